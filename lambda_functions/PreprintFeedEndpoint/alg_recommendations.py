@@ -1,7 +1,6 @@
-import boto3
+from storage import default_storage
 
-dynamodb = boto3.resource("dynamodb", region_name="us-east-2")
-alg_recs_table = dynamodb.Table("alg_recs")
+storage = default_storage()
 
 SKYGEST_TEAM_USERS = [
     'did:plc:kkhfvbrf4me4ogph35hjx3zc',
@@ -15,12 +14,10 @@ def get_alg_recs(user_did):
     if user_did not in SKYGEST_TEAM_USERS:
         return []
    
-    response = alg_recs_table.get_item(
-        Key={
+    item = storage.get_item("alg_recs", {
             "user_did": user_did
-        }
-    )
-    if 'Item' not in response:
+        })
+    if item is None:
         return None
-    
-    return response.get("Item")['recs']
\ No newline at end of file
+
+    return item['recs']
\ No newline at end of file
@@ -5,8 +5,9 @@ import traceback
 import os
 from datetime import datetime, timezone
 from auth import AuthorizationError, validate_auth
-from recommendation_generation import get_recommendations, get_agg_feed
+from recommendation_generation import get_recommendations, get_agg_feed, get_trending_feed
 from alg_recommendations import get_alg_recs
+from tombstones import drop_deleted
 
 CURSOR_EOF = 'eof'
 
@@ -26,6 +27,7 @@ FIXED_POSTS = {
 }
 
 ALG_FEED_DID = os.environ.get('ALG_FEED_DID')
+TRENDING_FEED_DID = os.environ.get('TRENDING_FEED_DID')
 
 logger.info('Finished setting up')
 
@@ -103,6 +105,11 @@ def serve_recommendations(event, context):
     if cursor == CURSOR_EOF:
         return format_response(CURSOR_EOF, [])
 
+    # the trending feed is the same for every viewer, so it is served without authentication
+    if TRENDING_FEED_DID and event['queryStringParameters'].get('feed') == TRENDING_FEED_DID:
+        trending_feed, return_cursor = get_trending_feed(cursor, limit)
+        return format_response(return_cursor or CURSOR_EOF, drop_deleted(trending_feed, logger))
+
     # authenticate user
     try:
         viewer = validate_auth(event)
@@ -112,7 +119,7 @@ def serve_recommendations(event, context):
             rec_posts = [FIXED_POSTS['auth']]
             agg_feed, return_cursor = get_agg_feed(cursor, limit)
             if agg_feed:
-                rec_posts.extend(agg_feed)
+                rec_posts.extend(drop_deleted(agg_feed, logger))
 
             return format_response(return_cursor, rec_posts)
         logger.info('Authenticated successfully')
@@ -133,11 +140,14 @@ def serve_recommendations(event, context):
         }
     else:
         if event['queryStringParameters']['feed'] == ALG_FEED_DID:
-            return format_response(CURSOR_EOF, get_alg_recs(viewer))
+            return format_response(CURSOR_EOF, drop_deleted(get_alg_recs(viewer) or [], logger))
         
     try:
         logger.info("Getting posts from recommendations database")
-        rec_posts, return_cursor, default_from, new_user = get_recommendations(viewer, cursor, limit, logger)
+        feed = event['queryStringParameters'].get('feed')
+        rec_posts, return_cursor, default_from, new_user = get_recommendations(viewer, cursor, limit, logger, feed)
+        # the lists were computed before their posts' latest deletions
+        rec_posts = drop_deleted(rec_posts, logger)
         logger.info(f"Got {len(rec_posts)} posts from recommendations database")
     
         # send the "wait a moment" post while recommendations are being generated
@@ -1,24 +1,34 @@
-import boto3
 import json
 import time
 import random
 import os
+from storage import default_storage
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-recommendations_table = dynamodb.Table('recommendations')
-users_table = dynamodb.Table('users')
+storage = default_storage()
 
 FOLLOW_RECOMMENDER_NAME = 'recent-following-posts'
 FOLLOW_RECOMMENDER_NAME_REPOSTS = 'recent-following-reposts'
 FOLLOW_RECOMMENDER_NAME_QUOTEPOSTS = 'recent-following-quoteposts'
 FOLLOW_RECOMMENDER_NAME_REPOSTS_QUOTEPOSTS = 'recent-following-repostsandquoteposts'
 
+# Maps per-discipline feed URIs to the tag their recommendations were filtered on, e.g.
+# DISCIPLINE_FEEDS={"at://did:plc:.../app.bsky.feed.generator/medical": "discipline:medical"}
+DISCIPLINE_FEEDS = json.loads(os.environ.get('DISCIPLINE_FEEDS', '{}'))
+
 AGGREGATE_FEED_ID = 'aggregate_feed'
 
+# Each ingestion worker publishes its trending posts and papers to this partition (see server/trending.py)
+TRENDING_FEED_ID = 'trending_feed'
+TRENDING_WINDOW = os.environ.get('TRENDING_WINDOW', 'day')
+# Lists not republished for this long (seconds) are from a worker that stopped, and are ignored
+TRENDING_MAX_AGE = int(os.environ.get('TRENDING_MAX_AGE', 3600))
+
 FEED_LIMIT = 5000
 NO_DEFAULT = -1
 
-def get_recommender(user_did):
+def get_recommender(user_did, feed=None):
+    if feed in DISCIPLINE_FEEDS:
+        return f'{FOLLOW_RECOMMENDER_NAME}:{DISCIPLINE_FEEDS[feed]}'
     if (
         user_did == os.environ.get('BETA_TESTER_1') or
         user_did == os.environ.get('BETA_TESTER_2')
@@ -34,17 +44,51 @@ def get_subset_recs(recs, cursor, limit):
         return recs[cursor:], None
 
 def get_agg_feed(cursor, limit):
-    response= recommendations_table.get_item(Key={
+    item = storage.get_item('recommendations', {
             'user_did': AGGREGATE_FEED_ID,
             'recommender': AGGREGATE_FEED_ID
         })
 
-    if response and response.get('Item'):
-        recs = response['Item']['recommendations']
+    if item:
+        recs = item['recommendations']
         return get_subset_recs(recs, cursor, limit)
     else:
         return None, None
 
+def get_trending_feed(cursor, limit, window=TRENDING_WINDOW):
+    """
+    Ranks the trending posts by summing every worker's decayed scores, decayed again to now. A paper
+    appears once, as its highest scoring post, with the score of all its posts combined.
+    """
+    items = storage.query('recommendations', TRENDING_FEED_ID)
+    now = time.time()
+
+    post_scores, post_papers, paper_scores, paper_posts = {}, {}, {}, {}
+    for item in items:
+        age = now - float(item['published_at'])
+        lists = item['windows'].get(window)
+        if age > TRENDING_MAX_AGE or not lists:
+            continue
+        decay = 2.0 ** -(age / float(lists['half_life']))
+        for uri, score, paper_key in lists['posts']:
+            post_scores[uri] = post_scores.get(uri, 0.0) + float(score) * decay
+            if paper_key:
+                post_papers[uri] = paper_key
+        for paper_key, score, uri in lists['papers']:
+            paper_scores[paper_key] = paper_scores.get(paper_key, 0.0) + float(score) * decay
+            paper_posts.setdefault(paper_key, uri)
+
+    # a paper's post is its best scoring post across workers, when any of them ranked it
+    for uri, score in sorted(post_scores.items(), key=lambda post: post[1]):
+        if uri in post_papers:
+            paper_posts[post_papers[uri]] = uri
+
+    ranked = [(score, paper_posts[paper_key]) for paper_key, score in paper_scores.items()]
+    ranked.extend((score, uri) for uri, score in post_scores.items() if post_papers.get(uri) not in paper_scores)
+    ranked.sort(reverse=True)
+    recs = list(dict.fromkeys(uri for _, uri in ranked))[:FEED_LIMIT]
+    return get_subset_recs(recs, cursor, limit)
+
 def user_is_active(item, logger):
     if 'deactivated' not in item:
         return True
@@ -55,20 +99,7 @@ def user_is_active(item, logger):
 
 def get_all_users(logger):
     logger.info('Getting all users')
-    items = []
-    response = users_table.scan(
-        ProjectionExpression='user_did,deactivated',
-    )
-    items.extend(response['Items'])
-
-    # Handle pagination only if we don't have enough items
-    while 'LastEvaluatedKey' in response:
-        response = users_table.scan(
-                ProjectionExpression='user_did,deactivated',
-                ExclusiveStartKey=response['LastEvaluatedKey']
-                #Limit=batch_size
-            )
-        items.extend(response['Items'])
+    items = list(storage.scan('users', attributes=['user_did', 'deactivated']))
 
     users = [item['user_did'] for item in items if user_is_active(item, logger)]
     inactive_users = [item['user_did'] for item in items if not user_is_active(item, logger)]
@@ -77,20 +108,18 @@ def get_all_users(logger):
 
     return users
 
-def get_recommendations(user_did, cursor, limit, logger):
+def get_recommendations(user_did, cursor, limit, logger, feed=None):
     logger.info(f'Getting {limit} recommendations for user {user_did}')
 
-    response = recommendations_table.get_item(Key={
+    item = storage.get_item('recommendations', {
         'user_did': user_did,
-        'recommender': get_recommender(user_did)
+        'recommender': get_recommender(user_did, feed)
     })
 
     # check if this is a new user
-    if not response.get('Item'):
+    if not item:
         return [], None, NO_DEFAULT, True
 
-    # parse response
-    item = response.get('Item')
     recs = item['recommendations']
     default_from = item.get('default_from', NO_DEFAULT)
 
@@ -0,0 +1,109 @@
+import hashlib
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from storage import default_storage
+
+# Deleted paper posts are in the tombstones table, written by the ingestion workers: partition 'day',
+# sort key 'sk' = deletion time|URI
+storage = default_storage()
+
+# Deletions older than this many days are not checked (feeds are regenerated well within it)
+TOMBSTONE_DAYS = int(os.environ.get('TOMBSTONE_DAYS', 30))
+# How often (seconds) a warm container reads the deletions since it last looked
+TOMBSTONE_REFRESH = int(os.environ.get('TOMBSTONE_REFRESH', 30))
+# How far (seconds) behind the last sort key read a refresh reads again: the workers buffer and
+# retry their writes, so a tombstone can land after ones deleted later than it
+TOMBSTONE_LATE_WINDOW = int(os.environ.get('TOMBSTONE_LATE_WINDOW', 300))
+# False positive rate of the filter of older days (a live post wrongly dropped)
+BLOOM_ERROR_RATE = 1e-4
+
+# Today's and yesterday's deletions are kept exactly, with the last sort key read from each day,
+# so a refresh only reads the ones since TOMBSTONE_LATE_WINDOW before it (the set drops the ones
+# read before). Days before that no longer change: they are read once per container (and day)
+# into a Bloom filter.
+RECENT_DAYS = 2
+
+class BloomFilter:
+    def __init__(self, n_items, error_rate=BLOOM_ERROR_RATE):
+        n_items = max(n_items, 1)
+        self.n_bits = max(64, int(-n_items * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / n_items * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, step = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+_recent = {}         # day -> set of deleted post URIs
+_recent_cursor = {}  # day -> last sort key read
+_older = None        # Bloom filter of the days before the recent ones
+_older_day = None    # the day _older was built on
+_refreshed_at = 0
+
+def _query_day(day, after=None):
+    """The (sort key, post URI) of a day's tombstones, only those after a sort key if given"""
+    for item in storage.query('tombstones', day, after=after or None, attributes=['sk', 'post_uri']):
+        yield item['sk'], item['post_uri']
+
+def _rewound(cursor):
+    """The sort key TOMBSTONE_LATE_WINDOW seconds before a sort key's deletion time"""
+    if not cursor:
+        return None
+    deleted_at = datetime.fromisoformat(cursor.split('|', 1)[0])
+    return (deleted_at - timedelta(seconds=TOMBSTONE_LATE_WINDOW)).isoformat()
+
+def _days(today, start, stop):
+    return [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(start, stop)]
+
+def refresh(logger):
+    """Reads new deletions, at most every TOMBSTONE_REFRESH seconds"""
+    global _older, _older_day, _refreshed_at
+    if time.time() - _refreshed_at < TOMBSTONE_REFRESH:
+        return
+    _refreshed_at = time.time()
+    today = datetime.now(timezone.utc)
+
+    recent_days = _days(today, 0, RECENT_DAYS)
+    for day in list(_recent):
+        if day not in recent_days:
+            del _recent[day]
+            _recent_cursor.pop(day, None)
+    for day in recent_days:
+        uris = _recent.setdefault(day, set())
+        for sk, post_uri in _query_day(day, _rewound(_recent_cursor.get(day))):
+            uris.add(post_uri)
+            _recent_cursor[day] = max(sk, _recent_cursor.get(day, ''))
+
+    if _older_day != recent_days[0]:
+        uris = [post_uri for day in _days(today, RECENT_DAYS, TOMBSTONE_DAYS) for _, post_uri in _query_day(day)]
+        _older = BloomFilter(len(uris))
+        for post_uri in uris:
+            _older.add(post_uri)
+        _older_day = recent_days[0]
+        logger.info(f'Loaded {len(uris)} tombstones of the last {TOMBSTONE_DAYS} days')
+
+def is_deleted(post_uri):
+    return any(post_uri in uris for uris in _recent.values()) or (_older is not None and post_uri in _older)
+
+def drop_deleted(posts, logger):
+    """Removes deleted posts from a page (of post URIs, or of {'post': ...} dicts such as reposts)"""
+    try:
+        refresh(logger)
+    except Exception as e:
+        # serve the page unfiltered rather than fail it
+        logger.error(f'Error refreshing tombstones: {str(e)}')
+    kept = [post for post in posts if not is_deleted(post['post'] if isinstance(post, dict) else post)]
+    if len(kept) < len(posts):
+        logger.info(f'Dropped {len(posts) - len(kept)} deleted posts')
+    return kept
@@ -1,9 +1,9 @@
 import boto3
 import time
 import os
+from storage import default_storage
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
+storage = default_storage()
 
 sqs = boto3.resource('sqs')
 postprocess_queue = sqs.Queue(os.environ['POSTPROCESS_QUEUE'])
@@ -22,15 +22,7 @@ def check_deactivated(content):
 
 def handle_deactivated(user_did, logger):
     logger.error(f'Deactivating user {user_did}')
-    users_table.update_item(
-        Key={
-            'user_did': user_did
-        },
-        UpdateExpression="SET deactivated=:a",
-        ExpressionAttributeValues={
-            ':a': True
-        }
-    )
+    storage.update_item('users', {'user_did': user_did}, set={'deactivated': True})
     logger.info('Viewer is deactivated')
 
 def handle_upstream_failure(user_did, message, logger):
@@ -1,27 +1,23 @@
 import json
 import os
 import logging
-import boto3
 import traceback
 from datetime import datetime, timezone
 from bluesky_requests import get_profile
+from storage import default_storage
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
-access_agg_table = dynamodb.Table('user_accesses_agg')
-access_table = dynamodb.Table('user_accesses')
+storage = default_storage()
 
 CONSENT_ACTIVE = True
 
 def update_access_agg_db(cursor, access_date, user_did):
     if cursor == 0:
-        past_user_info = access_agg_table.get_item(Key={'user_did': user_did})
-        if past_user_info and past_user_info.get('Item'):
+        item = storage.get_item('user_accesses_agg', {'user_did': user_did})
+        if item:
             logger.info('User already in database')
-            item = past_user_info.get('Item')
             n_accesses = item.get('access_count', 0)
             n_consent = item.get('consent_accesses', 0)
         else:
@@ -30,7 +26,7 @@ def update_access_agg_db(cursor, access_date, user_did):
 
         consent_accesses = n_consent + 1 if CONSENT_ACTIVE else 0
 
-        access_agg_table.put_item(Item={
+        storage.put_item('user_accesses_agg', {
             'user_did': user_did,
             'last_access': access_date,
             'access_count': n_accesses + 1,
@@ -42,13 +38,12 @@ def update_user_db(message, user_did):
     # api call to get user handle
     profile_response = get_profile(user_did)
 
-    dynamo_response = users_table.get_item(Key={'user_did': user_did})
-    user_item = dynamo_response.get('Item', None)
+    user_item = storage.get_item('users', {'user_did': user_did})
 
     # if the user is not already in the database, add to the database (if active)
     if not user_item:
         if profile_response:
-            users_table.put_item(Item={
+            storage.put_item('users', {
                 'user_did': user_did, 
                 'user_display_name': profile_response.get('displayName', None),
                 'user_handle': profile_response['handle'],
@@ -64,28 +59,21 @@ def update_user_db(message, user_did):
     # otherwise, update user in the database
     if profile_response:
         # user is active
-        users_table.update_item(Key={'user_did': user_did},
-            UpdateExpression='SET user_display_name = :val1, user_handle = :val2, deactivated = :val3',
-            ExpressionAttributeValues={
-                ':val1': profile_response.get('displayName', None),
-                ':val2': profile_response['handle'],
-                ':val3': False
+        storage.update_item('users', {'user_did': user_did}, set={
+                'user_display_name': profile_response.get('displayName', None),
+                'user_handle': profile_response['handle'],
+                'deactivated': False
             })
     else:
         # user is deactivated
-        users_table.update_item(
-            Key={'user_did': user_did}, 
-            UpdateExpression='SET deactivated = :val',
-            ExpressionAttributeValues={':val': True}
-        )
+        storage.update_item('users', {'user_did': user_did}, set={'deactivated': True})
 
     logger.info('Finished updating user database')
 
 
 def update_access_db(user_did, recs, access_date, default_from, cursors):
     # check that the user has not contacted us asking for removal
-    response = users_table.get_item(Key={'user_did': user_did})
-    user_item = response.get('Item', None)
+    user_item = storage.get_item('users', {'user_did': user_did})
     research_remove = user_item.get('research_remove', False)
 
     access_date_save = access_date if access_date else datetime.now(timezone.utc).isoformat()
@@ -93,7 +81,7 @@ def update_access_db(user_did, recs, access_date, default_from, cursors):
 
     if not research_remove:
         # log the access in the access DynamoDB table
-        access_table.put_item(Item={
+        storage.put_item('user_accesses', {
             'user_did': user_did,
             'access_date': access_date if access_date else datetime.now(timezone.utc).isoformat(),
             'access_date_day': access_date_day, 
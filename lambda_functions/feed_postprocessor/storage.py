@@ -0,0 +1,702 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import random
+import zlib
+from decimal import Decimal
+
+# Table storage behind one interface, with DynamoDB, SQLite and in-memory backends, so the same code
+# runs against the deployed tables or locally (benchmarks, backfill dry runs, development). The backend
+# is chosen by STORAGE_BACKEND ('dynamodb', the default, 'sqlite' or 'memory'); the SQLite backend keeps
+# its tables in STORAGE_SQLITE_FILE.
+#
+# This file is self-contained, and copied as is into the Lambda functions that use it: keep the copies
+# identical (preprint_feed/tests/test_storage.py checks them, and the local backends' semantics of
+# conditional writes and queries, which follow DynamoDB's). Items are plain dicts, as the DynamoDB resource API returns them, and every backend returns
+# numbers as Decimal. Tables are named as in DynamoDB; their keys and the secondary indexes that are
+# queried are described in TABLE_KEYS and INDEXES.
+
+REGION = 'us-east-2'
+
+# Key attribute names of each table (partition key, then sort key if any). A <TABLE>_TABLE_KEY
+# environment variable (comma-separated) overrides them.
+TABLE_KEYS = {
+    'paper_posts': ['at_uri'],
+    'paper_index': ['paper_key', 'at_uri'],
+    'recommendations': ['user_did', 'recommender'],
+    'users': ['user_did'],
+    'user_accesses_agg': ['user_did'],
+    'alg_recs': ['user_did'],
+    'follows': ['user_did', 'rkey'],
+    'tombstones': ['day', 'sk'],
+    'author_activity': ['author_did']
+}
+
+# Keys for the local backends of tables created outside this code; DynamoDB describes these tables
+# (once per process) when their key is needed, as the deployed keys may differ
+LOCAL_TABLE_KEYS = {
+    'interactions': ['user_did', 'post_uri'],
+    'reposts': ['user_did', 'post_uri'],
+    'quoteposts': ['at_uri'],
+    'user_accesses': ['user_did', 'access_date'],
+    'counterfactual_recs': ['uuid']
+}
+
+# Secondary indexes used by queries: table -> index name -> (partition key, sort key). The ones on the
+# integer timestamps (see server/timestamps.py) are used once created in DynamoDB and backfilled.
+INDEXES = {
+    'paper_posts': {
+        'AuthorDID-CreatedDate-index': ('AuthorDID', 'CreatedDate'),
+        'AuthorDID-CreatedTs-index': ('AuthorDID', 'CreatedTs')
+    },
+    'reposts': {
+        'user_did-created_at-index': ('user_did', 'created_at'),
+        'user_did-created_ts-index': ('user_did', 'created_ts')
+    },
+    'quoteposts': {
+        'user_did-created_date-index': ('user_did', 'created_date'),
+        'user_did-created_ts-index': ('user_did', 'created_ts')
+    }
+}
+
+# Connections DynamoDB clients keep open for reuse: at least as many as the threads that share one
+MAX_CONNECTIONS = int(os.environ.get('DYNAMODB_MAX_CONNECTIONS', 10))
+
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+def is_throttling(error):
+    """Whether an exception raised by a backend is DynamoDB throttling"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+def match_condition(if_match, absent_key=None):
+    """
+    The ConditionExpression arguments of a DynamoDB write that requires the stored item to have the
+    values of if_match ({attribute: value}, None for an absent attribute) and, given absent_key (the
+    partition key attribute), that no item has the written item's key
+    """
+    names, values, conditions = {}, {}, []
+    if absent_key:
+        names['#key'] = absent_key
+        conditions.append('attribute_not_exists(#key)')
+    for i, (attribute, value) in enumerate((if_match or {}).items()):
+        names[f'#c{i}'] = attribute
+        if value is None:
+            conditions.append(f'attribute_not_exists(#c{i})')
+        else:
+            values[f':c{i}'] = value
+            conditions.append(f'#c{i} = :c{i}')
+    kwargs = {'ConditionExpression': ' AND '.join(conditions), 'ExpressionAttributeNames': names}
+    if values:
+        kwargs['ExpressionAttributeValues'] = values
+    return kwargs
+
+def _configured_key(table):
+    configured = os.environ.get(f'{table.upper()}_TABLE_KEY')
+    return configured.split(',') if configured else None
+
+class Storage:
+    """
+    The table operations the feed uses. put_items and delete_items may be buffered (see flush);
+    every other write is applied before it returns.
+    """
+    def key_attributes(self, table):
+        """The key attribute names of a table"""
+        return _configured_key(table) or TABLE_KEYS.get(table) or LOCAL_TABLE_KEYS[table]
+
+    def item_key(self, table, item):
+        return {attribute: item[attribute] for attribute in self.key_attributes(table)}
+
+    def get_item(self, table, key):
+        """The item with the given key, or None"""
+        raise NotImplementedError
+
+    def get_items(self, table, keys):
+        """The items with the given keys that exist, in no particular order"""
+        raise NotImplementedError
+
+    def put_item(self, table, item, if_absent=False, if_match=None):
+        """
+        Writes an item; with if_absent, only if no item has its key, and with if_match ({attribute: value}),
+        only if the stored item has those values (None for an attribute that is absent, as it is when no
+        item has the key). Returns whether it was written.
+        """
+        raise NotImplementedError
+
+    def put_items(self, table, items, if_match=None):
+        """Writes items; with if_match, each only if the stored item has those values (see put_item)"""
+        raise NotImplementedError
+
+    def delete_item(self, table, key):
+        raise NotImplementedError
+
+    def delete_items(self, table, keys):
+        raise NotImplementedError
+
+    def update_item(self, table, key, set=None, add=None, must_exist=False, remove=None, unless=None):
+        """
+        Sets attributes to values, adds numbers to attributes (starting from 0) and removes the
+        attributes in remove, atomically. With must_exist, a missing item is left alone, and with
+        unless ({attribute: value}), so is an item that has any of those values; False is returned
+        when the item is left alone, otherwise True.
+        """
+        raise NotImplementedError
+
+    def query(self, table, value, index=None, limit=None, newest_first=False, after=None, exclude=None, attributes=None):
+        """
+        The items whose partition key (the table's, or the index's) is value, in sort key order (reversed
+        with newest_first), only those with a sort key greater than after if given. exclude maps attribute
+        names to values that drop an item. As with DynamoDB, limit applies before exclude.
+        """
+        raise NotImplementedError
+
+    def scan_page(self, table, start=None, limit=None, segment=None, total_segments=None, attributes=None):
+        """One page of a (segment of a) scan: (items, start of the next page, or None at the end)"""
+        raise NotImplementedError
+
+    def scan(self, table, attributes=None):
+        """Every item of a table"""
+        start = None
+        while True:
+            items, start = self.scan_page(table, start=start, attributes=attributes)
+            yield from items
+            if start is None:
+                return
+
+    def flush(self):
+        """Applies buffered writes"""
+
+    def _partition_and_sort(self, table, index):
+        if index:
+            return INDEXES[table][index]
+        key = self.key_attributes(table)
+        return key[0], key[1] if len(key) > 1 else None
+
+class DynamoStorage(Storage):
+    """
+    The deployed DynamoDB tables. writer, if given, is a function returning an object with put(table,
+    item, if_match=None), delete(table, key) and flush() that buffers put_items and delete_items (e.g.
+    a batch writer shared by a process); otherwise they are written with the resource's batch_writer
+    (or, with if_match, one conditional PutItem each). Every other operation goes through one client,
+    so they can be made from any number of threads, sharing its pool of max_connections connections.
+    """
+    def __init__(self, region=REGION, writer=None, max_connections=MAX_CONNECTIONS):
+        import boto3
+        from boto3.dynamodb.conditions import Attr, Key
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+        self._Attr, self._Key, self._ClientError = Attr, Key, ClientError
+        self.resource = boto3.resource('dynamodb', region_name=region, config=Config(max_pool_connections=max_connections))
+        # thread-safe, unlike the resource and its tables, and converts Python values like them
+        self.client = self.resource.meta.client
+        self.writer = writer
+        self._tables = {}
+        self._described_keys = {}
+
+    def table(self, table):
+        if table not in self._tables:
+            self._tables[table] = self.resource.Table(table)
+        return self._tables[table]
+
+    def key_attributes(self, table):
+        configured = _configured_key(table)
+        if configured:
+            return configured
+        if table in TABLE_KEYS:
+            return TABLE_KEYS[table]
+        if table not in self._described_keys:
+            self._described_keys[table] = [key['AttributeName'] for key in self.table(table).key_schema]
+        return self._described_keys[table]
+
+    def _known_key(self, table):
+        # the key, if it is known without describing the table (to deduplicate a batch)
+        return _configured_key(table) or TABLE_KEYS.get(table) or self._described_keys.get(table)
+
+    def get_item(self, table, key):
+        return self.client.get_item(TableName=table, Key=key).get('Item')
+
+    def get_items(self, table, keys):
+        found = []
+        keys = list(keys)
+        for i in range(0, len(keys), 100):
+            request = {table: {'Keys': keys[i:i + 100]}}
+            attempt = 0
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                found.extend(response['Responses'].get(table, []))
+                request = response.get('UnprocessedKeys')
+                if request:
+                    attempt += 1
+                    time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 5)))
+        return found
+
+    def put_item(self, table, item, if_absent=False, if_match=None):
+        if not if_absent and not if_match:
+            self.client.put_item(TableName=table, Item=item)
+            return True
+        condition = match_condition(if_match, self.key_attributes(table)[0] if if_absent else None)
+        try:
+            self.client.put_item(TableName=table, Item=item, **condition)
+        except self._ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def put_items(self, table, items, if_match=None):
+        if self.writer:
+            writer = self.writer()
+            for item in items:
+                writer.put(table, item, if_match=if_match)
+            return
+        if if_match:
+            for item in items:
+                self.put_item(table, item, if_match=if_match)
+            return
+        with self.table(table).batch_writer(overwrite_by_pkeys=self._known_key(table)) as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    def delete_items(self, table, keys):
+        if self.writer:
+            writer = self.writer()
+            for key in keys:
+                writer.delete(table, key)
+            return
+        with self.table(table).batch_writer(overwrite_by_pkeys=self._known_key(table)) as batch:
+            for key in keys:
+                batch.delete_item(Key=key)
+
+    def delete_item(self, table, key):
+        self.client.delete_item(TableName=table, Key=key)
+
+    def update_item(self, table, key, set=None, add=None, must_exist=False, remove=None, unless=None):
+        names, values, clauses = {}, {}, []
+        for action, attributes in (('SET', set), ('ADD', add)):
+            if not attributes:
+                continue
+            terms = []
+            for attribute, value in attributes.items():
+                placeholder = f'a{len(names)}'
+                names[f'#{placeholder}'] = attribute
+                values[f':{placeholder}'] = value
+                terms.append(f'#{placeholder} = :{placeholder}' if action == 'SET' else f'#{placeholder} :{placeholder}')
+            clauses.append(f'{action} ' + ', '.join(terms))
+        if remove:
+            terms = []
+            for attribute in remove:
+                placeholder = f'a{len(names)}'
+                names[f'#{placeholder}'] = attribute
+                terms.append(f'#{placeholder}')
+            clauses.append('REMOVE ' + ', '.join(terms))
+
+        kwargs = {
+            'TableName': table,
+            'Key': key,
+            'UpdateExpression': ' '.join(clauses),
+            'ExpressionAttributeNames': names
+        }
+        conditions = []
+        if must_exist:
+            names['#key'] = self.key_attributes(table)[0]
+            conditions.append('attribute_exists(#key)')
+        for i, (attribute, value) in enumerate((unless or {}).items()):
+            names[f'#u{i}'] = attribute
+            values[f':u{i}'] = value
+            conditions.append(f'(attribute_not_exists(#u{i}) OR #u{i} <> :u{i})')
+        if conditions:
+            kwargs['ConditionExpression'] = ' AND '.join(conditions)
+        if values:
+            kwargs['ExpressionAttributeValues'] = values
+        try:
+            self.client.update_item(**kwargs)
+        except self._ClientError as e:
+            if conditions and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def _projection(self, attributes, kwargs):
+        if attributes:
+            kwargs['ProjectionExpression'] = ', '.join(f'#p{i}' for i in range(len(attributes)))
+            kwargs['ExpressionAttributeNames'] = {f'#p{i}': attribute for i, attribute in enumerate(attributes)}
+
+    def query(self, table, value, index=None, limit=None, newest_first=False, after=None, exclude=None, attributes=None):
+        partition, sort = self._partition_and_sort(table, index)
+        condition = self._Key(partition).eq(value)
+        if after is not None:
+            condition = condition & self._Key(sort).gt(after)
+        kwargs = {'TableName': table, 'KeyConditionExpression': condition, 'ScanIndexForward': not newest_first}
+        if index:
+            kwargs['IndexName'] = index
+        if limit:
+            kwargs['Limit'] = limit
+        if exclude:
+            for attribute, excluded in exclude.items():
+                condition = ~self._Attr(attribute).is_in(list(excluded))
+                kwargs['FilterExpression'] = kwargs['FilterExpression'] & condition if 'FilterExpression' in kwargs else condition
+        self._projection(attributes, kwargs)
+
+        items = []
+        while True:
+            response = self.client.query(**kwargs)
+            items.extend(response['Items'])
+            # a limited query is one page, as before
+            if limit or 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def scan_page(self, table, start=None, limit=None, segment=None, total_segments=None, attributes=None):
+        kwargs = {'TableName': table}
+        if start:
+            kwargs['ExclusiveStartKey'] = start
+        if limit:
+            kwargs['Limit'] = limit
+        if total_segments:
+            kwargs['Segment'] = segment
+            kwargs['TotalSegments'] = total_segments
+        self._projection(attributes, kwargs)
+        response = self.client.scan(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    def flush(self):
+        if self.writer:
+            self.writer().flush()
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not storable')
+
+def _dumps(value):
+    return json.dumps(value, default=_encode, separators=(',', ':'))
+
+def _loads(text):
+    return json.loads(text, parse_float=Decimal, parse_int=Decimal)
+
+def _stored(item):
+    """An item as it comes back from storage (numbers as Decimal, sets as lists), detached from the caller's"""
+    return _loads(_dumps(item))
+
+def _select(item, attributes):
+    return {attribute: item[attribute] for attribute in attributes if attribute in item} if attributes else item
+
+def _matches(item, if_match):
+    return not if_match or all((item or {}).get(attribute) == value for attribute, value in if_match.items())
+
+def _has_any(item, values):
+    return bool(item and values) and any(item.get(attribute) == value for attribute, value in values.items())
+
+def _updated(item, set, add, remove):
+    """A copy of an item with an update_item's changes applied"""
+    item = dict(item)
+    item.update(_stored(set or {}))
+    for attribute, value in (add or {}).items():
+        item[attribute] = item.get(attribute, 0) + Decimal(str(value))
+    for attribute in remove or ():
+        item.pop(attribute, None)
+    return item
+
+def _excluded(item, exclude):
+    return exclude and any(item.get(attribute) in excluded for attribute, excluded in exclude.items())
+
+def _sort_value(value):
+    # numbers before strings, as values of one attribute are of one type in practice
+    return (0, value, '') if isinstance(value, (int, float, Decimal)) else (1, 0, str(value))
+
+def _scan_segment(key_text, segment, total_segments):
+    # a stable hash, so that every process splits a table the same way
+    return total_segments is None or zlib.crc32(key_text.encode()) % total_segments == segment
+
+class SQLiteStorage(Storage):
+    """
+    Tables in one SQLite file: each holds its items as JSON, keyed by their key, with expression
+    indexes on the partition and sort keys of the table and of its INDEXES. Safe to share between
+    threads, and between processes (each opens its own connection).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self._created = set()
+
+    def _db(self):
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._connection.execute('PRAGMA journal_mode=wal')
+            self._connection.execute('PRAGMA synchronous=normal')
+            self._pid = os.getpid()
+            self._created = set()
+        return self._connection
+
+    def _table(self, table):
+        db = self._db()
+        if table not in self._created:
+            db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, item TEXT NOT NULL)')
+            orders = [self.key_attributes(table)]
+            orders.extend([partition, sort] for partition, sort in INDEXES.get(table, {}).values())
+            for attributes in orders:
+                columns = ', '.join(f"json_extract(item, '$.{attribute}')" for attribute in attributes)
+                db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{"_".join(attributes)}" ON "{table}" ({columns})')
+            self._created.add(table)
+        return db
+
+    def _key_text(self, table, item):
+        return _dumps([item[attribute] for attribute in self.key_attributes(table)])
+
+    def get_item(self, table, key):
+        with self._lock:
+            row = self._table(table).execute(f'SELECT item FROM "{table}" WHERE key = ?', (self._key_text(table, key),)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def get_items(self, table, keys):
+        key_texts = [self._key_text(table, key) for key in keys]
+        items = []
+        with self._lock:
+            db = self._table(table)
+            for i in range(0, len(key_texts), 500):
+                chunk = key_texts[i:i + 500]
+                rows = db.execute(f'SELECT item FROM "{table}" WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+                items.extend(_loads(row[0]) for row in rows)
+        return items
+
+    def put_item(self, table, item, if_absent=False, if_match=None):
+        if if_match:
+            return self._put_if_match(table, item, if_absent, if_match)
+        if not if_absent:
+            self.put_items(table, [item])
+            return True
+        with self._lock:
+            cursor = self._table(table).execute(f'INSERT OR IGNORE INTO "{table}" (key, item) VALUES (?, ?)',
+                                                (self._key_text(table, item), _dumps(item)))
+        return cursor.rowcount > 0
+
+    def _put_if_match(self, table, item, if_absent, if_match):
+        key_text = self._key_text(table, item)
+        with self._lock:
+            db = self._table(table)
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(f'SELECT item FROM "{table}" WHERE key = ?', (key_text,)).fetchone()
+                if (row and if_absent) or not _matches(_loads(row[0]) if row else None, if_match):
+                    db.execute('ROLLBACK')
+                    return False
+                db.execute(f'INSERT OR REPLACE INTO "{table}" (key, item) VALUES (?, ?)', (key_text, _dumps(item)))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return True
+
+    def _write(self, table, sql, rows):
+        """Runs a statement for every row, in one transaction"""
+        with self._lock:
+            db = self._table(table)
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.executemany(sql, rows)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def put_items(self, table, items, if_match=None):
+        if if_match:
+            for item in items:
+                self._put_if_match(table, item, False, if_match)
+            return
+        self._write(table, f'INSERT OR REPLACE INTO "{table}" (key, item) VALUES (?, ?)',
+                    [(self._key_text(table, item), _dumps(item)) for item in items])
+
+    def delete_items(self, table, keys):
+        self._write(table, f'DELETE FROM "{table}" WHERE key = ?', [(self._key_text(table, key),) for key in keys])
+
+    def delete_item(self, table, key):
+        self.delete_items(table, [key])
+
+    def update_item(self, table, key, set=None, add=None, must_exist=False, remove=None, unless=None):
+        key_text = self._key_text(table, key)
+        with self._lock:
+            db = self._table(table)
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(f'SELECT item FROM "{table}" WHERE key = ?', (key_text,)).fetchone()
+                item = _loads(row[0]) if row else None
+                if (item is None and must_exist) or _has_any(item, unless):
+                    db.execute('ROLLBACK')
+                    return False
+                item = _updated(item or _stored(key), set, add, remove)
+                db.execute(f'INSERT OR REPLACE INTO "{table}" (key, item) VALUES (?, ?)', (key_text, _dumps(item)))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return True
+
+    def query(self, table, value, index=None, limit=None, newest_first=False, after=None, exclude=None, attributes=None):
+        partition, sort = self._partition_and_sort(table, index)
+        sql = f"SELECT item FROM \"{table}\" WHERE json_extract(item, '$.{partition}') = ?"
+        params = [_encode(value) if isinstance(value, Decimal) else value]
+        if sort:
+            # items without the index's sort key are not in the index
+            sql += f" AND json_extract(item, '$.{sort}') IS NOT NULL"
+            if after is not None:
+                sql += f" AND json_extract(item, '$.{sort}') > ?"
+                params.append(_encode(after) if isinstance(after, Decimal) else after)
+            sql += f" ORDER BY json_extract(item, '$.{sort}') {'DESC' if newest_first else 'ASC'}"
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._table(table).execute(sql, params).fetchall()
+        items = (_loads(row[0]) for row in rows)
+        return [_select(item, attributes) for item in items if not _excluded(item, exclude)]
+
+    def scan_page(self, table, start=None, limit=None, segment=None, total_segments=None, attributes=None):
+        limit = limit or 1000
+        items = []
+        last_key = start
+        with self._lock:
+            db = self._table(table)
+            while len(items) < limit:
+                rows = db.execute(f'SELECT key, item FROM "{table}" WHERE key > ? ORDER BY key LIMIT ?',
+                                  (last_key or '', limit)).fetchall()
+                if not rows:
+                    return items, None
+                for key_text, item in rows:
+                    last_key = key_text
+                    if _scan_segment(key_text, segment, total_segments):
+                        items.append(_select(_loads(item), attributes))
+        return items, last_key
+
+def _sort_key(item, sort):
+    return _sort_value(item.get(sort))
+
+class MemoryStorage(Storage):
+    """Tables as dicts in this process, with a partition lookup per table and index. For tests and benchmarks."""
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tables = {}      # table -> {key text: item}
+        self._partitions = {}  # (table, partition attribute) -> {partition value: set of key texts}
+
+    def _key_text(self, table, item):
+        return _dumps([item[attribute] for attribute in self.key_attributes(table)])
+
+    def _partition_attributes(self, table):
+        attributes = [self.key_attributes(table)[0]]
+        attributes.extend(partition for partition, _ in INDEXES.get(table, {}).values())
+        return set(attributes)
+
+    def _unindex(self, table, key_text, item):
+        for attribute in self._partition_attributes(table):
+            if attribute in item:
+                self._partitions.get((table, attribute), {}).get(_dumps(item[attribute]), set()).discard(key_text)
+
+    def get_item(self, table, key):
+        with self._lock:
+            item = self._tables.get(table, {}).get(self._key_text(table, key))
+        return _stored(item) if item is not None else None
+
+    def get_items(self, table, keys):
+        with self._lock:
+            rows = self._tables.get(table, {})
+            return [_stored(rows[key_text]) for key_text in (self._key_text(table, key) for key in keys) if key_text in rows]
+
+    def put_item(self, table, item, if_absent=False, if_match=None):
+        with self._lock:
+            stored = self._tables.get(table, {}).get(self._key_text(table, item))
+            if (if_absent and stored is not None) or not _matches(stored, if_match):
+                return False
+            self.put_items(table, [item])
+        return True
+
+    def put_items(self, table, items, if_match=None):
+        if if_match:
+            for item in items:
+                self.put_item(table, item, if_match=if_match)
+            return
+        with self._lock:
+            rows = self._tables.setdefault(table, {})
+            for item in items:
+                item = _stored(item)
+                key_text = self._key_text(table, item)
+                if key_text in rows:
+                    self._unindex(table, key_text, rows[key_text])
+                rows[key_text] = item
+                for attribute in self._partition_attributes(table):
+                    if attribute in item:
+                        self._partitions.setdefault((table, attribute), {}).setdefault(_dumps(item[attribute]), set()).add(key_text)
+
+    def delete_items(self, table, keys):
+        with self._lock:
+            rows = self._tables.get(table, {})
+            for key in keys:
+                key_text = self._key_text(table, key)
+                item = rows.pop(key_text, None)
+                if item is not None:
+                    self._unindex(table, key_text, item)
+
+    def delete_item(self, table, key):
+        self.delete_items(table, [key])
+
+    def update_item(self, table, key, set=None, add=None, must_exist=False, remove=None, unless=None):
+        with self._lock:
+            item = self._tables.get(table, {}).get(self._key_text(table, key))
+            if (item is None and must_exist) or _has_any(item, unless):
+                return False
+            self.put_items(table, [_updated(item or _stored(key), set, add, remove)])
+        return True
+
+    def query(self, table, value, index=None, limit=None, newest_first=False, after=None, exclude=None, attributes=None):
+        partition, sort = self._partition_and_sort(table, index)
+        with self._lock:
+            rows = self._tables.get(table, {})
+            key_texts = self._partitions.get((table, partition), {}).get(_dumps(value), ())
+            items = [_stored(rows[key_text]) for key_text in key_texts]
+        if sort:
+            items = [item for item in items if sort in item]
+            if after is not None:
+                items = [item for item in items if _sort_value(item[sort]) > _sort_value(after)]
+            items.sort(key=lambda item: _sort_key(item, sort), reverse=newest_first)
+        if limit:
+            items = items[:limit]
+        return [_select(item, attributes) for item in items if not _excluded(item, exclude)]
+
+    def scan_page(self, table, start=None, limit=None, segment=None, total_segments=None, attributes=None):
+        with self._lock:
+            rows = self._tables.get(table, {})
+            key_texts = sorted(key_text for key_text in rows if (start is None or key_text > start)
+                               and _scan_segment(key_text, segment, total_segments))
+            page = key_texts[:limit] if limit else key_texts
+            items = [_select(_stored(rows[key_text]), attributes) for key_text in page]
+        return items, (page[-1] if limit and len(key_texts) > limit else None)
+
+def open_storage(backend=None, path=None, **options):
+    """
+    The storage backend named by backend, or else by STORAGE_BACKEND. Options are passed to the
+    backend (e.g. writer for DynamoDB); path is the SQLite file, by default STORAGE_SQLITE_FILE.
+    """
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'dynamodb')
+    if backend == 'dynamodb':
+        return DynamoStorage(**options)
+    if backend == 'sqlite':
+        return SQLiteStorage(path or os.environ.get('STORAGE_SQLITE_FILE', 'storage.db'))
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f'Unknown storage backend {backend!r}')
+
+_default = None
+
+def default_storage():
+    """
+    The backend configured by the environment, opened once per process and shared by the modules
+    that use it (so that they see the same tables with the in-memory backend)
+    """
+    global _default
+    if _default is None:
+        _default = open_storage()
+    return _default
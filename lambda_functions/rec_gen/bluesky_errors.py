@@ -2,9 +2,9 @@ import boto3
 import time
 import json
 import os
+from storage import default_storage
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
+storage = default_storage()
 
 sqs = boto3.resource('sqs')
 recgen_queue = sqs.Queue(os.environ.get('RECGEN_QUEUE'))
@@ -37,15 +37,7 @@ def check_suspended_http(error, message):
 
 def handle_deactivated(user_did, logger):
     logger.error(f'Deactivating user {user_did}')
-    users_table.update_item(
-        Key={
-            'user_did': user_did
-        },
-        UpdateExpression="SET deactivated=:a",
-        ExpressionAttributeValues={
-            ':a': True
-        }
-    )
+    storage.update_item('users', {'user_did': user_did}, set={'deactivated': True})
     logger.info('Viewer is deactivated')
 
 def handle_upstream_failure(user_did, logger, retry_n):
@@ -1,10 +1,11 @@
 import requests
-from bluesky_errors import handle_error_http
+from bluesky_errors import handle_error_http, check_deactivated_http
 import logging
 import traceback
 
 PUBLIC_API_HOSTNAME = "https://public.api.bsky.app"
 BASE_URL = PUBLIC_API_HOSTNAME + "/xrpc"
+PLC_DIRECTORY = "https://plc.directory"
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -36,3 +37,49 @@ def get_follows(actor, retry_n, cursor, limit=100):
         logger.error(f"Unhandled recommendation generation error: Unhandled exception in API call to getFollows for user {actor}")
         logger.error(f"Unhandled recommendation generation error: Traceback: {traceback.format_exc()}")
         raise e
+
+def is_deactivated(actor):
+    """Whether the AppView reports an account as deactivated or gone; False if it cannot tell"""
+    endpoint = BASE_URL + '/app.bsky.actor.getProfile'
+    try:
+        response = requests.get(endpoint, params={"actor": actor}, timeout=10)
+        if response.status_code == 200:
+            return False
+        response_json = response.json()
+    except Exception as e:
+        logger.error(f'Error checking the account of {actor}: {str(e)}')
+        return False
+    return check_deactivated_http(response_json.get('error', None), response_json.get('message', None) or '')
+
+def resolve_pds(did):
+    """The endpoint of the PDS hosting a DID's repo, from its DID document, or None"""
+    if did.startswith('did:plc:'):
+        url = f'{PLC_DIRECTORY}/{did}'
+    elif did.startswith('did:web:'):
+        url = f'https://{did[len("did:web:"):]}/.well-known/did.json'
+    else:
+        return None
+    response = requests.get(url, timeout=10)
+    if response.status_code != 200:
+        logger.error(f'Could not resolve {did}: HTTP {response.status_code}')
+        return None
+    for service in response.json().get('service', []):
+        if service.get('id', '').endswith('#atproto_pds'):
+            return service.get('serviceEndpoint')
+    return None
+
+def list_follow_records(pds, repo, cursor, limit=100):
+    """One page of the app.bsky.graph.follow records in a repo: (records, cursor), or (None, None) on error"""
+    endpoint = pds.rstrip('/') + '/xrpc/com.atproto.repo.listRecords'
+    params = {
+        "repo": repo,
+        "collection": "app.bsky.graph.follow",
+        "cursor": cursor,
+        "limit": limit
+    }
+    response = requests.get(endpoint, params=params, timeout=10)
+    if response.status_code != 200:
+        logger.error(f'Error listing follow records of {repo}: HTTP {response.status_code}')
+        return None, None
+    response_json = response.json()
+    return response_json.get('records', []), response_json.get('cursor', None)
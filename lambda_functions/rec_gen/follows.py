@@ -1,28 +1,124 @@
 import traceback
-from bluesky_requests import get_follows
-import boto3
+from datetime import datetime, timezone
+from bluesky_requests import get_follows, resolve_pds, list_follow_records, is_deactivated
+from bluesky_errors import handle_deactivated
+from storage import default_storage
 import logging
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
+# Follow records of our users are in the follows table (user_did, rkey -> subject_did), kept up to
+# date by the ingestion workers from the firehose, after a one-time bootstrap from the user's repo
+storage = default_storage()
 
 MAX_FOLLOWS = 5000
 
+# Item marking a user's follows as bootstrapped; record keys are TIDs, so it cannot clash with one
+BOOTSTRAP_RKEY = '#bootstrap'
+
+# Record key prefix of the deletion marks the ingestion workers leave for unfollows (see
+# preprint_feed/server/database_dynamo.py), which expire after a few days
+DELETED_FOLLOW_PREFIX = '#deleted|'
+
+def drop_deleted_follows(viewer, items, since=None):
+    """
+    The follow items among a partition's items, newest (highest TID record key) first, without the
+    ones with a deletion mark (made at or after since, if given). Those were written again by a
+    bootstrap after they were deleted, and are deleted from the table again.
+    """
+    deleted = {item['rkey'][len(DELETED_FOLLOW_PREFIX):] for item in items if item['rkey'].startswith(DELETED_FOLLOW_PREFIX)
+               and (since is None or item.get('deleted_at', '') >= since)}
+    follows = [item for item in items if not item['rkey'].startswith('#')]
+    stale = [item for item in follows if item['rkey'] in deleted]
+    if stale:
+        storage.delete_items('follows', [{'user_did': viewer, 'rkey': item['rkey']} for item in stale])
+        logger.info(f'Dropped {len(stale)} follows of {viewer} deleted during their bootstrap')
+    follows = [item for item in follows if item['rkey'] not in deleted]
+    follows.sort(key=lambda item: item['rkey'], reverse=True)
+    return follows
+
+def get_stored_follows(viewer):
+    """The stored follow items of the viewer, newest first, or None if they were never bootstrapped"""
+    items = storage.query('follows', viewer)
+    if not any(item['rkey'] == BOOTSTRAP_RKEY for item in items):
+        return None
+    return drop_deleted_follows(viewer, items)
+
+def bootstrap_follows(viewer):
+    """
+    Copies the viewer's follow records from their repo into the follows table, and marks them as
+    bootstrapped. Returns the followed DIDs, newest first, or None if the repo could not be read.
+
+    The firehose keeps the table up to date from the moment the listing starts (bootstrapped_at), so
+    a follow deleted after that may still be in the listing: its deletion mark drops it again once
+    the listing is written.
+    """
+    pds = resolve_pds(viewer)
+    if not pds:
+        return None
+    started_at = datetime.now(timezone.utc).isoformat()
+
+    follow_items = []
+    cursor = None
+    # listRecords returns the newest records first, so the cap keeps the newest follows
+    while len(follow_items) < MAX_FOLLOWS:
+        records, cursor = list_follow_records(pds, viewer, cursor)
+        if records is None:
+            return None
+        for record in records:
+            subject = record.get('value', {}).get('subject')
+            if isinstance(subject, str):
+                follow_items.append({
+                    'user_did': viewer,
+                    'rkey': record['uri'].rsplit('/', 1)[1],
+                    'subject_did': subject,
+                    'created_at': record['value'].get('createdAt')
+                })
+        if not cursor:
+            break
+
+    storage.put_items('follows', follow_items)
+    follow_items = drop_deleted_follows(viewer, storage.query('follows', viewer), since=started_at)
+    # the marker goes last, so an interrupted bootstrap is redone
+    storage.put_item('follows', {'user_did': viewer, 'rkey': BOOTSTRAP_RKEY, 'bootstrapped_at': started_at})
+    logger.info(f'Bootstrapped {len(follow_items)} follows of {viewer}')
+    return [item['subject_did'] for item in follow_items]
+
 def get_all_follows(viewer, retry_n):
-    """Get all accounts the viewer follows from BlueSky, handling pagination"""
+    """
+    Get all accounts the viewer follows, newest first: one query of the follows table, bootstrapped
+    from the viewer's repo the first time. Falls back to paging through the AppView if that fails.
+    Returns None for a viewer whose account is deactivated, marking them as such in the users table
+    (as the AppView's errors do).
+    """
+    if is_deactivated(viewer):
+        handle_deactivated(viewer, logger)
+        return None
+
+    try:
+        stored = get_stored_follows(viewer)
+        if stored is not None:
+            logger.info(f"Read {len(stored)} stored follows")
+            return list(dict.fromkeys(item['subject_did'] for item in stored))[:MAX_FOLLOWS]
+
+        follow_dids = bootstrap_follows(viewer)
+        if follow_dids is not None:
+            return list(dict.fromkeys(follow_dids))[:MAX_FOLLOWS]
+    except Exception as e:
+        logger.error(f"Error reading stored follows of {viewer}, querying Bluesky instead: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+
     logger.info(f'Querying Bluesky for follows')
-      
+
     all_follows = []
-    cursor = None 
+    cursor = None
     while len(all_follows) < MAX_FOLLOWS:
         follows, response_cursor = get_follows(viewer, retry_n, cursor=cursor, limit=100)
 
         if follows is None:
             break
-            
+
         all_follows.extend(follows)
         cursor = response_cursor
         if not cursor:
@@ -31,4 +127,4 @@ def get_all_follows(viewer, retry_n):
     follow_dids = [follow['did'] for follow in all_follows]
     logger.info(f"Fetched {len(all_follows)} follows")
 
-    return follow_dids
\ No newline at end of file
+    return follow_dids
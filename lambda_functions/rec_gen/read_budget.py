@@ -0,0 +1,27 @@
+import threading
+import time
+
+class ReadBudget:
+    """
+    A token bucket of read capacity units, shared by the threads reading from DynamoDB: refills at
+    rate units per second, holding at most one second's worth. A rate of 0 or less is unlimited.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._updated = time.monotonic()
+
+    def acquire(self, units=1):
+        """Takes units from the budget, waiting until they are available"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # the tokens are taken now and the wait is done outside the lock, so waiters queue up in order
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
@@ -1,4 +1,5 @@
 import logging
+from timestamps import created_ts
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,8 +16,18 @@ def process_post(post):
     else:
         return post['post']
 
+def sort_key(post):
+    """
+    The integer time key ingestion stores (createdTs: epoch ms, no later than when the record was
+    indexed), or for items stored before it, one computed from the raw createdDate
+    """
+    ts = post.get('createdTs')
+    if ts is None:
+        ts = post['createdTs'] = created_ts(post.get('createdDate'))
+    return ts
+
 def sort_posts(posts):
-    posts.sort(key=lambda x: x['createdDate'], reverse=True)
+    posts.sort(key=sort_key, reverse=True)
     return posts
 
 def follow_control(data: AlgorithmData):
@@ -31,6 +42,26 @@ def follow_quoteposts(data: AlgorithmData):
 def follow_all(data: AlgorithmData):
     return build_chron_recs(data.follows_posts + data.follows_reposts + data.follows_quoteposts)
 
+def collapse_duplicate_papers(posts):
+    # keep only the first (most recent) post of each paper; posts without a paper key are all kept
+    seen = set()
+    collapsed = []
+    for post in posts:
+        paper_key = post.get('paperKey')
+        if paper_key:
+            if paper_key in seen:
+                continue
+            seen.add(paper_key)
+        collapsed.append(post)
+    return collapsed
+
 def build_chron_recs(posts):
-    posts = sort_posts(posts)
+    posts = collapse_duplicate_papers(sort_posts(posts))
     return [process_post(post) for post in posts], posts
+
+def filter_by_tag(posts, tag):
+    return [post for post in posts if tag in post.get('tags', ())]
+
+def follow_discipline(data: AlgorithmData, tag):
+    # tags are only stored on paper posts, so discipline feeds are built from follows' own posts
+    return build_chron_recs(filter_by_tag(data.follows_posts, tag))
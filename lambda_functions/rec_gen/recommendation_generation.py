@@ -1,19 +1,15 @@
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from boto3.dynamodb.conditions import Key, Attr
 import time
 import logging
 import os
 from follows import get_all_follows
-from recommendation_algorithms import follow_control, follow_quoteposts, follow_reposts, follow_all, AlgorithmData
+from read_budget import ReadBudget
+from recommendation_algorithms import follow_control, follow_quoteposts, follow_reposts, follow_all, follow_discipline, sort_key, AlgorithmData
 from save_counterfactuals import save_counterfactuals
+from storage import default_storage, MAX_CONNECTIONS
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-recommendations_table = dynamodb.Table('recommendations')
-posts_table = dynamodb.Table('paper_posts')
-access_agg_table = dynamodb.Table('user_accesses_agg')
-reposts_table = dynamodb.Table('reposts')
-quoteposts_table = dynamodb.Table('quoteposts')
+storage = default_storage()
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -30,8 +26,44 @@ ALGORITHMS_DICT = {
     FOLLOW_RECOMMENDER_NAME_REPOSTS_QUOTEPOSTS: follow_all
 }
 
+# Per-discipline feeds, built by filtering on the tags ingestion stores on each paper post
+# e.g. DISCIPLINE_FEED_TAGS=discipline:medical,discipline:economics
+DISCIPLINE_TAGS = [tag for tag in os.environ.get('DISCIPLINE_FEED_TAGS', '').split(',') if tag]
+
+# Post statuses that keep a post out of recommendations: deleted by its author, or
+# excluded by a re-classification backfill (preprint_feed/backfill.py)
+HIDDEN_STATUSES = ['deleted', 'excluded']
+
 AGGREGATE_FEED_ID = 'aggregate_feed'
 
+# Indexes an author's recent posts, reposts and quoteposts are read from. Switch to the ones sorted on
+# the integer timestamps (AuthorDID-CreatedTs-index, user_did-created_ts-index) once they are created
+# and backfilled.
+POSTS_INDEX = os.environ.get('POSTS_INDEX', 'AuthorDID-CreatedDate-index')
+REPOSTS_INDEX = os.environ.get('REPOSTS_INDEX', 'user_did-created_at-index')
+QUOTEPOSTS_INDEX = os.environ.get('QUOTEPOSTS_INDEX', 'user_did-created_date-index')
+
+# Followed accounts' posts, reposts and quoteposts are queried concurrently, by one thread per pooled
+# DynamoDB connection (DYNAMODB_MAX_CONNECTIONS), within FOLLOWS_READ_BUDGET read capacity units per
+# second (0 for no limit) for the whole Lambda. A query reads at most 10 small items, which is counted
+# as QUERY_READ_UNITS: eventually consistent reads cost half a unit per 4 KB.
+FOLLOWS_QUERY_THREADS = MAX_CONNECTIONS
+FOLLOWS_READ_BUDGET = float(os.environ.get('FOLLOWS_READ_BUDGET', 1000))
+QUERY_READ_UNITS = 1
+
+# Followed accounts' recent activity is read from the author_activity items the ingestion workers keep
+# (see preprint_feed/server/author_activity.py), ACTIVITY_BATCH_SIZE per BatchGetItem. An item (a few
+# KB) is counted as ACTIVITY_READ_UNITS. Once the items have been seeded for every author with stored
+# activity (the SEEDED_MARKER item exists), an account without one has none; until then, accounts
+# without one are queried.
+USE_AUTHOR_ACTIVITY = os.environ.get('USE_AUTHOR_ACTIVITY', 'true').lower() != 'false'
+ACTIVITY_BATCH_SIZE = 100
+ACTIVITY_READ_UNITS = 2
+SEEDED_MARKER = '#seeded'
+
+# Recent posts, reposts and quoteposts used per followed account
+AUTHOR_RECENT_LIMIT = 10
+
 FIXED_POSTS = {
     'no_feed': 'at://did:plc:uaadt6f5bbda6cycbmatcm3z/app.bsky.feed.post/3ljjnqm4vl72l',
     'few_accesses': 'at://did:plc:uaadt6f5bbda6cycbmatcm3z/app.bsky.feed.post/3ljvzkxtotk2r' ,
@@ -46,19 +78,20 @@ ACCESS_THRESHOLD = 10
 CONSENT_THRESHOLD = 5
 
 def get_agg_feed():
-    response= recommendations_table.get_item(Key={
+    item = storage.get_item('recommendations', {
             'user_did': AGGREGATE_FEED_ID,
             'recommender': AGGREGATE_FEED_ID
         })
 
-    if response and response.get('Item'):
-        return response['Item']['recommendations']
+    if item:
+        return item['recommendations']
     return []
 
 def create_repost_object(post):
     obj = {
         'post': post['post_uri'],
-        'createdDate': post['created_at']
+        'createdDate': post['created_at'],
+        'createdTs': int(post['created_ts']) if 'created_ts' in post else None
     }
     if 'repost_uri' in post and post['repost_uri'] is not None:
         obj['reason'] = {
@@ -69,40 +102,33 @@ def create_repost_object(post):
 
 def get_author_recent_reposts(author_did):
     """Get 10 most recent posts for a single author"""
-    response = reposts_table.query(
-        IndexName='user_did-created_at-index',
-        KeyConditionExpression=Key('user_did').eq(author_did),
-        Limit=10,
-        ScanIndexForward=False
-    )
-    return [create_repost_object(post) for post in response['Items']]
+    items = storage.query('reposts', author_did, index=REPOSTS_INDEX, limit=AUTHOR_RECENT_LIMIT, newest_first=True)
+    return [create_repost_object(post) for post in items]
 
 def get_author_recent_quoteposts(author_did):
     """Get 10 most recent quoteposts for a single author"""
-    response = quoteposts_table.query(
-        IndexName='user_did-created_date-index',
-        KeyConditionExpression=Key('user_did').eq(author_did),
-        Limit=10,
-        ScanIndexForward=False
-    )
+    items = storage.query('quoteposts', author_did, index=QUOTEPOSTS_INDEX, limit=AUTHOR_RECENT_LIMIT, newest_first=True)
     return [{
         'post': post['at_uri'],
-        'createdDate': post['created_date']
-    } for post in response['Items']]
-
-def get_author_recent_posts(author_did, table):
-    """Get 10 most recent posts for a single author, filtering out deleted posts"""
-    response = table.query(
-        IndexName='AuthorDID-CreatedDate-index',
-        KeyConditionExpression=Key('AuthorDID').eq(author_did),
-        Limit=10,
-        FilterExpression=Attr('status').ne('deleted'),
-        ScanIndexForward=False
-    )
+        'createdDate': post['created_date'],
+        'createdTs': int(post['created_ts']) if 'created_ts' in post else None
+    } for post in items]
+
+def get_author_recent_posts(author_did):
+    """Get 10 most recent posts for a single author, filtering out deleted and excluded posts"""
+    items = storage.query('paper_posts', author_did, index=POSTS_INDEX, limit=AUTHOR_RECENT_LIMIT,
+                          newest_first=True, exclude={'status': HIDDEN_STATUSES})
     return [{
         'post': post['at_uri'],
-        'createdDate': post['CreatedDate']
-    } for post in response['Items']]
+        'createdDate': post['CreatedDate'],
+        'createdTs': int(post['CreatedTs']) if 'CreatedTs' in post else None,
+        'tags': post.get('Tags', []),
+        'paperKey': post.get('PaperKey'),
+        # engagement counted by the ingestion workers (absent until a post is first liked, reposted or quoted)
+        'likeCount': int(post.get('LikeCount', 0)),
+        'repostCount': int(post.get('RepostCount', 0)),
+        'quoteCount': int(post.get('QuoteCount', 0))
+    } for post in items]
 
 def process_post(post):
     if 'reason' in post:
@@ -110,23 +136,88 @@ def process_post(post):
     else:
         return post['post']
 
-def get_follows_data(following_dids):
-    all_posts = []
-    for author_did in following_dids:
-        all_posts.extend(get_author_recent_posts(author_did, posts_table))
+_query_executor = None
+_read_budget = ReadBudget(FOLLOWS_READ_BUDGET)
+_activity_seeded = False
+
+def get_query_executor():
+    # kept across the invocations of a warm Lambda, like the storage client and its connections
+    global _query_executor
+    if _query_executor is None:
+        _query_executor = ThreadPoolExecutor(max_workers=FOLLOWS_QUERY_THREADS, thread_name_prefix='follows-query')
+    return _query_executor
+
+def budgeted(query):
+    def run(author_did):
+        _read_budget.acquire(QUERY_READ_UNITS)
+        return query(author_did)
+    return run
+
+def query_authors(query, following_dids):
+    """Starts query(author_did) for every followed account; returns an iterator of their results, in order"""
+    return get_query_executor().map(budgeted(query), following_dids)
+
+def activity_seeded():
+    """Whether every author with stored activity has an author_activity item (kept once true, like the storage client)"""
+    global _activity_seeded
+    if not _activity_seeded:
+        _activity_seeded = storage.get_item('author_activity', {'author_did': SEEDED_MARKER}) is not None
+    return _activity_seeded
+
+def get_activity_items(following_dids):
+    """author DID -> author_activity item, for the followed accounts that have one; None if they cannot be read"""
+    dids = list(dict.fromkeys(following_dids))
+    def fetch(chunk):
+        _read_budget.acquire(ACTIVITY_READ_UNITS * len(chunk))
+        return storage.get_items('author_activity', [{'author_did': author_did} for author_did in chunk])
+
+    chunks = [dids[i:i + ACTIVITY_BATCH_SIZE] for i in range(0, len(dids), ACTIVITY_BATCH_SIZE)]
+    items = {}
+    try:
+        for found in get_query_executor().map(fetch, chunks):
+            items.update((item['author_did'], item) for item in found)
+    except Exception as e:
+        logger.error(f'Error reading author activity, querying every followed account: {e}')
+        return None
+    return items
 
-    all_reposts = []
-    for author_did in following_dids:
-        all_reposts.extend(get_author_recent_reposts(author_did))
+def activity_entries(item, kind):
+    """The recent posts, reposts or quoteposts of an author_activity item, as the queries return them"""
+    return [{**entry, 'createdTs': int(entry['createdTs'])} for entry in item.get(kind, [])[:AUTHOR_RECENT_LIMIT]]
 
-    all_quoteposts = []
-    for author_did in following_dids:
-        all_quoteposts.extend(get_author_recent_quoteposts(author_did))
+def get_follows_data(following_dids):
+    activity = get_activity_items(following_dids) if USE_AUTHOR_ACTIVITY else None
+    if activity is None:
+        activity, missing = {}, following_dids
+    elif activity_seeded():
+        missing = []
+    else:
+        missing = [author_did for author_did in following_dids if author_did not in activity]
+    logger.info(f'Read the activity of {len(activity)} followed accounts, querying {len(missing)}')
+
+    # all three kinds of queries are started before any results are read
+    posts = query_authors(get_author_recent_posts, missing)
+    reposts = query_authors(get_author_recent_reposts, missing)
+    quoteposts = query_authors(get_author_recent_quoteposts, missing)
+    queried = {
+        'posts': dict(zip(missing, posts)),
+        'reposts': dict(zip(missing, reposts)),
+        'quoteposts': dict(zip(missing, quoteposts))
+    }
+
+    def follows_entries(kind):
+        entries = []
+        for author_did in following_dids:
+            if author_did in activity:
+                entries.extend(activity_entries(activity[author_did], kind))
+            elif author_did in queried[kind]:
+                entries.extend(queried[kind][author_did])
+        return entries
 
     return AlgorithmData(
-        follows_posts=all_posts,
-        follows_reposts=all_reposts,
-        follows_quoteposts=all_quoteposts
+        follows_posts=follows_entries('posts'),
+        follows_reposts=follows_entries('reposts'),
+        follows_quoteposts=follows_entries('quoteposts')
     )
 
 def get_all_authors_posts(following_dids, include_reposts=False, include_quoteposts=False):
@@ -135,7 +226,7 @@ def get_all_authors_posts(following_dids, include_reposts=False, include_quotepo
     all_posts = []
 
     for author_did in following_dids:
-        all_posts.extend(get_author_recent_posts(author_did, posts_table))
+        all_posts.extend(get_author_recent_posts(author_did))
 
     if include_reposts:
         all_reposts = []
@@ -157,7 +248,7 @@ def get_all_authors_posts(following_dids, include_reposts=False, include_quotepo
         return ALGORITHMS_DICT[FOLLOW_RECOMMENDER_NAME_REPOSTS_QUOTEPOSTS](data)
 
     # Sort all posts by date
-    all_posts.sort(key=lambda x: x['createdDate'], reverse=True)
+    all_posts.sort(key=sort_key, reverse=True)
     logger.info(f'Retrieved {len(all_posts)} posts')
     logger.info(f'Time for retrieval: {time.time() - start_time}')
     return [process_post(post) for post in all_posts], all_posts
@@ -175,11 +266,13 @@ def consent_accesses(accesses):
         return consent_accesses <= CONSENT_THRESHOLD
     return False
 
+def discipline_recommender_name(tag):
+    return f'{FOLLOW_RECOMMENDER_NAME}:{tag}'
+
 def get_access_details(user_did):
-    response = access_agg_table.get_item(Key={
+    return storage.get_item('user_accesses_agg', {
         'user_did': user_did
     })
-    return response.get('Item', None)
 
 def construct_recs_object(recommender_name, recommendations, user_did, default_from, start_time, end_time):
     return {
@@ -195,7 +288,7 @@ def save_recs(batch, recommender_name, recommendations, user_did, default_from,
     try:
         recs_object = construct_recs_object(recommender_name, recommendations, user_did, default_from, start_time, end_time)
         if recs_object:
-            batch.put_item(Item=recs_object)
+            batch.append(recs_object)
         return recs_object
     except Exception as e:
         logger.error(f'Error saving recs for user {user_did}: {e}')
@@ -243,6 +336,12 @@ def generate_recommendations_user_updated(batch, user_did, agg_feed, retry_n, sc
             recommendations_dict = save_recs(batch, alg, recommendations, user_did, default_from, start_time, end_time)
             recommendations_dicts.append(recommendations_dict)
 
+        # discipline feeds are not part of the experiment, so they are not saved as counterfactuals
+        for tag in DISCIPLINE_TAGS:
+            recs, _ = follow_discipline(data, tag)
+            recommendations = (recommendation_prefix + recs)[:FEED_LIMIT]
+            save_recs(batch, discipline_recommender_name(tag), recommendations, user_did, -1, start_time, end_time)
+
         if scheduled_generation:
             save_counterfactuals(user_did, recommendations_dicts)
 
@@ -251,7 +350,7 @@ def generate_recommendations_user_updated(batch, user_did, agg_feed, retry_n, sc
         return None
 
 def generate_recommendations_agg(all_raw_recs):
-    all_raw_recs.sort(key=lambda x: x['createdDate'], reverse=True)
+    all_raw_recs.sort(key=sort_key, reverse=True)
     agg_recs = all_raw_recs[:FEED_LIMIT]
     agg_posts = [post['post'] for post in agg_recs]
     return {'user_did': AGGREGATE_FEED_ID, 'recommender': AGGREGATE_FEED_ID, 'recommendations': agg_posts, 'generation_date': datetime.now(timezone.utc).isoformat()}
@@ -260,14 +359,16 @@ def generate_recommendations_users(users, generate_agg, retry_n, scheduled_gener
     logger.info(f"Generating recommendations for {len(users)} users")
     agg_recs = get_agg_feed()
 
-    with recommendations_table.batch_writer() as batch:
-        all_recs = []
-        for user in users:
-            recs_raw = generate_recommendations_user_updated(batch, user, agg_recs, retry_n, scheduled_generation)
-            if recs_raw:
-                all_recs.extend(recs_raw)
-        
-        if generate_agg:
-            agg_user_recs = generate_recommendations_agg(all_recs)
-            recommendations_table.put_item(Item=agg_user_recs)
+    all_recs = []
+    for user in users:
+        # each user's recommendations are written once they are all generated
+        batch = []
+        recs_raw = generate_recommendations_user_updated(batch, user, agg_recs, retry_n, scheduled_generation)
+        storage.put_items('recommendations', batch)
+        if recs_raw:
+            all_recs.extend(recs_raw)
+
+    if generate_agg:
+        agg_user_recs = generate_recommendations_agg(all_recs)
+        storage.put_item('recommendations', agg_user_recs)
             
\ No newline at end of file
@@ -1,21 +1,18 @@
-import boto3
 from datetime import datetime, timezone
 import logging
 import uuid
+from storage import default_storage
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
-counterfactuals_table = dynamodb.Table('counterfactual_recs')
+storage = default_storage()
 
 def is_research_user(user):
     return not user.get('research_remove', False)
 
 def check_research_user(user_did):
-    response = users_table.get_item(Key={'user_did': user_did})
-    user = response.get('Item')
+    user = storage.get_item('users', {'user_did': user_did})
     return is_research_user(user)
 
 def get_first_page_recs(user_did, recommendations_dicts, save_date, page_length=30):
@@ -42,6 +39,4 @@ def save_counterfactuals(user_did, recommendation_dicts):
     if is_research_user:
         logger.info(f"Saving counterfactuals for user {user_did}")
         recs_to_save = get_first_page_recs(user_did, recommendation_dicts, save_date)
-        with counterfactuals_table.batch_writer() as ct:
-            for rec_to_save in recs_to_save:
-                ct.put_item(Item=rec_to_save)
\ No newline at end of file
+        storage.put_items('counterfactual_recs', recs_to_save)
\ No newline at end of file
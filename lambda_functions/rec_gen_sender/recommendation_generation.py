@@ -1,13 +1,19 @@
-import boto3
 import json
 import logging
+import os
 import random
+from datetime import datetime, timedelta, timezone
+from storage import default_storage
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-users_table = dynamodb.Table('users')
+storage = default_storage()
+
+# Users whose last access is more than this many days ago are not scheduled: their recommendations
+# are archived and expired by preprint_feed/tier_tables.py (keep this equal to its --dormant-days),
+# and regenerating them would drop the expiry. A returning user's access dispatches their generation.
+DORMANT_DAYS = int(os.environ.get('DORMANT_DAYS', 30))
 
 def user_is_active(item):
     if 'deactivated' not in item:
@@ -17,26 +23,27 @@ def user_is_active(item):
         logger.info(f'User {item["user_did"]} is deactivated')
     return not deactivated
 
+def get_dormant_users():
+    """The users whose last access is more than DORMANT_DAYS ago (not those never seen to access)"""
+    cutoff_day = (datetime.now(timezone.utc) - timedelta(days=DORMANT_DAYS)).date().isoformat()
+    dormant = set()
+    for item in storage.scan('user_accesses_agg', attributes=['user_did', 'last_access']):
+        last_access = item.get('last_access')
+        if isinstance(last_access, str) and last_access[:10] <= cutoff_day:
+            dormant.add(item['user_did'])
+    return dormant
+
 def get_all_users():
     logger.info('Getting all users')
-    items = []
-    response = users_table.scan(
-        ProjectionExpression='user_did,deactivated',
-    )
-    items.extend(response['Items'])
-
-    # Handle pagination only if we don't have enough items
-    while 'LastEvaluatedKey' in response:
-        response = users_table.scan(
-                ProjectionExpression='user_did,deactivated',
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-        items.extend(response['Items'])
+    items = list(storage.scan('users', attributes=['user_did', 'deactivated']))
+    dormant = get_dormant_users()
 
-    users = [item['user_did'] for item in items if user_is_active(item)]
+    users = [item['user_did'] for item in items if user_is_active(item) and item['user_did'] not in dormant]
     inactive_users = [item['user_did'] for item in items if not user_is_active(item)]
+    dormant_users = [item['user_did'] for item in items if user_is_active(item) and item['user_did'] in dormant]
     logger.info(f'Found {len(users)} users: {users}')
     logger.info(f'Found {len(inactive_users)} inactive users: {inactive_users}')
+    logger.info(f'Found {len(dormant_users)} dormant users (no access in {DORMANT_DAYS} days): {dormant_users}')
 
     return users
 
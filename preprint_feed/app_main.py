@@ -3,16 +3,28 @@
 import multiprocessing
 from time import sleep, time
 
+from server import author_activity
 from server import config
 from server import data_stream
+from server import database
+from server import database_dynamo
+from server import engagement
+from server import membership
+from server import patterns
+from server import retry_log
+from server import trending
 from server.data_filter import operations_callback
 from server.logger import logger
 
+import os
 import signal
 import sys
 
 # Define the maximum queue size
 MAX_QUEUE_SIZE = 10000
+
+# How often (seconds) worker 0 prunes PostURI rows past the retention horizon
+PRUNE_INTERVAL = 3600
 work_queue = multiprocessing.Queue(MAX_QUEUE_SIZE)
 
 def prepare_record(record):
@@ -124,14 +136,19 @@ def prepare_record(record):
         except AttributeError:
             record_dict['reply'] = None
 
-    # Handle subject (for likes)
+    # Handle subject (a post reference for likes and reposts, the followed DID for follows)
     if hasattr(record, 'subject') and record.subject is not None:
-        try:
+        if isinstance(record.subject, str):
             record_dict['subject'] = {
-                'uri': record.subject.uri
+                'did': record.subject
             }
-        except AttributeError:
-            record_dict['subject'] = None
+        else:
+            try:
+                record_dict['subject'] = {
+                    'uri': record.subject.uri
+                }
+            except AttributeError:
+                record_dict['subject'] = None
 
     return record_dict
 
@@ -176,19 +193,41 @@ def worker_process_queue(work_queue, worker_id = 0):
     processed_count = 0
     success_count = 0
     last_print_time = time()
+    last_prune_time = 0
+    patterns.install_reload_handler()
+    database.init_db()
 
     try: 
         while True:
             try:
+                # pick up a new pattern set between batches (on SIGHUP or when the file changes)
+                patterns.maybe_reload()
+
+                if worker_id == 0 and config.POST_URI_RETENTION_DAYS and time() - last_prune_time >= PRUNE_INTERVAL:
+                    last_prune_time = time()
+                    n_pruned, n_records = database.prune_post_uris(config.POST_URI_RETENTION_DAYS, archive=config.POST_URI_ARCHIVE)
+                    if n_pruned:
+                        print(f"Worker {worker_id} pruned {n_pruned} post URIs older than {config.POST_URI_RETENTION_DAYS} days "
+                              f"and {n_records} interaction records of their posts")
+                        membership.rebuild_post_index()
+
                 ops = work_queue.get(timeout=1)
                 success_count += operations_callback(ops)
                 processed_count += 1
 
+                # hand the engagement counted since the last flush to a background write, one update per post
+                engagement.maybe_flush()
+                author_activity.maybe_flush()
+                trending.maybe_publish(worker_id)
+
                 # Print the count every 30 seconds
                 current_time = time()
                 if current_time - last_print_time >= 30:
                     queue_length = work_queue.qsize()
                     print(f"Worker {worker_id} processed {processed_count} items and has found {success_count} paper posts; Queue length: {queue_length}")
+                    rates, backlog = database_dynamo.write_stats()
+                    print(f"Worker {worker_id} write backlog: {backlog} buffered; " +
+                          ", ".join(f"{table} {rate:.0f}/s ({waiting:.0f} waiting)" for table, (rate, waiting) in rates.items()))
                     last_print_time = current_time
 
             except multiprocessing.queues.Empty:
@@ -199,12 +238,18 @@ def worker_process_queue(work_queue, worker_id = 0):
                 print(f"Error processing work: {e}")
                 sleep(1)
     finally:
+        # writes the buffered items, then the engagement counted and the authors' activity
+        engagement.flush()
+        author_activity.flush()
         # Ensure we return the connection to the pool
         print(f"Worker {worker_id} finished processing. Total processed: {processed_count}, Success: {success_count}")
 
 from datetime import datetime
 def data_stream_with_restart(service_did, callback, stop_event):
     """Run data_stream with automatic restart on hang"""
+    # a SIGHUP sent to the process group reloads the workers' patterns; the stream (which inherits
+    # this disposition) has nothing to reload and must not die of it
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
     while True:
         print(f"Starting data stream at {datetime.now()}")
         
@@ -230,6 +275,15 @@ def data_stream_with_restart(service_did, callback, stop_event):
 
 def main():
     num_workers = 6  # Specify the number of worker processes you want
+
+    # until the forwarder below is installed (workers install their own reload handler)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Open (or build) the stored-post membership index before forking, so workers share its pages.
+    # Every process opens its own database connection, so this one is closed before forking.
+    database.init_db()
+    membership.get_post_index()
+    database.db.close()
     
     # Replace the direct data_stream.run with our wrapper
     stream_process = multiprocessing.Process(
@@ -246,6 +300,17 @@ def main():
         process.start()
         worker_processes.append(process)
 
+    # replays the writes the workers could not make (started after forking: threads do not survive it)
+    retry_log.start_drainer(database_dynamo.replay_failed_write)
+
+    def reload_handler(sig, frame):
+        # forward SIGHUP so every worker swaps to the new pattern set
+        print("Reloading pattern set in all workers...")
+        for p in worker_processes:
+            os.kill(p.pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGHUP, reload_handler)
+
     # Wait for the worker processes to finish (if necessary)
     for process in worker_processes:
         process.join()
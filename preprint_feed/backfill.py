@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# Re-classifies posts that were already seen with the current pattern set, so that pattern
+# changes also reach old posts. Run from the preprint_feed directory:
+#   python3 backfill.py --dry-run                        # report what would change, write nothing
+#   python3 backfill.py --segments 64 --processes 16     # parallel scan of paper_posts
+#   python3 backfill.py --capture captures/*.jsonl       # re-read captured firehose posts
+#
+# paper_posts is read with a parallel segmented Scan. Each segment is one pool task, which
+# re-runs the classifier on the stored SearchText. Capture files are JSONL of prepared posts
+# as the workers receive them ({"uri", "cid", "author", "record"}), one pool task per file.
+#
+# Writes are only made for posts whose outcome changed:
+#   - removals: posts that no longer classify as papers get status "excluded", which the
+#     recommendation generator filters out like deleted posts
+#   - restores: excluded posts that classify as papers again lose that status
+#   - tag changes: new Tags, PaperKey or PaperKeys, with the paper index updated to match
+#   - timestamps: paper posts stored before they had a CreatedTs (the integer sort key, see
+#     server/timestamps.py) get one; every other rewritten post gets one too
+#   - adds (capture files only): paper posts that are not stored yet. Capture files only hold
+#     created posts, so a post deleted after it was captured will be added again
+# Their authors' author_activity items (see server/author_activity.py) are updated to match.
+# A changed post is written with an UpdateItem of only the BACKFILL_FIELDS that changed, on
+# condition that it is still stored and not deleted, so the live workers' updates of the same
+# post (marking it deleted, counting its likes, reposts and quotes) are never lost. An added
+# post is only written if no post has its URI by then.
+#
+# Every segment or file saves its position in --checkpoint-dir after each page of writes,
+# so rerunning the same command after an interruption resumes where it stopped.
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+
+from server import author_activity
+from server.classifier import Classification, ClassificationBudgetExceeded, classify_post, classify_search_text
+from server.data_filter import classification_fields, format_paper_post
+from server.database import init_db, store_post_uris
+from server.database_dynamo import (storage, get_posts, format_paper_index_entries, store_paper_index,
+                                    remove_paper_index_entries, flush_writes)
+from server.logger import logger
+from server.membership import add_stored_posts
+from server.patterns import get_pattern_set, load_pattern_set
+from server.post_utils import get_search_text
+from server.timestamps import created_ts
+
+DEFAULT_CHECKPOINT_DIR = 'backfill_checkpoints'
+
+# Items per Scan page (DynamoDB also ends a page at 1 MB); one page is written and checkpointed at a time
+SCAN_PAGE_SIZE = 1000
+
+# Capture file lines classified between checkpoints
+CAPTURE_CHUNK_SIZE = 1000
+
+# Per-post classification budget (seconds). Far above the live one, since nothing waits on the
+# backfill; stored posts that still exceed it are left unchanged.
+BACKFILL_TIME_BUDGET = 1.0
+
+EXCLUDED_STATUS = 'excluded'
+
+# Attributes set by classification_fields, replaced wholesale when a post is re-classified
+CLASSIFIED_FIELDS = ['PatternVersion', 'Tags', 'PaperKey', 'PaperKeys']
+
+# Every attribute the backfill writes; the others (e.g. the engagement counts) are left alone
+BACKFILL_FIELDS = CLASSIFIED_FIELDS + ['status', 'excluded_at', 'CreatedTs']
+
+# Concurrent UpdateItem (and conditional PutItem) calls per page of writes
+WRITE_THREADS = 8
+
+COUNTERS = ['read', 'unchanged', 'skipped', 'retagged', 'removed', 'restored', 'timestamped', 'added']
+
+_pattern_set = None
+
+def init_worker(patterns_path):
+    global _pattern_set
+    init_db()
+    _pattern_set = load_pattern_set(patterns_path) if patterns_path else get_pattern_set()
+
+def classify_stored(search_text, pattern_set):
+    """
+    Classifies a stored post from its SearchText alone; None if it runs over BACKFILL_TIME_BUDGET.
+    Without the record, the arXiv override checks the whole search text rather than only the post
+    text and link, which only matters for posts quoting an arXiv link.
+    """
+    try:
+        classification = classify_search_text(search_text, deadline=perf_counter() + BACKFILL_TIME_BUDGET, pattern_set=pattern_set)
+    except ClassificationBudgetExceeded:
+        return None
+    if not classification.is_paper and 'arxiv.org' in search_text:
+        return Classification(True, classification.tags)
+    return classification
+
+def reclassify(item, classification, search_text, pattern_set):
+    """
+    Compares a stored post with its new classification. Returns (kind, updated item), where
+    kind is 'retagged', 'removed', 'restored' or 'timestamped', or None if the stored item is up to date.
+    """
+    status = item.get('status')
+    if status == 'deleted' or classification is None:
+        return None
+
+    if not classification.is_paper:
+        if status == EXCLUDED_STATUS:
+            return None
+        updated = dict(item, status=EXCLUDED_STATUS, excluded_at=datetime.now(timezone.utc).isoformat(),
+                       PatternVersion=pattern_set.version)
+        updated.setdefault('CreatedTs', created_ts(item.get('CreatedDate')))
+        return 'removed', updated
+
+    updated = {key: value for key, value in item.items() if key not in CLASSIFIED_FIELDS}
+    updated.update(classification_fields(search_text, classification, pattern_set))
+    updated.setdefault('CreatedTs', created_ts(item.get('CreatedDate')))
+    if status == EXCLUDED_STATUS:
+        updated.pop('status')
+        updated.pop('excluded_at', None)
+        return 'restored', updated
+    if all(item.get(field) == updated.get(field) for field in ('Tags', 'PaperKey', 'PaperKeys')):
+        return None if 'CreatedTs' in item else ('timestamped', updated)
+    return 'retagged', updated
+
+def write_change(item, updated):
+    """
+    Updates a stored post's BACKFILL_FIELDS from item to updated; False if it was deleted (or is
+    no longer stored) since it was read
+    """
+    changed = {field: updated[field] for field in BACKFILL_FIELDS if field in updated and updated[field] != item.get(field)}
+    removed = [field for field in BACKFILL_FIELDS if field in item and field not in updated]
+    return storage.update_item('paper_posts', {'at_uri': item['at_uri']}, set=changed, remove=removed,
+                               must_exist=True, unless={'status': 'deleted'})
+
+def apply_changes(changes, added):
+    """Writes one page of changes: (kind, old item, new item) tuples and newly added posts"""
+    if not changes and not added:
+        return
+
+    with ThreadPoolExecutor(max_workers=WRITE_THREADS) as executor:
+        written = list(executor.map(lambda change: write_change(change[1], change[2]), changes))
+        added_written = list(executor.map(lambda post: storage.put_item('paper_posts', post, if_absent=True), added))
+    changes = [change for change, done in zip(changes, written) if done]
+    added = [post for post, done in zip(added, added_written) if done]
+
+    stale_entries = []
+    indexed_posts = list(added)
+    for kind, item, updated in changes:
+        new_keys = set() if kind == 'removed' else set(updated.get('PaperKeys', []))
+        stale_entries.extend(entry for entry in format_paper_index_entries(item) if entry['paper_key'] not in new_keys)
+        if kind != 'removed':
+            indexed_posts.append(updated)
+    remove_paper_index_entries(stale_entries)
+    store_paper_index(indexed_posts)
+    author_activity.remove_posts([item['at_uri'] for kind, item, _ in changes if kind == 'removed'])
+    author_activity.add_posts(indexed_posts)
+    # written before the checkpoint that records them as done
+    flush_writes()
+    author_activity.flush()
+
+    if added:
+        add_stored_posts(store_post_uris([post['at_uri'] for post in added], {post['at_uri']: post.get('PaperKey') for post in added}))
+
+def checkpoint_path(checkpoint_dir, unit):
+    if unit[0] == 'scan':
+        name = f'scan-{unit[1]}-of-{unit[2]}'
+    else:
+        name = 'capture-' + os.path.abspath(unit[1]).strip('/').replace('/', '_')
+    return os.path.join(checkpoint_dir, name + '.json')
+
+def load_checkpoint(path, pattern_set):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        # counters added since the checkpoint was written
+        for counter in COUNTERS:
+            checkpoint['counts'].setdefault(counter, 0)
+        return checkpoint
+    return {'pattern_version': pattern_set.version, 'position': None, 'done': False,
+            'counts': dict.fromkeys(COUNTERS, 0)}
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def backfill_segment(segment, total_segments, path, dry_run):
+    """Re-classifies one segment of a parallel scan of paper_posts"""
+    checkpoint = load_checkpoint(path, _pattern_set)
+    counts = checkpoint['counts']
+
+    while not checkpoint['done']:
+        items, position = storage.scan_page('paper_posts', start=checkpoint['position'], limit=SCAN_PAGE_SIZE,
+                                            segment=segment, total_segments=total_segments)
+
+        changes = []
+        for item in items:
+            counts['read'] += 1
+            search_text = item.get('SearchText', '')
+            classification = classify_stored(search_text, _pattern_set)
+            change = reclassify(item, classification, search_text, _pattern_set)
+            if change is None:
+                counts['skipped' if classification is None or item.get('status') == 'deleted' else 'unchanged'] += 1
+                continue
+            counts[change[0]] += 1
+            changes.append((change[0], item, change[1]))
+
+        if not dry_run:
+            apply_changes(changes, [])
+        checkpoint['position'] = position
+        checkpoint['done'] = checkpoint['position'] is None
+        save_checkpoint(path, checkpoint)
+    return counts
+
+def read_capture_chunk(f, path, first_line):
+    """Reads up to CAPTURE_CHUNK_SIZE prepared posts; returns them and the number of lines consumed"""
+    posts = []
+    n_lines = 0
+    for line in f:
+        n_lines += 1
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            post = json.loads(line)
+        except ValueError as e:
+            logger.error(f'{path}:{first_line + n_lines}: skipping invalid JSON: {e}')
+            continue
+        if isinstance(post.get('record'), dict) and all(post.get(key) for key in ('uri', 'cid', 'author')):
+            posts.append(post)
+        else:
+            logger.error(f'{path}:{first_line + n_lines}: skipping line without uri, cid, author and record')
+        if n_lines >= CAPTURE_CHUNK_SIZE:
+            break
+    return posts, n_lines
+
+def backfill_capture(capture_path, path, dry_run):
+    """Re-classifies the posts of one capture file, adding paper posts that are not stored yet"""
+    checkpoint = load_checkpoint(path, _pattern_set)
+    counts = checkpoint['counts']
+    position = checkpoint['position'] or 0
+
+    with open(capture_path) as f:
+        for _ in range(position):
+            next(f, None)
+
+        while not checkpoint['done']:
+            posts, n_lines = read_capture_chunk(f, capture_path, position)
+            stored = get_posts([post['uri'] for post in posts])
+
+            changes = []
+            added = {}
+            for post in posts:
+                counts['read'] += 1
+                search_text = get_search_text(post['record'])
+                classification = classify_post(post['record'], search_text, time_budget=BACKFILL_TIME_BUDGET, pattern_set=_pattern_set)
+                item = stored.get(post['uri'])
+                if item is None:
+                    if classification.is_paper and post['uri'] not in added:
+                        counts['added'] += 1
+                        added[post['uri']] = format_paper_post(post, search_text, classification, _pattern_set)
+                    else:
+                        counts['unchanged'] += 1
+                    continue
+                change = reclassify(item, classification, search_text, _pattern_set)
+                if change is None:
+                    counts['skipped' if item.get('status') == 'deleted' else 'unchanged'] += 1
+                    continue
+                counts[change[0]] += 1
+                changes.append((change[0], item, change[1]))
+
+            if not dry_run:
+                apply_changes(changes, list(added.values()))
+            position += n_lines
+            checkpoint['position'] = position
+            checkpoint['done'] = n_lines == 0
+            save_checkpoint(path, checkpoint)
+    return counts
+
+def run_unit(task):
+    unit, path, dry_run = task
+    if unit[0] == 'scan':
+        counts = backfill_segment(unit[1], unit[2], path, dry_run)
+    else:
+        counts = backfill_capture(unit[1], path, dry_run)
+    return unit, counts
+
+def prepare_checkpoints(checkpoint_dir, units, pattern_set, restart):
+    """Creates the checkpoint directory, refusing to resume a run made with a different pattern set"""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    paths = [checkpoint_path(checkpoint_dir, unit) for unit in units]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if restart:
+            os.remove(path)
+            continue
+        with open(path) as f:
+            version = json.load(f).get('pattern_version')
+        if version != pattern_set.version:
+            sys.exit(f'{path} was written with pattern set {version}, not {pattern_set.version}; '
+                     f'rerun with --restart to start over')
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-classify stored posts with the current pattern set')
+    parser.add_argument('--capture', nargs='+', metavar='FILE', help='read prepared posts from JSONL capture files instead of paper_posts')
+    parser.add_argument('--segments', type=int, default=64, help='parallel scan segments over paper_posts')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--patterns', help='patterns file to classify with (default: the active one)')
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR, help='where progress is saved for resuming')
+    parser.add_argument('--restart', action='store_true', help='discard existing checkpoints and start over')
+    parser.add_argument('--dry-run', action='store_true', help='classify and count, but write nothing (no checkpoints)')
+    args = parser.parse_args()
+
+    pattern_set = load_pattern_set(args.patterns) if args.patterns else get_pattern_set()
+    if args.capture:
+        units = [('capture', capture_path) for capture_path in args.capture]
+    else:
+        units = [('scan', segment, args.segments) for segment in range(args.segments)]
+
+    if args.dry_run:
+        paths = [None] * len(units)
+    else:
+        paths = prepare_checkpoints(args.checkpoint_dir, units, pattern_set, args.restart)
+
+    totals = dict.fromkeys(COUNTERS, 0)
+    start = perf_counter()
+    tasks = [(unit, path, args.dry_run) for unit, path in zip(units, paths)]
+    # spawn rather than fork, so every worker creates its own DynamoDB client and SQLite connection
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes, initializer=init_worker, initargs=(args.patterns,)) as pool:
+        for n_done, (unit, counts) in enumerate(pool.imap_unordered(run_unit, tasks), start=1):
+            for counter in COUNTERS:
+                totals[counter] += counts[counter]
+            elapsed = perf_counter() - start
+            print(f'[{n_done}/{len(tasks)}] {unit[1]}: read {counts["read"]}; '
+                  f'total {totals["read"]} in {elapsed:.0f}s ({totals["read"] / max(elapsed, 1e-9):.0f} posts/s)', flush=True)
+
+    summary = ', '.join(f'{counter} {totals[counter]}' for counter in COUNTERS)
+    print(f'{"Dry run with" if args.dry_run else "Backfilled with"} pattern set {pattern_set.version}: {summary}')
+
+
+if __name__ == '__main__':
+    main()
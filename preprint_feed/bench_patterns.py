@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Regex fuzz and benchmark suite for the paper classifier.
+# Run from the preprint_feed directory:
+#   python3 bench_patterns.py            # fuzz every pattern and benchmark the classifier
+#   python3 bench_patterns.py --quick    # smaller inputs, for a fast sanity check
+#
+# Every pattern is timed against adversarial inputs of doubling size. If the time grows
+# faster than the input (growth exponent above MAX_GROWTH_EXPONENT), the pattern is flagged
+# as super-linear. Since post_utils caps every field, a flagged pattern only fails the run
+# if it is also slower than MAX_PATTERN_TIME on an input of the largest field size.
+import argparse
+import math
+import random
+import re
+import sys
+from time import perf_counter
+
+from server import config
+from server.classifier import is_paper_post
+from server.patterns import get_pattern_set
+from server.post_utils import get_search_text, MAX_TEXT_LENGTH
+
+# Largest acceptable slope of log(time) against log(input size)
+MAX_GROWTH_EXPONENT = 1.5
+
+# Largest acceptable time for one pattern on a capped field; a fifth of the per-post budget
+MAX_PATTERN_TIME = config.CLASSIFICATION_TIME_BUDGET / 5
+
+# Input sizes (characters) each pattern is timed against
+SIZES = [2000, 4000, 8000, 16000]
+QUICK_SIZES = [1000, 2000, 4000]
+
+# Fragments that tend to make URL and announcement patterns backtrack when repeated
+GENERIC_SEEDS = [
+    'a',
+    ' ',
+    'http://',
+    'https://x.org/',
+    'published ',
+    '(2024) ',
+    'doi.org/10.1234/',
+    '10.12345/',
+    '.pdf',
+    'arxiv.org/abs/',
+    'et al',
+]
+
+def pattern_seeds(pattern):
+    """Literal words from a pattern's source, used to build inputs that almost match it"""
+    words = re.findall(r'[a-z][a-z-]{2,}', pattern.pattern.replace('\\.', '.'))
+    seeds = [word + ' ' for word in words[:4]]
+    seeds.extend(word + '/' for word in words[:2])
+    seeds.append(''.join(words[:3]))
+    return [seed for seed in seeds if seed]
+
+def adversarial_input(seed, size):
+    repeats = size // len(seed) + 1
+    return (seed * repeats)[:size]
+
+def time_search(pattern, text, repeats=3):
+    best = math.inf
+    for _ in range(repeats):
+        start = perf_counter()
+        for _ in pattern.finditer(text):
+            pass
+        best = min(best, perf_counter() - start)
+    return best
+
+def growth_exponent(sizes, timings):
+    """Least-squares slope of log(time) against log(size)"""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(timing, 1e-7)) for timing in timings]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    numerator = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    denominator = sum((x - x_mean) ** 2 for x in xs)
+    return numerator / denominator
+
+def fuzz_pattern(pattern, sizes):
+    """Returns (worst exponent, seed, largest timing) over all seeds for one pattern"""
+    worst = (-math.inf, None, 0.0)
+    for seed in GENERIC_SEEDS + pattern_seeds(pattern):
+        timings = [time_search(pattern, adversarial_input(seed, size)) for size in sizes]
+        # Ignore seeds that are too fast to measure reliably
+        if timings[-1] < 1e-4:
+            continue
+        exponent = growth_exponent(sizes, timings)
+        if exponent > worst[0]:
+            worst = (exponent, seed, timings[-1])
+    return worst
+
+def fuzz_all(sizes):
+    flagged = []
+    failed = []
+    pattern_set = get_pattern_set()
+    patterns = [('paper', p) for p in pattern_set.paper_patterns] + [('content', p) for p in pattern_set.content_patterns]
+    for kind, pattern in patterns:
+        exponent, seed, largest = fuzz_pattern(pattern, sizes)
+        if seed is None or exponent <= MAX_GROWTH_EXPONENT:
+            continue
+        capped_time = time_search(pattern, adversarial_input(seed, MAX_TEXT_LENGTH))
+        flagged.append(pattern.pattern)
+        status = 'FAIL' if capped_time > MAX_PATTERN_TIME else 'bounded by field caps'
+        if capped_time > MAX_PATTERN_TIME:
+            failed.append(pattern.pattern)
+        print(f'SUPER-LINEAR {kind} pattern {pattern.pattern!r}: exponent {exponent:.2f} on seed {seed!r} '
+              f'({largest * 1000:.1f} ms at {sizes[-1]} chars, {capped_time * 1000:.1f} ms at {MAX_TEXT_LENGTH}) - {status}')
+    print(f'Fuzzed {len(patterns)} patterns of set {pattern_set.version} at sizes {sizes}; '
+          f'{len(flagged)} super-linear, {len(failed)} failing')
+    return failed
+
+def random_record(rng, size):
+    words = ['paper', 'new', 'our', 'study', 'published', 'journal', 'of', 'the', 'we', 'show',
+             'https://example.com/', 'doi.org/10.1234/', '(2024)', 'http://', 'a' * 20]
+    text = ' '.join(rng.choice(words) for _ in range(size // 6))
+    return {
+        'text': text,
+        'urls': [f'https://example.com/{rng.randint(0, 10**6)}'],
+        'embed': {
+            'external': {'uri': 'https://example.com/' + 'a/' * (size // 20), 'title': text[:200], 'description': text},
+            'images_alt_texts': [text],
+        },
+        'created_at': '2025-01-01T00:00:00Z',
+    }
+
+def benchmark_classifier(n_records, size, seed=0):
+    """Times the full classification path on random, partly adversarial records"""
+    rng = random.Random(seed)
+    records = [random_record(rng, size) for _ in range(n_records)]
+    latencies = []
+    start = perf_counter()
+    for record in records:
+        record_start = perf_counter()
+        is_paper_post(record, get_search_text(record))
+        latencies.append(perf_counter() - record_start)
+    elapsed = perf_counter() - start
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'Classified {n_records} records of ~{size} chars: {n_records / elapsed:.0f} posts/s, '
+          f'p99 {p99 * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz and benchmark the paper classifier patterns')
+    parser.add_argument('--quick', action='store_true', help='use smaller inputs')
+    parser.add_argument('--records', type=int, default=2000, help='records for the classifier benchmark')
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    failed = fuzz_all(sizes)
+    benchmark_classifier(args.records if not args.quick else args.records // 10, 3000)
+    benchmark_classifier(args.records // 10, 50000)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
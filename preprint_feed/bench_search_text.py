@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Allocation benchmark for building post search text.
+# Run from the preprint_feed directory:
+#   python3 bench_search_text.py
+#
+# Compares the eager builder that post_utils used before SearchText (kept below as the
+# reference) with the lazy SearchText, on typical posts and on posts with an arXiv link,
+# where is_paper_post decides without building the full text. For every case it reports
+# the peak bytes allocated while handling one post (tracemalloc) and the time per post.
+import argparse
+import random
+import tracemalloc
+from time import perf_counter
+from urllib.parse import unquote
+
+from server.classifier import classify_post, is_paper_post
+from server.post_utils import (SearchText, get_search_text, _capped, MAX_TEXT_LENGTH, MAX_URL_LENGTH,
+                               MAX_TITLE_LENGTH, MAX_DESCRIPTION_LENGTH, MAX_ALT_TEXT_LENGTH)
+
+def eager_search_text(record):
+    """The previous get_search_text: every field is normalized up front, then formatted into one string"""
+    post_text = record.get('text', '')[:MAX_TEXT_LENGTH].lower()
+    facet_url_str = " ".join([url[:MAX_URL_LENGTH].lower() for url in _capped(record.get('urls', [])) if url])
+    mentions_str = " ".join([m[:MAX_TITLE_LENGTH].lower() for m in _capped(record.get('mentions', [])) if m])
+    facet_tags = [tag[:MAX_TITLE_LENGTH].lower() for tag in _capped(record.get('facet_tags', [])) if tag]
+    standalone_tags = [tag[:MAX_TITLE_LENGTH].lower() for tag in _capped(record.get('tags')) if tag]
+    tags_str = " ".join(facet_tags + standalone_tags)
+    labels_str = " ".join([l[:MAX_TITLE_LENGTH].lower() for l in _capped(record.get('label_values', [])) if l])
+
+    external_uri = external_title = external_description = quoted_text = quoted_uri = images_alt_text = ""
+    embed_data = record.get('embed', {})
+    if isinstance(embed_data, dict):
+        external_data = embed_data.get('external', {})
+        if isinstance(external_data, dict):
+            external_uri = external_data.get('uri', '')[:MAX_URL_LENGTH].lower()
+            external_title = external_data.get('title', '')[:MAX_TITLE_LENGTH].lower()
+            external_description = external_data.get('description', '')[:MAX_DESCRIPTION_LENGTH].lower()
+        alt_texts = [a[:MAX_ALT_TEXT_LENGTH].lower() for a in _capped(embed_data.get('images_alt_texts', [])) if a]
+        images_alt_text = " ".join(alt_texts)
+        quoted_record = embed_data.get('record', {})
+        if isinstance(quoted_record, dict):
+            quoted_text = quoted_record.get('text', '')[:MAX_TEXT_LENGTH].lower()
+            quoted_uri = quoted_record.get('uri', '')[:MAX_URL_LENGTH].lower()
+
+    external_uri = unquote(external_uri)
+    quoted_uri = unquote(quoted_uri)
+    facet_url_str = unquote(facet_url_str)
+    return f"{post_text} {external_uri} {external_title} {external_description} {quoted_text} {quoted_uri} {facet_url_str} {mentions_str} {tags_str} {labels_str} {images_alt_text}"
+
+WORDS = ['new', 'paper', 'out', 'today', 'we', 'show', 'that', 'the', 'cat', 'sat', 'on', 'a', 'mat', 'Science', 'Thread']
+
+def random_record(rng, arxiv=False):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 50)))
+    uri = f'https://arxiv.org/abs/2401.{rng.randint(10000, 99999)}' if arxiv else f'https://example.com/{rng.randint(0, 10**6)}'
+    return {
+        'text': text,
+        'urls': [uri],
+        'mentions': ['did:plc:' + 'x' * 24] if rng.random() < 0.3 else [],
+        'facet_tags': ['science'] if rng.random() < 0.2 else [],
+        'embed': {
+            'external': {'uri': uri, 'title': text[:80].title(), 'description': text},
+            'images_alt_texts': [text[:40]] if rng.random() < 0.2 else [],
+        },
+        'created_at': '2025-01-01T00:00:00Z',
+    }
+
+def measure(name, records, handle):
+    """Peak bytes allocated per post (mean) with tracemalloc, then time per post without it"""
+    tracemalloc.start()
+    peak_total = 0
+    for record in records:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        handle(record)
+        peak_total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    start = perf_counter()
+    for record in records:
+        handle(record)
+    elapsed = perf_counter() - start
+    print(f'  {name:<48} {peak_total / len(records):>9.0f} B peak/post  {elapsed / len(records) * 1e6:>8.1f} us/post')
+    return peak_total / len(records)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare allocations of the eager and lazy search text builders')
+    parser.add_argument('--records', type=int, default=5000, help='records per case')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    typical = [random_record(rng) for _ in range(args.records)]
+    arxiv = [random_record(rng, arxiv=True) for _ in range(args.records)]
+    assert all(eager_search_text(record) == get_search_text(record) for record in typical + arxiv)
+
+    print('Build the full search text:')
+    measure('eager', typical, eager_search_text)
+    measure('SearchText.text', typical, lambda record: SearchText(record).text)
+
+    print('Read one field (embed link) for a cheap check:')
+    measure('eager', typical, lambda record: eager_search_text(record).split(' ', 2)[1])
+    measure('SearchText.external_uri', typical, lambda record: SearchText(record).external_uri)
+
+    print('is_paper_post on posts with an arXiv link:')
+    measure('eager text + classify_post', arxiv, lambda record: classify_post(record, eager_search_text(record)).is_paper)
+    measure('is_paper_post (lazy)', arxiv, is_paper_post)
+
+    print('Full classification of typical posts:')
+    measure('eager text + classify_post', typical, lambda record: classify_post(record, eager_search_text(record)))
+    measure('SearchText + classify_post', typical, lambda record: classify_post(record, SearchText(record)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Labelled-corpus evaluation harness for the paper classifier.
+# Run from the preprint_feed directory:
+#   python3 evaluate_classifier.py corpus.jsonl
+#   python3 evaluate_classifier.py corpus.jsonl --compare-patterns /path/to/new_patterns.json
+#   python3 evaluate_classifier.py corpus.jsonl --compare-engine mymodule:classify
+#
+# The corpus is JSONL with one labelled post per line, where "record" is a post record as built by
+# app_main.prepare_record and "label" says whether it is a paper post:
+#   {"uri": "at://...", "record": {"text": "...", "embed": {...}, ...}, "label": true}
+#
+# Reports precision, recall, confusion examples, posts per second and p99 latency per record.
+# With --compare-patterns or --compare-engine, it also runs the second classifier and lists every
+# record the two disagree on, so rule changes and performance work ship with evidence.
+import argparse
+import importlib
+import json
+import sys
+from time import perf_counter
+
+from server.patterns import get_pattern_set, load_pattern_set
+
+DEFAULT_ENGINE = 'server.classifier:classify_record'
+
+# Characters of post text shown for each example
+EXAMPLE_TEXT_LENGTH = 160
+
+def load_corpus(path):
+    corpus = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                sys.exit(f'{path}:{line_number}: invalid JSON: {e}')
+            if not isinstance(entry.get('record'), dict) or not isinstance(entry.get('label'), bool):
+                sys.exit(f'{path}:{line_number}: each line needs a "record" object and a boolean "label"')
+            entry.setdefault('uri', f'{path}:{line_number}')
+            corpus.append(entry)
+    return corpus
+
+def load_engine(spec):
+    """Resolves a "module:function" spec to a callable taking (record, pattern_set=...)"""
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        sys.exit(f'Engine must be given as module:function, got {spec!r}')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def run(corpus, engine, pattern_set):
+    """Classifies every record, returning the predictions and per-record latencies"""
+    predictions = []
+    latencies = []
+    for entry in corpus:
+        start = perf_counter()
+        predictions.append(bool(engine(entry['record'], pattern_set=pattern_set)))
+        latencies.append(perf_counter() - start)
+    return predictions, latencies
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def summarize(name, corpus, predictions, latencies, n_examples):
+    true_pos = [e for e, p in zip(corpus, predictions) if p and e['label']]
+    false_pos = [e for e, p in zip(corpus, predictions) if p and not e['label']]
+    false_neg = [e for e, p in zip(corpus, predictions) if not p and e['label']]
+    true_neg = len(corpus) - len(true_pos) - len(false_pos) - len(false_neg)
+
+    precision = len(true_pos) / (len(true_pos) + len(false_pos)) if true_pos or false_pos else 0.0
+    recall = len(true_pos) / (len(true_pos) + len(false_neg)) if true_pos or false_neg else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    total_time = sum(latencies)
+    sorted_latencies = sorted(latencies)
+
+    print(f'== {name}')
+    print(f'   records: {len(corpus)}  TP: {len(true_pos)}  FP: {len(false_pos)}  FN: {len(false_neg)}  TN: {true_neg}')
+    print(f'   precision: {precision:.4f}  recall: {recall:.4f}  F1: {f1:.4f}')
+    print(f'   throughput: {len(corpus) / total_time:.0f} posts/s  '
+          f'p50: {percentile(sorted_latencies, 0.5) * 1000:.3f} ms  '
+          f'p99: {percentile(sorted_latencies, 0.99) * 1000:.3f} ms  '
+          f'max: {sorted_latencies[-1] * 1000:.3f} ms')
+    for label, examples in (('false positives', false_pos), ('false negatives', false_neg)):
+        if examples and n_examples:
+            print(f'   {label}:')
+            for entry in examples[:n_examples]:
+                print(f'     {entry["uri"]}: {format_example(entry)}')
+
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'posts_per_second': len(corpus) / total_time,
+            'p99_ms': percentile(sorted_latencies, 0.99) * 1000}
+
+def format_example(entry):
+    record = entry['record']
+    text = record.get('text', '').replace('\n', ' ')[:EXAMPLE_TEXT_LENGTH]
+    uri = record.get('embed', {}).get('external', {}).get('uri', '')
+    return f'{text!r} {uri}'.strip()
+
+def diff(corpus, name_a, predictions_a, name_b, predictions_b, n_examples):
+    changed = [(e, a, b) for e, a, b in zip(corpus, predictions_a, predictions_b) if a != b]
+    fixed = sum(1 for e, a, b in changed if b == e['label'])
+    print(f'== {name_a} -> {name_b}: {len(changed)} records changed ({fixed} fixed, {len(changed) - fixed} broken)')
+    for entry, a, b in changed[:n_examples]:
+        status = 'fixed' if b == entry['label'] else 'broken'
+        print(f'     {status}: {entry["uri"]} label={entry["label"]} {a}->{b}: {format_example(entry)}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate classifier accuracy and throughput on a labelled corpus')
+    parser.add_argument('corpus', help='JSONL file of {"record": ..., "label": bool}')
+    parser.add_argument('--patterns', help='patterns file to evaluate (default: the active one)')
+    parser.add_argument('--engine', default=DEFAULT_ENGINE, help='classifier as module:function')
+    parser.add_argument('--compare-patterns', help='second patterns file to diff against')
+    parser.add_argument('--compare-engine', help='second classifier (module:function) to diff against')
+    parser.add_argument('--examples', type=int, default=5, help='confusion examples to print per category')
+    parser.add_argument('--json', action='store_true', help='also print the summary metrics as JSON')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        sys.exit('Corpus is empty')
+
+    pattern_set = load_pattern_set(args.patterns) if args.patterns else get_pattern_set()
+    engine = load_engine(args.engine)
+    name_a = f'{args.engine} @ patterns {pattern_set.version}'
+    predictions_a, latencies_a = run(corpus, engine, pattern_set)
+    results = {name_a: summarize(name_a, corpus, predictions_a, latencies_a, args.examples)}
+
+    if args.compare_patterns or args.compare_engine:
+        pattern_set_b = load_pattern_set(args.compare_patterns) if args.compare_patterns else pattern_set
+        engine_spec_b = args.compare_engine or args.engine
+        name_b = f'{engine_spec_b} @ patterns {pattern_set_b.version}'
+        predictions_b, latencies_b = run(corpus, load_engine(engine_spec_b), pattern_set_b)
+        results[name_b] = summarize(name_b, corpus, predictions_b, latencies_b, args.examples)
+        diff(corpus, name_a, predictions_a, name_b, predictions_b, args.examples)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
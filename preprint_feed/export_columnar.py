@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Exports the research tables to date-partitioned, compressed Parquet files, so that analyses read a
+# few columns from local files instead of scanning the production tables. Run from the preprint_feed
+# directory (needs pyarrow, which the feed itself does not):
+#   python3 export_columnar.py                                  # every table, new days only
+#   python3 export_columnar.py --tables interactions reposts    # some of them
+#   python3 export_columnar.py --full                           # every day again, ignoring the watermarks
+#
+# Each table is written under --out-dir as a Hive-partitioned dataset, which pyarrow.dataset, pandas,
+# Polars and DuckDB read as is (with the day as a column):
+#   <out-dir>/<table>/day=YYYY-MM-DD/part-<segment>-<n>.parquet
+# An item's day comes from its day attribute (CreatedDateDay, created_at_day, access_date_day) or
+# else the date of its timestamp; items with neither go to day=unknown. Numbers are int64 when whole,
+# lists, maps and sets are stored as JSON strings (as are attributes whose type varies between items),
+# and columns are the union of the items' attributes.
+#
+# Incremental runs: _watermarks.json in --out-dir holds, for each table, the latest day exported (never
+# later than the day of the export, as clients can date records in the future). A run re-exports
+# the days from --lookback days before the watermark on: those may have gained items since (late
+# records, the rest of the day the last run ended in), and each one is rewritten whole, so a day is
+# never exported twice or half. Records dated further back by their clients are only picked up by
+# --full or a larger --lookback.
+#
+# Items are still read with a parallel segmented Scan, so a run costs a full read of each table; what
+# the watermarks save is the writing and the memory, and the data is then read locally as often as
+# wanted. A run's files are written to a staging directory first, and a day's files are only
+# replaced once every segment of its table has been written.
+#
+# Items archived by tier_tables.py before they expire from the tables are in the same datasets, in
+# tiered-* files of their own; the export leaves those files, and the items they hold, alone.
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
+
+from server.storage import default_storage
+
+DEFAULT_OUT_DIR = 'exports'
+WATERMARKS_FILE = '_watermarks.json'
+
+# Table -> (attribute holding the item's day, timestamp attribute whose date is used otherwise)
+EXPORT_TABLES = {
+    'paper_posts': ('CreatedDateDay', 'CreatedDate'),
+    'interactions': ('created_at_day', 'created_at'),
+    'reposts': (None, 'created_at'),
+    'quoteposts': (None, 'created_date'),
+    'user_accesses': ('access_date_day', 'access_date'),
+    'counterfactual_recs': (None, 'save_date')
+}
+
+UNKNOWN_DAY = 'unknown'
+DAY_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# Items per Scan page (DynamoDB also ends a page at 1 MB)
+SCAN_PAGE_SIZE = 1000
+
+# Rows of one day buffered by a segment before they are written as a file of their own
+ROWS_PER_FILE = 100000
+
+COMPRESSION = 'zstd'
+
+# Files written by this export; tier_tables.py writes the items it archives as tiered-* files
+PART_PREFIX = 'part-'
+
+# Items given this attribute (their expiry time, in epoch seconds) by tier_tables.py have been
+# archived, and are left out of the export
+TTL_ATTRIBUTE = 'expires_at'
+
+_storage = None
+_pyarrow = None
+
+def init_worker():
+    global _storage, _pyarrow
+    _storage = default_storage()
+    _pyarrow = import_pyarrow()
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit('The export needs pyarrow: pip install pyarrow')
+    return pyarrow
+
+def item_day(item, day_attribute, timestamp_attribute):
+    """The YYYY-MM-DD day an item is filed under, or UNKNOWN_DAY"""
+    for value in (item.get(day_attribute) if day_attribute else None, item.get(timestamp_attribute)):
+        if isinstance(value, str) and DAY_PATTERN.match(value):
+            return value[:10]
+    return UNKNOWN_DAY
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    raise TypeError(f'{type(value).__name__} is not serializable')
+
+def column_value(value):
+    """An item attribute as a Parquet scalar: str, bool, int, float, or a JSON string for anything nested"""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return json.dumps(value, default=_json_default, separators=(',', ':'), sort_keys=True)
+
+def column_array(values):
+    try:
+        return _pyarrow.array(values)
+    except (_pyarrow.ArrowInvalid, _pyarrow.ArrowTypeError):
+        # an attribute whose type varies between items (e.g. a number in some, a string in others)
+        return _pyarrow.array([value if value is None or isinstance(value, str) else json.dumps(value) for value in values],
+                              type=_pyarrow.string())
+
+def write_part(rows, path):
+    columns = sorted({attribute for row in rows for attribute in row})
+    table = _pyarrow.table({column: column_array([column_value(row.get(column)) for row in rows]) for column in columns})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # dot files are skipped by dataset readers, so a file is only seen once complete
+    partial = os.path.join(os.path.dirname(path), '.' + os.path.basename(path))
+    _pyarrow.parquet.write_table(table, partial, compression=COMPRESSION)
+    os.replace(partial, path)
+
+def export_segment(task):
+    """Scans one segment of a table into the staging directory; returns {day: rows written}"""
+    table_name, segment, total_segments, start_day, staging_dir = task
+    day_attribute, timestamp_attribute = EXPORT_TABLES[table_name]
+    buffers = {}    # day -> rows not written yet
+    parts = {}      # day -> files written
+    counts = {}
+
+    def write(day):
+        rows = buffers.pop(day)
+        n = parts.get(day, 0)
+        write_part(rows, os.path.join(staging_dir, f'day={day}', f'{PART_PREFIX}{segment:04d}-{n:04d}.parquet'))
+        parts[day] = n + 1
+
+    start = None
+    while True:
+        items, start = _storage.scan_page(table_name, start=start, limit=SCAN_PAGE_SIZE,
+                                          segment=segment, total_segments=total_segments)
+        for item in items:
+            if TTL_ATTRIBUTE in item:
+                continue
+            day = item_day(item, day_attribute, timestamp_attribute)
+            # unknown days are rewritten every run: the scan reads all of them anyway
+            if start_day and day != UNKNOWN_DAY and day < start_day:
+                continue
+            buffers.setdefault(day, []).append(item)
+            counts[day] = counts.get(day, 0) + 1
+            if len(buffers[day]) >= ROWS_PER_FILE:
+                write(day)
+        if start is None:
+            break
+    for day in list(buffers):
+        write(day)
+    return table_name, segment, counts
+
+def load_watermarks(out_dir):
+    path = os.path.join(out_dir, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_watermarks(out_dir, watermarks):
+    path = os.path.join(out_dir, WATERMARKS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def start_day(watermark, lookback):
+    """The first day a run re-exports, or None for all of them"""
+    if not watermark:
+        return None
+    return (date.fromisoformat(watermark['day']) - timedelta(days=lookback)).isoformat()
+
+def publish(staging_dir, table_dir):
+    """
+    Replaces the exported files of each day a run staged with the new ones. Files archived by
+    tier_tables.py (tiered-*) are left alone.
+    """
+    for name in sorted(os.listdir(staging_dir)):
+        day_dir = os.path.join(table_dir, name)
+        os.makedirs(day_dir, exist_ok=True)
+        old = {file_name for file_name in os.listdir(day_dir) if file_name.startswith(PART_PREFIX)}
+        for file_name in sorted(os.listdir(os.path.join(staging_dir, name))):
+            os.replace(os.path.join(staging_dir, name, file_name), os.path.join(day_dir, file_name))
+            old.discard(file_name)
+        for file_name in old:
+            os.remove(os.path.join(day_dir, file_name))
+    shutil.rmtree(staging_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export tables to date-partitioned Parquet files, incrementally')
+    parser.add_argument('--tables', nargs='+', choices=list(EXPORT_TABLES), default=list(EXPORT_TABLES), help='tables to export')
+    parser.add_argument('--out-dir', default=DEFAULT_OUT_DIR, help='where the datasets and watermarks are written')
+    parser.add_argument('--lookback', type=int, default=2, help='days before the watermark that are exported again')
+    parser.add_argument('--full', action='store_true', help='export every day, ignoring the watermarks')
+    parser.add_argument('--segments', type=int, default=32, help='parallel scan segments per table')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args()
+
+    import_pyarrow()
+    os.makedirs(args.out_dir, exist_ok=True)
+    watermarks = load_watermarks(args.out_dir)
+    today = datetime.now(timezone.utc).date().isoformat()
+
+    # spawn rather than fork, so every worker creates its own DynamoDB client
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes, initializer=init_worker) as pool:
+        for table_name in args.tables:
+            first_day = None if args.full else start_day(watermarks.get(table_name), args.lookback)
+            staging_dir = os.path.join(args.out_dir, f'.staging-{table_name}')
+            if os.path.exists(staging_dir):
+                # left by an interrupted run
+                shutil.rmtree(staging_dir)
+            tasks = [(table_name, segment, args.segments, first_day, staging_dir) for segment in range(args.segments)]
+
+            start = perf_counter()
+            days = {}
+            for n_done, (_, segment, counts) in enumerate(pool.imap_unordered(export_segment, tasks), start=1):
+                for day, n in counts.items():
+                    days[day] = days.get(day, 0) + n
+                print(f'[{table_name} {n_done}/{len(tasks)}] segment {segment}: {sum(counts.values())} rows; '
+                      f'total {sum(days.values())} in {perf_counter() - start:.0f}s', flush=True)
+
+            if os.path.exists(staging_dir):
+                publish(staging_dir, os.path.join(args.out_dir, table_name))
+            known_days = [day for day in days if day != UNKNOWN_DAY]
+            latest = min(max(known_days), today) if known_days else None
+            previous = (watermarks.get(table_name) or {}).get('day')
+            if previous and (latest is None or previous > latest):
+                latest = previous
+            if latest:
+                watermarks[table_name] = {'day': latest, 'exported_at': datetime.now(timezone.utc).isoformat()}
+                save_watermarks(args.out_dir, watermarks)
+            print(f'Exported {table_name}: {sum(days.values())} rows in {len(days)} days '
+                  f'from {first_day or "the start"}; watermark {latest}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# Seeds the author_activity items (see server/author_activity.py) of every author whose posts,
+# reposts or quoteposts are stored, once, after the workers that keep the items are deployed. Run
+# from the preprint_feed directory:
+#   python3 seed_author_activity.py --dry-run                    # count the authors, write nothing
+#   python3 seed_author_activity.py --segments 32 --processes 8
+#
+# paper_posts, reposts and quoteposts are read with a parallel segmented Scan of their author
+# attribute (the partition key of the index the items are seeded from). Every author found gets an
+# item from the indexes, written only if they have none (the workers' items are as new), also when
+# all its lists are empty. Once every author has one, the SEEDED_MARKER item is written: from then
+# on the recommendation generator takes an account without an item to have no activity, rather than
+# querying the indexes for it. Rerunning is safe; it only writes the items that are missing.
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+
+from server import author_activity
+from server.database_dynamo import storage
+from server.storage import INDEXES
+
+# Items per Scan page (DynamoDB also ends a page at 1 MB)
+SCAN_PAGE_SIZE = 1000
+
+# Authors per pool task, and concurrent seeds (three queries and a conditional put each) within one
+SEED_CHUNK_SIZE = 500
+SEED_THREADS = 8
+
+def author_attributes():
+    """table -> the attribute holding its items' author, for the tables items are seeded from"""
+    return {table_name: INDEXES[table_name][index][0] for table_name, index in author_activity.SEED_INDEXES.values()}
+
+def scan_authors(task):
+    """The authors of one segment of a table's items"""
+    table_name, attribute, segment, total_segments = task
+    authors = set()
+    start = None
+    while True:
+        items, start = storage.scan_page(table_name, start=start, limit=SCAN_PAGE_SIZE, segment=segment,
+                                         total_segments=total_segments, attributes=[attribute])
+        authors.update(item[attribute] for item in items if item.get(attribute))
+        if start is None:
+            return authors
+
+def seed_authors(author_dids):
+    """Seeds the items of authors that have none; returns how many were written"""
+    with ThreadPoolExecutor(max_workers=SEED_THREADS) as executor:
+        return sum(executor.map(author_activity.seed, author_dids))
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the author_activity items of every author with stored activity')
+    parser.add_argument('--segments', type=int, default=32, help='parallel scan segments per table')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='count the authors, but write nothing')
+    args = parser.parse_args()
+
+    start = perf_counter()
+    tasks = [(table_name, attribute, segment, args.segments)
+             for table_name, attribute in author_attributes().items() for segment in range(args.segments)]
+    authors = set()
+    # spawn rather than fork, so every worker creates its own DynamoDB client
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes) as pool:
+        for segment_authors in pool.imap_unordered(scan_authors, tasks):
+            authors.update(segment_authors)
+        print(f'Found {len(authors)} authors in {perf_counter() - start:.0f}s', flush=True)
+        if args.dry_run:
+            return
+
+        author_dids = sorted(authors)
+        chunks = [author_dids[i:i + SEED_CHUNK_SIZE] for i in range(0, len(author_dids), SEED_CHUNK_SIZE)]
+        n_seeded = 0
+        for n_done, n_written in enumerate(pool.imap_unordered(seed_authors, chunks), start=1):
+            n_seeded += n_written
+            print(f'[{n_done}/{len(chunks)}] seeded {n_seeded} items in {perf_counter() - start:.0f}s', flush=True)
+
+    storage.put_item(author_activity.TABLE, {'author_did': author_activity.SEEDED_MARKER,
+                                             'seeded_at': datetime.now(timezone.utc).isoformat()})
+    print(f'Seeded {n_seeded} items ({len(authors) - n_seeded} authors already had one); wrote the seeded marker')
+
+
+if __name__ == '__main__':
+    main()
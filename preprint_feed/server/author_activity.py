@@ -0,0 +1,220 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from server import config
+from server.database_dynamo import storage
+from server.logger import logger
+from server.timestamps import parse_ms
+
+# One author_activity item per author whose posts, reposts or quoteposts we store, holding their
+# newest live ones, newest first, as the recommendation generator uses them:
+#   {'author_did', 'posts': [...], 'reposts': [...], 'quoteposts': [...], 'version'}
+# so that it reads 100 authors per BatchGetItem instead of querying three indexes per author. Each
+# list keeps config.AUTHOR_ACTIVITY_SIZE entries, more than the generator uses, so that deletions
+# still leave it enough without reading the indexes again. Engagement counts are not kept here.
+#
+# Workers collect the changes of the posts they process, and apply them every
+# config.AUTHOR_ACTIVITY_FLUSH_INTERVAL seconds as one read and one conditional write per author:
+# the write only succeeds if the item's version is still the one read, and is otherwise made again
+# from the item another worker wrote. An author's first item is seeded from the indexes, so it holds
+# what came before too. The flush runs in a background thread, so the worker loop never waits for it.
+#
+# seed_author_activity.py writes the items of every author with stored activity once (also those
+# whose lists are empty), then the SEEDED_MARKER item: from then on, the generator takes an account
+# without an item to have no activity, instead of querying the indexes for it.
+
+TABLE = 'author_activity'
+KINDS = ('posts', 'reposts', 'quoteposts')
+
+# Key of the item written once every author with stored activity has one
+SEEDED_MARKER = '#seeded'
+
+# Post statuses that take a post out of the activity (as out of recommendations)
+HIDDEN_STATUSES = ['deleted', 'excluded']
+
+# Indexes a new item is seeded from: kind -> (table, index)
+SEED_INDEXES = {
+    'posts': ('paper_posts', 'AuthorDID-CreatedDate-index'),
+    'reposts': ('reposts', 'user_did-created_at-index'),
+    'quoteposts': ('quoteposts', 'user_did-created_date-index')
+}
+
+# Conditional writes of one author's item before its changes are kept for the next flush
+MAX_ATTEMPTS = 5
+
+# Concurrent authors per flush (the storage backends are thread-safe)
+FLUSH_THREADS = 8
+
+# author DID -> kind -> post URI -> entry to add, or None to remove, for this worker process.
+# Collected by the worker loop and written by a background flush, so both hold _lock to touch it.
+_pending = defaultdict(lambda: defaultdict(dict))
+_lock = threading.Lock()
+_last_flush = time()
+_flusher = None         # the thread of the background flush in progress
+
+def author_of(uri):
+    """The DID of the repo an at:// URI is in, or None"""
+    if not uri or not uri.startswith('at://'):
+        return None
+    return uri[len('at://'):].split('/', 1)[0]
+
+def _ts(item, ts_attribute, date_attribute):
+    if item.get(ts_attribute) is not None:
+        return int(item[ts_attribute])
+    return parse_ms(item.get(date_attribute)) or 0
+
+def post_entry(post):
+    """The entry of a paper_posts item"""
+    return {
+        'post': post['at_uri'],
+        'createdDate': post.get('CreatedDate'),
+        'createdTs': _ts(post, 'CreatedTs', 'CreatedDate'),
+        'tags': list(post.get('Tags', [])),
+        'paperKey': post.get('PaperKey')
+    }
+
+def repost_entry(repost):
+    """The entry of a reposts item"""
+    entry = {
+        'post': repost['post_uri'],
+        'createdDate': repost.get('created_at'),
+        'createdTs': _ts(repost, 'created_ts', 'created_at')
+    }
+    if repost.get('repost_uri') is not None:
+        entry['reason'] = {
+            '$type': 'app.bsky.feed.defs#skeletonReasonRepost',
+            'repost': repost['repost_uri']
+        }
+    return entry
+
+def quotepost_entry(quotepost):
+    """The entry of a quoteposts item"""
+    return {
+        'post': quotepost['at_uri'],
+        'createdDate': quotepost.get('created_date'),
+        'createdTs': _ts(quotepost, 'created_ts', 'created_date')
+    }
+
+ENTRIES = {'posts': post_entry, 'reposts': repost_entry, 'quoteposts': quotepost_entry}
+
+def add(author_did, kind, entries):
+    with _lock:
+        for entry in entries:
+            _pending[author_did][kind][entry['post']] = entry
+
+def remove(author_did, kind, post_uris):
+    with _lock:
+        for post_uri in post_uris:
+            _pending[author_did][kind][post_uri] = None
+
+def add_posts(posts):
+    """Adds stored paper posts (or replaces their entries, e.g. after re-tagging)"""
+    for post in posts:
+        add(post['AuthorDID'], 'posts', [post_entry(post)])
+
+def remove_posts(post_uris):
+    """Removes deleted or excluded paper posts, by URI"""
+    for post_uri in post_uris:
+        remove(author_of(post_uri), 'posts', [post_uri])
+
+def add_reposts(reposts):
+    for repost in reposts:
+        add(repost['user_did'], 'reposts', [repost_entry(repost)])
+
+def add_quoteposts(quoteposts):
+    for quotepost in quoteposts:
+        add(quotepost['user_did'], 'quoteposts', [quotepost_entry(quotepost)])
+
+def remove_interactions(table_name, key):
+    """Removes a deleted reposts or quoteposts item, given its key"""
+    if table_name == 'reposts':
+        remove(key['user_did'], 'reposts', [key['post_uri']])
+    elif table_name == 'quoteposts':
+        remove(author_of(key['at_uri']), 'quoteposts', [key['at_uri']])
+
+def _seed(author_did):
+    """A new item for an author, from their newest posts, reposts and quoteposts in the indexes"""
+    item = {'author_did': author_did}
+    for kind, (table_name, index) in SEED_INDEXES.items():
+        exclude = {'status': HIDDEN_STATUSES} if kind == 'posts' else None
+        items = storage.query(table_name, author_did, index=index, limit=config.AUTHOR_ACTIVITY_SIZE,
+                              newest_first=True, exclude=exclude)
+        item[kind] = [ENTRIES[kind](stored) for stored in items]
+    return item
+
+def seed(author_did):
+    """Writes an author's item from the indexes, unless they have one; returns whether it was written"""
+    item = _seed(author_did)
+    item['version'] = 1
+    return storage.put_item(TABLE, item, if_absent=True)
+
+def _merge(item, changes):
+    merged = {'author_did': item['author_did']}
+    for kind in KINDS:
+        entries = {entry['post']: entry for entry in item.get(kind, [])}
+        for post_uri, entry in changes.get(kind, {}).items():
+            if entry is None:
+                entries.pop(post_uri, None)
+            else:
+                entries[post_uri] = entry
+        merged[kind] = sorted(entries.values(), key=lambda entry: int(entry['createdTs']),
+                              reverse=True)[:config.AUTHOR_ACTIVITY_SIZE]
+    return merged
+
+def _apply(author_did, changes):
+    """Writes one author's changes; returns them if they should be retried"""
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            item = storage.get_item(TABLE, {'author_did': author_did})
+            version = item.get('version') if item else None
+            merged = _merge(item or _seed(author_did), changes)
+            merged['version'] = int(version or 0) + 1
+            if storage.put_item(TABLE, merged, if_match={'version': version}):
+                return None
+        except Exception as e:
+            logger.error(f"Error updating the activity of {author_did}: {str(e)}")
+            return changes
+    logger.error(f"Gave up updating the activity of {author_did} after {MAX_ATTEMPTS} conflicting writes")
+    return changes
+
+def _write(pending):
+    """Applies one flush's changes, one item write per author. Changes that fail are kept for the next flush."""
+    with ThreadPoolExecutor(max_workers=FLUSH_THREADS) as executor:
+        failed = list(executor.map(lambda item: (item[0], _apply(*item)), pending.items()))
+    with _lock:
+        for author_did, changes in failed:
+            if changes:
+                for kind, entries in changes.items():
+                    # changes collected since are newer
+                    _pending[author_did][kind] = {**entries, **_pending[author_did][kind]}
+
+def _take():
+    global _pending, _last_flush
+    with _lock:
+        pending, _pending = _pending, defaultdict(lambda: defaultdict(dict))
+    _last_flush = time()
+    pending.pop(None, None)
+    return pending
+
+def flush():
+    """Applies the collected changes and waits for them: called when the worker stops, after the background flush in progress"""
+    if _flusher is not None:
+        _flusher.join()
+    pending = _take()
+    if pending:
+        _write(pending)
+    return len(pending)
+
+def maybe_flush():
+    """Called from the worker loop: every AUTHOR_ACTIVITY_FLUSH_INTERVAL seconds, hands the changes to a background flush"""
+    global _flusher
+    if time() - _last_flush < config.AUTHOR_ACTIVITY_FLUSH_INTERVAL or (_flusher is not None and _flusher.is_alive()):
+        return 0
+    pending = _take()
+    if not pending:
+        return 0
+    _flusher = threading.Thread(target=_write, args=(pending,), name='author-activity-flush', daemon=True)
+    _flusher.start()
+    return len(pending)
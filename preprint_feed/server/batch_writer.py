@@ -0,0 +1,210 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from server import config
+from server.logger import logger
+from server.storage import is_throttling, match_condition
+
+# Items per BatchWriteItem request (the DynamoDB maximum)
+BATCH_SIZE = 25
+
+# Attempts at a batch's unprocessed or throttled items before they are given up
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 0.05
+BACKOFF_MAX = 5.0
+
+class BatchWriter:
+    """
+    Buffers puts and deletes for any number of tables, and writes them as BatchWriteItem requests
+    from a thread pool, so the worker loop never waits on DynamoDB. A table's buffer is written as
+    soon as it holds BATCH_SIZE items, and otherwise within config.WRITE_FLUSH_DEADLINE seconds of
+    its oldest item. Writes to the same key replace each other while buffered (the last one wins), and
+    a key's write waits in the buffer while a batch holding an earlier write of that key is in flight,
+    so that writes to a key land in the order they were made.
+
+    A put with if_match ({attribute: value}, None for an absent attribute) is only written if the
+    stored item has those values; BatchWriteItem has no conditions, so it is sent as its own PutItem
+    from the batch's thread, and dropped if the condition fails.
+
+    client is a thread-safe DynamoDB client; a resource's meta.client keeps the resource's conversion
+    of Python values. key_attributes(table_name) gives the key attribute names of a table. Each batch
+    first takes its items' worth of tokens from the limiter (a RateLimiter), if one is given, and
+    reports back whether it was throttled. Requests given up on (after an error other than throttling,
+    or MAX_ATTEMPTS throttled attempts) are passed to on_failure(table_name, requests, error), if given.
+    """
+    def __init__(self, client, key_attributes, limiter=None, threads=None, deadline=None, on_failure=None):
+        self.client = client
+        self.key_attributes = key_attributes
+        self.limiter = limiter
+        self.on_failure = on_failure
+        self.threads = threads or config.WRITE_THREADS
+        self.deadline = deadline or config.WRITE_FLUSH_DEADLINE
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        # bounds the batches in flight, so a slow table pushes back on the worker instead of piling up
+        self._in_flight = threading.BoundedSemaphore(self.threads * 4)
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._buffers = {}      # table name -> {key tuple: write request}
+        self._oldest = {}       # table name -> time its oldest buffered item was added
+        self._writing = {}      # table name -> {key tuple: batches in flight holding it}
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='batch-writer-flusher', daemon=True)
+        self._flusher.start()
+
+    def put(self, table_name, item, if_match=None):
+        request = {'PutRequest': {'Item': item}}
+        if if_match:
+            request['IfMatch'] = if_match
+        self._add(table_name, tuple(item[attribute] for attribute in self.key_attributes(table_name)), request)
+
+    def delete(self, table_name, key):
+        self._add(table_name, tuple(key[attribute] for attribute in self.key_attributes(table_name)),
+                  {'DeleteRequest': {'Key': key}})
+
+    def _add(self, table_name, key, request):
+        with self._lock:
+            buffer = self._buffers.setdefault(table_name, {})
+            if not buffer:
+                self._oldest[table_name] = time.monotonic()
+            buffer.pop(key, None)
+            buffer[key] = request
+            batch = self._take(table_name) if len(buffer) >= BATCH_SIZE else None
+        if batch:
+            self._submit(table_name, batch)
+
+    def _take(self, table_name):
+        """
+        Removes and returns up to BATCH_SIZE of a table's buffered requests whose keys are not in
+        flight, as {key tuple: request}, and marks their keys in flight. Call with the lock held.
+        """
+        buffer = self._buffers[table_name]
+        writing = self._writing.setdefault(table_name, {})
+        keys = [key for key in buffer if key not in writing][:BATCH_SIZE]
+        batch = {key: buffer.pop(key) for key in keys}
+        for key in keys:
+            writing[key] = writing.get(key, 0) + 1
+        self._oldest[table_name] = time.monotonic()
+        return batch
+
+    def _submit(self, table_name, batch):
+        self._in_flight.acquire()
+        future = self._executor.submit(self._write, table_name, list(batch.values()))
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda future: self._done(future, table_name, batch))
+
+    def _done(self, future, table_name, batch):
+        with self._lock:
+            self._futures.discard(future)
+            writing = self._writing[table_name]
+            for key in batch:
+                writing[key] -= 1
+                if not writing[key]:
+                    del writing[key]
+        self._in_flight.release()
+
+    def _put_if_match(self, table_name, requests):
+        """Writes conditional puts one PutItem at a time; returns the ones that were throttled"""
+        throttled = []
+        for request in requests:
+            try:
+                self.client.put_item(TableName=table_name, Item=request['PutRequest']['Item'],
+                                     **match_condition(request['IfMatch']))
+            except Exception as e:
+                if is_throttling(e):
+                    throttled.append(request)
+                elif getattr(e, 'response', {}).get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+        return throttled
+
+    def _write(self, table_name, requests):
+        """
+        Writes one batch, retrying unprocessed and throttled requests with backoff and jitter. Puts
+        written again after an error are harmless: they write the same item, under the same condition.
+        """
+        attempt = 0
+        while requests:
+            if self.limiter:
+                self.limiter.acquire(table_name, len(requests))
+            plain = [request for request in requests if 'IfMatch' not in request]
+            try:
+                remaining = self._put_if_match(table_name, [request for request in requests if 'IfMatch' in request])
+                if plain:
+                    response = self.client.batch_write_item(RequestItems={table_name: plain})
+                    remaining += response.get('UnprocessedItems', {}).get(table_name, [])
+            except Exception as e:
+                if not is_throttling(e):
+                    logger.error(f"Error writing {len(requests)} items to {table_name}: {str(e)}")
+                    self._give_up(table_name, requests, e)
+                    return
+                throttled = True
+            else:
+                # unprocessed items are DynamoDB throttling part of the batch
+                requests = remaining
+                throttled = bool(requests)
+
+            if self.limiter:
+                if throttled:
+                    self.limiter.throttled(table_name)
+                else:
+                    self.limiter.succeeded(table_name)
+            if requests:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    logger.error(f"Gave up writing {len(requests)} items to {table_name} after {attempt} attempts")
+                    self._give_up(table_name, requests, f'throttled {attempt} times')
+                    return
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+    def _give_up(self, table_name, requests, error):
+        if self.on_failure:
+            try:
+                self.on_failure(table_name, requests, error)
+            except Exception as e:
+                logger.error(f"Error handing over {len(requests)} failed writes to {table_name}: {str(e)}")
+
+    def _flush_due(self, force=False):
+        now = time.monotonic()
+        batches = []
+        with self._lock:
+            for table_name, buffer in self._buffers.items():
+                if buffer and (force or now - self._oldest[table_name] >= self.deadline):
+                    # what is left waits for the batches in flight with its keys
+                    while True:
+                        batch = self._take(table_name)
+                        if not batch:
+                            break
+                        batches.append((table_name, batch))
+        for table_name, batch in batches:
+            self._submit(table_name, batch)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.deadline / 2):
+            try:
+                self._flush_due()
+            except Exception as e:
+                logger.error(f"Error flushing buffered writes: {str(e)}")
+
+    def flush(self):
+        """Writes everything buffered and waits until all writes in flight have finished"""
+        while True:
+            self._flush_due(force=True)
+            with self._lock:
+                futures = list(self._futures)
+                if not futures and not any(self._buffers.values()):
+                    return
+            for future in futures:
+                future.result()
+
+    @property
+    def backlog(self):
+        """Items buffered and not yet submitted"""
+        with self._lock:
+            return sum(len(buffer) for buffer in self._buffers.values())
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        self._executor.shutdown(wait=True)
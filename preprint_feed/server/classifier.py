@@ -0,0 +1,144 @@
+from collections import namedtuple
+from time import perf_counter
+
+from server import config
+from server.logger import logger
+from server.post_utils import SearchText
+from server.patterns import get_pattern_set
+
+# Result of classifying one post: whether it is paper-related, and the frozenset of
+# tags (discipline and source type) of the pattern groups that matched
+Classification = namedtuple('Classification', ['is_paper', 'tags'])
+
+NOT_PAPER = Classification(False, frozenset())
+
+# Tags of a post with an arXiv link, which makes it a paper post whatever else it matches
+ARXIV_TAGS = frozenset({'source:preprint'})
+
+class ClassificationBudgetExceeded(Exception):
+    """Raised when checking a single post takes longer than its time budget"""
+
+def _check_deadline(deadline):
+    if deadline is not None and perf_counter() > deadline:
+        raise ClassificationBudgetExceeded()
+
+def classify_search_text(search_text, deadline=None, pattern_set=None, paper_tags=None):
+    """
+    Checks if a Bluesky post contains academic paper links or PDFs, including
+    paper announcements common on social media, and collects the tags of every
+    pattern group that matched in the same pass.
+
+    Args:
+        search_text: The lowercased search text built by get_search_text (SearchText.text)
+        deadline: Optional perf_counter() value after which ClassificationBudgetExceeded is raised
+        pattern_set: The PatternSet to check against; defaults to the active one
+        paper_tags: The tags of a post already known to be a paper post (e.g. ARXIV_TAGS); only
+            the paper patterns that could add other tags are run then, and no content pattern
+
+    Returns:
+        Classification: whether the post is a paper post, and its tags
+    """
+    if pattern_set is None:
+        pattern_set = get_pattern_set()
+
+    matched = paper_tags is not None
+    tags = set(paper_tags or ())
+    for compiled_pattern, pattern_tags in pattern_set.paper_candidates(search_text):
+        # once the post has matched, only patterns that could add new tags are worth running
+        if matched and pattern_tags <= tags:
+            continue
+        _check_deadline(deadline)
+        for match in compiled_pattern.finditer(search_text):
+            matched_text = match.group().lower()
+
+            # Check exclusions for PDFs (set lookup is faster)
+            if '.pdf' in matched_text:
+                if any(exclusion in matched_text for exclusion in pattern_set.pdf_exclusions):
+                    continue
+
+            matched = True
+            tags.update(pattern_tags)
+            break
+
+    if matched:
+        return Classification(True, frozenset(tags))
+
+    matches = 0
+    for compiled_pattern, _ in pattern_set.content_candidates(search_text):
+        _check_deadline(deadline)
+        if compiled_pattern.search(search_text):
+            matches += 1
+            # Return true if we find enough academic indicators (three in the shipped patterns)
+            if matches >= pattern_set.content_threshold:
+                return Classification(True, pattern_set.content_tags)
+
+    return NOT_PAPER
+
+def contains_paper_link(search_text, deadline=None, pattern_set=None) -> bool:
+    """Checks if a post's search text contains academic paper links or paper announcements"""
+    return classify_search_text(search_text, deadline=deadline, pattern_set=pattern_set).is_paper
+
+def contains_arxiv_link(record) -> bool:
+    """
+    Specifically checks for arXiv links in a post.
+
+    Args:
+        record: A dictionary containing post record data with 'text' and optional 'embed' fields
+
+    Returns:
+        bool: True if an arXiv link is found, False otherwise
+    """
+    # Safely extract text from record
+    post_text = record.get('text', '').lower()
+
+    # Safely extract external URI from embed data
+    external_uri = ''
+    embed_data = record.get('embed', {})
+    if isinstance(embed_data, dict):
+        external_data = embed_data.get('external', {})
+        if isinstance(external_data, dict):
+            external_uri = external_data.get('uri', '').lower()
+
+    # Check for arXiv links in either the post text or external URI
+    return 'arxiv.org' in post_text or 'arxiv.org' in external_uri
+
+def classify_post(record, search_text=None, time_budget=None, pattern_set=None):
+    """
+    Runs the full paper check for one post within a wall-clock budget, returning a Classification.
+    search_text may be the post's SearchText, or its joined text as a string; by default it is built here.
+
+    Python's re module cannot interrupt a running search, so the budget is checked
+    between patterns; the field limits in post_utils bound the cost of any single one.
+    If the budget runs out, only the post's links are checked against the paper patterns.
+
+    An arXiv link decides that the post is a paper post, and tags it as a preprint, before any
+    pattern runs: only the patterns that could add other tags (e.g. its discipline) are run then.
+    """
+    if pattern_set is None:
+        pattern_set = get_pattern_set()
+    if time_budget is None:
+        time_budget = config.CLASSIFICATION_TIME_BUDGET
+    if search_text is None:
+        search_text = SearchText(record)
+    text = search_text if isinstance(search_text, str) else search_text.text
+    paper_tags = ARXIV_TAGS if contains_arxiv_link(record) else None
+
+    try:
+        return classify_search_text(text, deadline=perf_counter() + time_budget, pattern_set=pattern_set, paper_tags=paper_tags)
+    except ClassificationBudgetExceeded:
+        logger.warning(f'Classification exceeded {time_budget}s for search text of length {len(text)}; checking links only')
+        link_text = SearchText(record).link_text if isinstance(search_text, str) else search_text.link_text
+        return classify_search_text(link_text, pattern_set=pattern_set, paper_tags=paper_tags)
+
+def is_paper_post(record, search_text=None, time_budget=None, pattern_set=None) -> bool:
+    """
+    Checks if a post is paper-related. An arXiv link decides this on its own, so it is checked
+    first, before the search text is built or any pattern runs.
+    """
+    if contains_arxiv_link(record):
+        return True
+    return classify_post(record, search_text, time_budget=time_budget, pattern_set=pattern_set).is_paper
+
+def classify_record(record, pattern_set=None) -> bool:
+    """Classifies a prepared post record from scratch; the entry point used by offline tooling"""
+    return is_paper_post(record, pattern_set=pattern_set)
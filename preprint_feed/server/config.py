@@ -7,4 +7,57 @@ if SERVICE_DID is None:
     SERVICE_DID = f'did:web:{HOSTNAME}'
 
 
-PREPRINT_URI = os.environ.get('PREPRINT_URI')
\ No newline at end of file
+PREPRINT_URI = os.environ.get('PREPRINT_URI')
+
+# Wall-clock budget (seconds) for classifying a single post before falling back to links only
+CLASSIFICATION_TIME_BUDGET = float(os.environ.get('CLASSIFICATION_TIME_BUDGET', 0.05))
+
+# PostURI rows (and so the posts whose likes, reposts and quotes are tracked) are kept for this many
+# days, then pruned by worker 0; 0 keeps them forever. Pruned rows are moved to the ArchivedPostURI
+# table unless POST_URI_ARCHIVE is false, in which case they are deleted.
+POST_URI_RETENTION_DAYS = float(os.environ.get('POST_URI_RETENTION_DAYS', 0))
+POST_URI_ARCHIVE = os.environ.get('POST_URI_ARCHIVE', 'true').lower() != 'false'
+
+# How often (seconds) each worker writes the engagement (like, repost and quote counts) it has counted,
+# and how many flushes a post's counts are retried in when its update fails other than by throttling
+# (e.g. while the post's own write is still buffered) before they are dropped
+ENGAGEMENT_FLUSH_INTERVAL = float(os.environ.get('ENGAGEMENT_FLUSH_INTERVAL', 10))
+ENGAGEMENT_MAX_ATTEMPTS = int(os.environ.get('ENGAGEMENT_MAX_ATTEMPTS', 30))
+
+# How often (seconds) each worker publishes its trending posts and papers, and how many of each it keeps
+TRENDING_PUBLISH_INTERVAL = float(os.environ.get('TRENDING_PUBLISH_INTERVAL', 60))
+TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K', 500))
+
+# How often (seconds) workers re-read the users table, whose members' follows are kept from the firehose
+USERS_REFRESH_INTERVAL = float(os.environ.get('USERS_REFRESH_INTERVAL', 300))
+
+# DynamoDB writes are buffered per worker and sent as 25-item batches from WRITE_THREADS threads;
+# a partial batch waits at most WRITE_FLUSH_DEADLINE seconds
+WRITE_THREADS = int(os.environ.get('WRITE_THREADS', 8))
+WRITE_FLUSH_DEADLINE = float(os.environ.get('WRITE_FLUSH_DEADLINE', 1.0))
+
+# Write rate (write units per second) of each table: the starting point, bounds and additive increase
+# of its AIMD adaptation to throttling, shared by all workers
+WRITE_RATE_INITIAL = float(os.environ.get('WRITE_RATE_INITIAL', 50))
+WRITE_RATE_MIN = float(os.environ.get('WRITE_RATE_MIN', 5))
+WRITE_RATE_MAX = float(os.environ.get('WRITE_RATE_MAX', 4000))
+WRITE_RATE_INCREASE = float(os.environ.get('WRITE_RATE_INCREASE', 1))
+
+# Where the tables live: 'dynamodb' (the deployed tables), 'sqlite' (STORAGE_SQLITE_FILE, shared by
+# the workers) or 'memory' (per process, for tests and benchmarks); see server/storage.py
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'dynamodb')
+STORAGE_SQLITE_FILE = os.environ.get('STORAGE_SQLITE_FILE', 'storage.db')
+
+# Writes that fail are logged in RETRY_LOG_DIR and replayed by the main process every
+# RETRY_DRAIN_INTERVAL seconds, backing off up to RETRY_BACKOFF_MAX seconds between attempts
+RETRY_LOG_DIR = os.environ.get('RETRY_LOG_DIR', 'retry_log')
+RETRY_DRAIN_INTERVAL = float(os.environ.get('RETRY_DRAIN_INTERVAL', 10))
+RETRY_BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 900))
+
+# Append-only file of the strings (DIDs, at:// URIs) given integer IDs by server/interning.py
+INTERN_FILE = os.environ.get('INTERN_FILE', 'interned_ids.log')
+
+# Entries of each kind kept on an author_activity item, and how often (seconds) each worker writes
+# the changes it has collected (see server/author_activity.py)
+AUTHOR_ACTIVITY_SIZE = int(os.environ.get('AUTHOR_ACTIVITY_SIZE', 20))
+AUTHOR_ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('AUTHOR_ACTIVITY_FLUSH_INTERVAL', 5))
@@ -1,83 +1,18 @@
 from collections import defaultdict
 from atproto import models
 from server.logger import logger
-from server.database_dynamo import store_post, store_likes, store_reposts, store_quoteposts, mark_post_deleted
-from server.database import PostURI, db
-from server.post_utils import get_search_text
-from server.patterns import COMPILED_PAPER_PATTERNS, COMPILED_CONTENT_PATTERNS, PDF_EXCLUSIONS
-
-def contains_paper_link(search_text) -> bool:
-    """
-    Checks if a Bluesky post contains academic paper links or PDFs, including
-    paper announcements common on social media.
-    
-    Args:
-        record: A dictionary containing post record data with 'text' and optional 'embed' fields
-        
-    Returns:
-        bool: True if any academic paper link or PDF is found, False otherwise
-    """
-
-    for compiled_pattern in COMPILED_PAPER_PATTERNS:
-        for match in compiled_pattern.finditer(search_text):
-            matched_text = match.group().lower()
-            
-            # Check exclusions for PDFs (set lookup is faster)
-            if '.pdf' in matched_text:
-                if any(exclusion in matched_text for exclusion in PDF_EXCLUSIONS):
-                    continue
-            
-            return True
-
-    matches = 0
-    for compiled_pattern in COMPILED_CONTENT_PATTERNS:
-        if compiled_pattern.search(search_text):
-            matches += 1
-            # Return true if we find at least three academic indicators
-            if matches >= 3:
-                return True
-    
-    # # Check for explicit paper URLs
-    # for pattern in paper_patterns:
-    #     if re.search(pattern, search_text):
-    #         return True
-    
-    # Look for multiple academic content indicators
-    # matches = 0
-    # for pattern in content_patterns:
-    #     if re.search(pattern, search_text):
-    #         matches += 1
-    #         # Return true if we find at least two academic indicators
-    #         if matches >= 2:
-    #             return True
-    
-
-    
-    return False
-
-def contains_arxiv_link(record) -> bool:
-    """
-    Specifically checks for arXiv links in a post.
-    
-    Args:
-        record: A dictionary containing post record data with 'text' and optional 'embed' fields
-        
-    Returns:
-        bool: True if an arXiv link is found, False otherwise
-    """
-    # Safely extract text from record
-    post_text = record.get('text', '').lower()
-    
-    # Safely extract external URI from embed data
-    external_uri = ''
-    embed_data = record.get('embed', {})
-    if isinstance(embed_data, dict):
-        external_data = embed_data.get('external', {})
-        if isinstance(external_data, dict):
-            external_uri = external_data.get('uri', '').lower()
-    
-    # Check for arXiv links in either the post text or external URI
-    return 'arxiv.org' in post_text or 'arxiv.org' in external_uri
+from server.database_dynamo import store_post, store_likes, store_reposts, store_quoteposts, store_paper_index, mark_post_deleted, delete_interactions, item_key, store_follows, delete_follows, store_tombstones
+from server.database import store_post_uris, store_interaction_records, pop_interaction_records
+from server.membership import stored_posts, add_stored_posts
+from server.post_utils import SearchText
+from server.paper_ids import extract_paper_keys, canonical_paper_key
+from server.classifier import classify_post
+from server.timestamps import created_ts
+from server import author_activity
+from server import engagement
+from server import trending
+from server.patterns import get_pattern_set
+from server.users import user_dids
 
 def format_event(event, event_type):
     record = event['record']
@@ -90,170 +25,289 @@ def format_event(event, event_type):
         'type': event_type
     }
 
+def classification_fields(search_text, classification, pattern_set):
+    """The paper post attributes that depend on the classifier: pattern version, tags and paper keys"""
+    fields = {
+        'PatternVersion': pattern_set.version,
+        'Tags': sorted(classification.tags)
+    }
+
+    # Canonical paper identifiers, so the same paper posted as different links can be collapsed
+    paper_keys = extract_paper_keys(search_text)
+    if paper_keys:
+        fields['PaperKey'] = canonical_paper_key(paper_keys)
+        fields['PaperKeys'] = paper_keys
+    return fields
+
+def format_paper_post(created_post, search_text, classification, pattern_set):
+    """Builds the paper_posts item for a post classified as paper-related"""
+    record = created_post['record']
+
+    # Handle reply data carefully using dictionary access
+    reply_root = reply_parent = None
+    reply_data = record.get('reply', {})
+    if isinstance(reply_data, dict):
+        # Extract root URI if available
+        root_data = reply_data.get('root', {})
+        if isinstance(root_data, dict):
+            reply_root = root_data.get('uri')
+        
+        # Extract parent URI if available
+        parent_data = reply_data.get('parent', {})
+        if isinstance(parent_data, dict):
+            reply_parent = parent_data.get('uri')
+
+    created_date_day = None
+    try:
+        created_date_day = record.get('created_at').split('T')[0]
+    except Exception as e:
+        logger.error(f"Error parsing created_at date: {e}")
+
+    # Create the post dictionary with all necessary fields
+    post_dict = {
+        'at_uri': created_post['uri'],
+        'CID': created_post['cid'],
+        'CreatedDate': record.get('created_at'),
+        'CreatedTs': created_ts(record.get('created_at')),
+        'AuthorDID': created_post['author'],
+        'CreatedDateDay': created_date_day,
+        'ReplyParent': reply_parent,
+        'ReplyRoot': reply_root,
+        'SearchText': search_text
+    }
+    post_dict.update(classification_fields(search_text, classification, pattern_set))
+    return post_dict
+
 def process_created_reposts(created_reposts):
     if len(created_reposts) > 0:
         r0 = created_reposts[0]
         logger.info(r0)
 
 def process_created_posts(created):
+    """
+    Makes the one pass over a batch's created posts: paper posts are classified and stored, and
+    quote posts are collected as (post, quoted post URI) pairs for process_created_quoteposts.
+    """
     posts_to_create = []
+    quoteposts = []
+    pattern_set = get_pattern_set()
 
     # Process all newly created posts
     for created_post in created:
         author = created_post['author']
         record = created_post['record']
 
-        search_text = get_search_text(record)
-
-        # Check if the post is paper-related
-        if contains_arxiv_link(record) or contains_paper_link(search_text):
-            # Handle reply data carefully using dictionary access
-            reply_root = reply_parent = None
-            reply_data = record.get('reply', {})
-            if isinstance(reply_data, dict):
-                # Extract root URI if available
-                root_data = reply_data.get('root', {})
-                if isinstance(root_data, dict):
-                    reply_root = root_data.get('uri')
-                
-                # Extract parent URI if available
-                parent_data = reply_data.get('parent', {})
-                if isinstance(parent_data, dict):
-                    reply_parent = parent_data.get('uri')
-            
+        if is_quote_post(record):
+            quoteposts.append((created_post, record['embed']['record']['uri']))
+
+        search_text = SearchText(record)
+
+        # Check if the post is paper-related, and which discipline/source tags it has
+        classification = classify_post(record, search_text, pattern_set=pattern_set)
+        if classification.is_paper:
             # Log the found paper-related post
             logger.info(author)
             logger.info(record.get('text', ''))
 
-            try:
-                created_date_day = record.get('created_at').split('T')[0]
-                print(created_date_day)
-            except Exception as e:
-                logger.error(f"Error parsing created_at date: {e}")
-
-
-            # Create the post dictionary with all necessary fields
-            post_dict = {
-                'at_uri': created_post['uri'],
-                'CID': created_post['cid'],
-                'CreatedDate': record.get('created_at'),
-                'AuthorDID': author,
-                'CreatedDateDay': created_date_day,
-                'ReplyParent': reply_parent,
-                'ReplyRoot': reply_root,
-                'SearchText': search_text
-            }
-            
-            posts_to_create.append(post_dict)
+            posts_to_create.append(format_paper_post(created_post, search_text.text, classification, pattern_set))
 
     # Store all paper-related posts in the database
     if posts_to_create:
         for post_dict in posts_to_create:
             store_post(post_dict)
+        store_paper_index(posts_to_create)
+        author_activity.add_posts(posts_to_create)
 
-        with db.atomic():
-            for post_dict in posts_to_create:
-                post_uri = post_dict['at_uri']
-                PostURI.create(uri=post_uri)
+        add_stored_posts(store_post_uris([post_dict['at_uri'] for post_dict in posts_to_create],
+                                         {post_dict['at_uri']: post_dict.get('PaperKey') for post_dict in posts_to_create}))
         logger.info(f'Added to feed: {len(posts_to_create)}')
 
-    return len(posts_to_create)
+    return len(posts_to_create), quoteposts
+
+def subject_uri(interaction: dict):
+    """The URI of the post a like or repost refers to, or None if its record has no subject"""
+    subject = interaction['record'].get('subject')
+    return subject.get('uri') if isinstance(subject, dict) else None
 
-def relevant_interaction(interaction: dict) -> bool:
-    # get the post referenced by this AppBskyFeedLike interaction, and check if it is in the posts database
-    uri = interaction['record']['subject']['uri']
-    in_db = PostURI.select().where(PostURI.uri == uri).exists()
+def relevant_interaction(interaction: dict, stored_uris) -> bool:
+    # check if the post referenced by this AppBskyFeedLike interaction is one of the stored paper posts
+    uri = subject_uri(interaction)
+    in_db = uri in stored_uris
     if in_db:
         print(f'Interaction {interaction["uri"]} is relevant: post {uri} is in the database')
     return in_db
 
-def relevant_repost(interaction: dict) -> bool:
-    # get the post referenced by this AppBskyFeedRepost interaction, and check if it is in the posts database
-    uri = interaction['record']['subject']['uri']
-    in_db = PostURI.select().where(PostURI.uri == uri).exists()
+def relevant_repost(interaction: dict, stored_uris) -> bool:
+    # check if the post referenced by this AppBskyFeedRepost interaction is one of the stored paper posts
+    uri = subject_uri(interaction)
+    in_db = uri in stored_uris
     if in_db:
         print(f'Repost {interaction["uri"]} is relevant: post {uri} is in the database')
     return in_db
 
-def relevant_quotepost(quote_uri: str) -> bool:
-    in_db = PostURI.select().where(PostURI.uri == quote_uri).exists()
+def relevant_quotepost(quote_uri: str, stored_uris) -> bool:
+    in_db = quote_uri in stored_uris
     if in_db:
         print(f'Quote post is relevant: post {quote_uri} is in the database')
     return in_db
 
-def process_created_likes(created_likes):
+def remember_interactions(table_name, record_uris, items, post_uri_attribute):
+    """
+    Records which DynamoDB item each stored like, repost or quote post record became, so deletes can
+    find it, and counts it towards the engagement of the post it refers to
+    """
+    store_interaction_records([(record_uri, table_name, item_key(table_name, item), item[post_uri_attribute])
+                               for record_uri, item in zip(record_uris, items)])
+    kind = engagement.TABLE_COUNTERS[table_name]
+    for item in items:
+        engagement.count(item[post_uri_attribute], kind)
+    trending.record([(item[post_uri_attribute], kind) for item in items])
+
+def process_created_likes(created_likes, stored_uris):
     interactions_to_create = []
+    record_uris = []
     for like_interaction in created_likes:
-        if relevant_interaction(like_interaction):
+        if relevant_interaction(like_interaction, stored_uris):
             interaction_dict = {
                 'user_did': like_interaction['author'],
                 'post_uri': like_interaction['record']['subject']['uri'],
                 'created_at': like_interaction['record']['created_at'],
+                'created_ts': created_ts(like_interaction['record']['created_at']),
                 'created_at_day': like_interaction['record']['created_at'].split('T')[0],
 	            'post_cid': like_interaction['cid']
             }
             interactions_to_create.append(interaction_dict)
+            record_uris.append(like_interaction['uri'])
             uri = like_interaction['uri']
             logger.info(f'Added interaction {uri}')
 
     store_likes(interactions_to_create)
+    remember_interactions('interactions', record_uris, interactions_to_create, 'post_uri')
     return len(interactions_to_create)
 
-def process_created_reposts(created_reposts):
+def process_created_reposts(created_reposts, stored_uris):
     reposts_to_create = []
+    record_uris = []
     for repost_interaction in created_reposts:
-        if relevant_repost(repost_interaction):
+        if relevant_repost(repost_interaction, stored_uris):
             interaction_dict = {
                 'user_did': repost_interaction['author'],
                 'post_uri': repost_interaction['record']['subject']['uri'],
                 'created_at': repost_interaction['record']['created_at'],
+                'created_ts': created_ts(repost_interaction['record']['created_at']),
 	            'post_cid': repost_interaction['cid'],
                 'repost_uri': repost_interaction['uri']
             }
             reposts_to_create.append(interaction_dict)
+            record_uris.append(repost_interaction['uri'])
             uri = repost_interaction['uri']
             logger.info(f'Added interaction {uri}')
 
     store_reposts(reposts_to_create)
+    author_activity.add_reposts(reposts_to_create)
+    remember_interactions('reposts', record_uris, reposts_to_create, 'post_uri')
     return len(reposts_to_create)
 
 def is_quote_post(record):
     return 'embed' in record and 'record' in record['embed'] and 'uri' in record['embed']['record']
 
-def process_created_quoteposts(created):
+def process_created_quoteposts(quoteposts, stored_uris):
     quoteposts_to_create = []
-    for quotepost in created: 
+    for quotepost, quote_uri in quoteposts:
         record = quotepost['record']
-        if is_quote_post(record):
-            quote_uri = record['embed']['record']['uri']
-            if relevant_quotepost(quote_uri):
-                logger.info(f'Found quotepost {quotepost["uri"]} referencing {quote_uri}')
-                quotepost_dict = {
-                    'at_uri': quotepost['uri'],
-                    'cid': quotepost['cid'],
-                    'created_date': record.get('created_at'),
-                    'user_did': quotepost['author'],
-                    'ref_uri': quote_uri,
-                    'text': record.get('text', ''),
-                }
-                quoteposts_to_create.append(quotepost_dict)
+        if relevant_quotepost(quote_uri, stored_uris):
+            logger.info(f'Found quotepost {quotepost["uri"]} referencing {quote_uri}')
+            quotepost_dict = {
+                'at_uri': quotepost['uri'],
+                'cid': quotepost['cid'],
+                'created_date': record.get('created_at'),
+                'created_ts': created_ts(record.get('created_at')),
+                'user_did': quotepost['author'],
+                'ref_uri': quote_uri,
+                'text': record.get('text', ''),
+            }
+            quoteposts_to_create.append(quotepost_dict)
 
     if quoteposts_to_create:
         store_quoteposts(quoteposts_to_create)
+        author_activity.add_quoteposts(quoteposts_to_create)
+        remember_interactions('quoteposts', [quotepost_dict['at_uri'] for quotepost_dict in quoteposts_to_create], quoteposts_to_create, 'ref_uri')
         logger.info(f'Added {len(quoteposts_to_create)} quoteposts to feed')
 
-def process_deleted_posts(deleted):
+def record_key(record_uri):
+    """The (repo DID, record key) of an at:// record URI"""
+    repo, _, rkey = record_uri[len('at://'):].split('/')
+    return repo, rkey
+
+def process_created_follows(created_follows):
+    """Stores the follows made by our users; everyone else's are dropped"""
+    our_users = user_dids()
+    follows_to_create = []
+    for follow in created_follows:
+        subject = follow['record'].get('subject')
+        if follow['author'] not in our_users or not isinstance(subject, dict) or not subject.get('did'):
+            continue
+        follows_to_create.append({
+            'user_did': follow['author'],
+            'rkey': record_key(follow['uri'])[1],
+            'subject_did': subject['did'],
+            'created_at': follow['record']['created_at']
+        })
+
+    if follows_to_create:
+        store_follows(follows_to_create)
+        logger.info(f'Added {len(follows_to_create)} follows')
+    return len(follows_to_create)
+
+def process_deleted_follows(deleted_follows):
+    """Deletes our users' unfollows; the follower and record key are both in the record URI"""
+    our_users = user_dids()
+    keys = []
+    for deleted_follow in deleted_follows:
+        user_did, rkey = record_key(deleted_follow['uri'])
+        if user_did in our_users:
+            keys.append({'user_did': user_did, 'rkey': rkey})
+
+    if keys:
+        delete_follows(keys)
+        logger.info(f'Deleted {len(keys)} follows')
+
+def process_deleted_posts(deleted, stored_uris):
+    tombstones = []
     for deleted_post in deleted:
         uri = deleted_post['uri']
 
-        # first, check if the post exists in the PostURI table
-        if not PostURI.select().where(PostURI.uri == uri).exists():
+        # first, check if the post is one of the stored paper posts
+        if uri not in stored_uris:
             continue
 
         # if it exists, delete it from the DynamoDB table
         mark_post_deleted(uri)
+        tombstones.append(uri)
         logger.info(f'Deleted post {uri} from DynamoDB')
 
+    # precomputed feeds still list these posts; the endpoint drops them using the tombstones
+    if tombstones:
+        store_tombstones(tombstones)
+        author_activity.remove_posts(tombstones)
+
+def process_deleted_interactions(deleted):
+    """
+    Deletes the stored likes, reposts and quote posts whose records were deleted (unlikes, un-reposts and
+    deleted quote posts), resolving the whole batch with one lookup in the interaction record index
+    """
+    keys_by_table = {}
+    for table_name, key, post_uri in pop_interaction_records([deleted_record['uri'] for deleted_record in deleted]):
+        keys_by_table.setdefault(table_name, []).append(key)
+        author_activity.remove_interactions(table_name, key)
+        if post_uri:
+            engagement.count(post_uri, engagement.TABLE_COUNTERS[table_name], -1)
+
+    if keys_by_table:
+        delete_interactions(keys_by_table)
+        for table_name, keys in keys_by_table.items():
+            logger.info(f'Deleted {len(keys)} items from {table_name}')
+
 def operations_callback(ops: defaultdict) -> None:
     """
     Processes incoming operations from the Bluesky firehose, filtering for paper-related posts.
@@ -261,15 +315,32 @@ def operations_callback(ops: defaultdict) -> None:
     Args:
         ops: A defaultdict containing created and deleted posts to process
     """
-
-    # feed post processing (filter to only paper posts)
-    n_posts_created = process_created_posts(ops[models.ids.AppBskyFeedPost]['created'])
-    
-    process_created_likes(ops[models.ids.AppBskyFeedLike]['created'])
-    process_created_reposts(ops[models.ids.AppBskyFeedRepost]['created'])
-    process_created_quoteposts(ops[models.ids.AppBskyFeedPost]['created'])
+    created_likes = ops[models.ids.AppBskyFeedLike]['created']
+    created_reposts = ops[models.ids.AppBskyFeedRepost]['created']
+    deleted_posts = ops[models.ids.AppBskyFeedPost]['deleted']
+
+    # feed post processing (filter to only paper posts, and collect quote posts), in one pass
+    n_posts_created, quoteposts = process_created_posts(ops[models.ids.AppBskyFeedPost]['created'])
+
+    # Every post this batch refers to is resolved in one probe of the membership index. This runs
+    # after the new paper posts are stored, so likes, quotes and deletes of them are caught too.
+    referenced_uris = {subject_uri(interaction) for interaction in created_likes}
+    referenced_uris.update(subject_uri(interaction) for interaction in created_reposts)
+    referenced_uris.update(quote_uri for _, quote_uri in quoteposts)
+    referenced_uris.update(deleted_post['uri'] for deleted_post in deleted_posts)
+    referenced_uris.discard(None)
+    stored_uris = stored_posts(referenced_uris)
+
+    process_created_likes(created_likes, stored_uris)
+    process_created_reposts(created_reposts, stored_uris)
+    process_created_quoteposts(quoteposts, stored_uris)
 
     # deletion processing
-    process_deleted_posts(ops[models.ids.AppBskyFeedPost]['deleted'])
+    process_deleted_posts(deleted_posts, stored_uris)
+    process_deleted_interactions(ops[models.ids.AppBskyFeedLike]['deleted'] + ops[models.ids.AppBskyFeedRepost]['deleted'] + deleted_posts)
+
+    # follow graph of our users
+    process_created_follows(ops[models.ids.AppBskyGraphFollow]['created'])
+    process_deleted_follows(ops[models.ids.AppBskyGraphFollow]['deleted'])
 
-    return n_posts_created
\ No newline at end of file
+    return n_posts_created
@@ -1,7 +1,7 @@
 from atproto import AtUri, CAR, firehose_models, FirehoseSubscribeReposClient, models, parse_subscribe_repos_message
 from atproto.exceptions import FirehoseError
 
-from server.database import SubscriptionState
+from server.database import SubscriptionState, init_db
 from server.logger import logger
 
 from time import sleep
@@ -11,6 +11,7 @@ _INTERESTED_RECORDS = {
     models.AppBskyFeedLike: models.ids.AppBskyFeedLike,
     models.AppBskyFeedRepost: models.ids.AppBskyFeedRepost,
     models.AppBskyFeedPost: models.ids.AppBskyFeedPost,
+    models.AppBskyGraphFollow: models.ids.AppBskyGraphFollow,
 }
 
 def create_operations_dict():
@@ -59,6 +60,7 @@ def _get_ops_by_type(commit: models.ComAtprotoSyncSubscribeRepos.Commit):
 
 
 def run(name, operations_callback, stream_stop_event=None):
+    init_db()
     run_count = 0
     last_print_time = datetime.now()
     while stream_stop_event is None or not stream_stop_event.is_set():
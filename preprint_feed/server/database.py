@@ -1,8 +1,29 @@
-from datetime import datetime
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
 
 import peewee
 
-db = peewee.SqliteDatabase('feed_database.db')
+DATABASE_FILE = os.environ.get('DATABASE_FILE', 'feed_database.db')
+
+# WAL lets the stream process and the workers read while one of them writes, and commits only
+# append to the log. synchronous=normal is durable against process crashes in WAL mode (only an
+# OS crash can lose the last commits), and busy_timeout makes writers wait for each other.
+PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,  # KiB, i.e. 64 MB of page cache per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+    'busy_timeout': 5000,
+}
+
+# Rows moved or deleted per transaction when pruning
+PRUNE_CHUNK_SIZE = 10000
+
+# Opened per process by init_db(): SQLite connections must not be carried across fork
+db = peewee.SqliteDatabase(None)
 
 
 class BaseModel(peewee.Model):
@@ -23,17 +44,179 @@ class SubscriptionState(BaseModel):
 
 
 class PostURI(BaseModel):
-    uri = peewee.CharField(index=True)
+    uri = peewee.CharField(unique=True)
+    created_at = peewee.DateTimeField(default=datetime.utcnow, index=True)
+    paper_key = peewee.CharField(null=True)  # canonical paper identifier, for trending papers
+
+
+class ArchivedPostURI(BaseModel):
+    """Cold partition for PostURI rows older than the retention horizon, when they are archived rather than deleted"""
+    uri = peewee.CharField(unique=True)
+    created_at = peewee.DateTimeField()
+    archived_at = peewee.DateTimeField(default=datetime.utcnow)
+
+
+class InteractionRecord(BaseModel):
+    """
+    Record URIs of the likes, reposts and quote posts we stored, keyed by a 64-bit hash of the URI
+    (the table's rowid, so an entry is a few dozen bytes), with the key of the DynamoDB item they
+    were stored as. Deletes of these records are resolved against it. A deleted record keeps its row,
+    marked with deleted_at, so that a failed put of its item replayed later is dropped rather than
+    bringing the item back (see interaction_deleted). Rows are pruned with the PostURI row of their
+    post (see prune_post_uris).
+    """
+    record_hash = peewee.IntegerField(primary_key=True)  # INTEGER PRIMARY KEY: the rowid itself, 64-bit
+    table_name = peewee.CharField()
+    item_key = peewee.TextField()
+    post_uri = peewee.CharField(null=True, index=True)  # the paper post the interaction is with
+    deleted_at = peewee.DateTimeField(null=True)
+
+
+def record_hash(record_uri):
+    """Signed 64-bit hash of a record URI, to fit an SQLite integer key"""
+    return int.from_bytes(hashlib.blake2b(record_uri.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def _add_missing_column(table, column, column_type):
+    """Adds a nullable column to an existing table; returns whether it was missing"""
+    if column in {existing.name for existing in db.get_columns(table)}:
+        return False
+    db.execute_sql(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+    return True
+
+def _migrate_post_uri():
+    """Brings a PostURI table from before created_at and the unique uri index up to date"""
+    if _add_missing_column('posturi', 'created_at', 'DATETIME'):
+        # the age of existing rows is unknown, so they count as stored now
+        PostURI.update(created_at=datetime.utcnow()).where(PostURI.created_at.is_null()).execute()
+    _add_missing_column('posturi', 'paper_key', 'VARCHAR(255)')
 
-if db.is_closed():
-    db.connect()
+    indexes = {index.name: index for index in db.get_indexes('posturi')}
+    if not any(index.unique and index.columns == ['uri'] for index in indexes.values()):
+        with db.atomic():
+            db.execute_sql('DELETE FROM posturi WHERE id NOT IN (SELECT MIN(id) FROM posturi GROUP BY uri)')
+            if 'posturi_uri' in indexes:
+                db.execute_sql('DROP INDEX posturi_uri')
+            db.execute_sql('CREATE UNIQUE INDEX posturi_uri ON posturi (uri)')
+
+def _migrate_interaction_records():
+    """
+    Brings an InteractionRecord table from before post_uri, its index or deleted_at up to date. Rows
+    of posts pruned before interaction records were pruned with them are dropped once, as the index is made.
+    """
+    _add_missing_column('interactionrecord', 'post_uri', 'VARCHAR(255)')
+    _add_missing_column('interactionrecord', 'deleted_at', 'DATETIME')
+    if any(index.columns == ['post_uri'] for index in db.get_indexes('interactionrecord')):
+        return
+    with db.atomic():
+        db.execute_sql('CREATE INDEX interactionrecord_post_uri ON interactionrecord (post_uri)')
+        db.execute_sql('DELETE FROM interactionrecord WHERE post_uri IS NOT NULL '
+                       'AND NOT EXISTS (SELECT 1 FROM posturi WHERE posturi.uri = interactionrecord.post_uri)')
+
+def init_db(path=DATABASE_FILE):
+    """
+    Opens this process's connection, creating or migrating the tables. Call it at the start of every
+    process that uses the database, and close the connection (db.close()) before forking.
+    """
+    db.init(path, pragmas=PRAGMAS)
+    db.connect(reuse_if_open=True)
 
     # Get existing tables
     existing_tables = db.get_tables()
-    
+
     # Drop the old Post table if it exists
     if 'post' in existing_tables:
         db.execute_sql('DROP TABLE IF EXISTS post;')
-    
+
+    if 'posturi' in existing_tables:
+        _migrate_post_uri()
+    if 'interactionrecord' in existing_tables:
+        _migrate_interaction_records()
+
     # Create tables (safe=True means it won't recreate existing tables)
-    db.create_tables([PostURI, SubscriptionState], safe=True)
\ No newline at end of file
+    db.create_tables([PostURI, ArchivedPostURI, InteractionRecord, SubscriptionState], safe=True)
+
+def store_post_uris(uris, paper_keys=None):
+    """
+    Inserts post URIs, with their canonical paper keys from the paper_keys dict if given, ignoring
+    ones already stored, and returns the PostURI rows of all of them
+    """
+    paper_keys = paper_keys or {}
+    with db.atomic():
+        PostURI.insert_many([{'uri': uri, 'paper_key': paper_keys.get(uri)} for uri in uris]).on_conflict_ignore().execute()
+        return list(PostURI.select(PostURI.id, PostURI.uri).where(PostURI.uri.in_(uris)))
+
+def post_paper_keys(uris):
+    """{post URI: canonical paper key} for the stored posts among uris that have one"""
+    if not uris:
+        return {}
+    return dict(PostURI.select(PostURI.uri, PostURI.paper_key)
+                .where(PostURI.uri.in_(list(uris)) & PostURI.paper_key.is_null(False)).tuples())
+
+def store_interaction_records(records):
+    """Remembers stored interactions, given as (record URI, DynamoDB table name, item key dict, post URI) tuples"""
+    if not records:
+        return
+    with db.atomic():
+        InteractionRecord.insert_many([{
+            'record_hash': record_hash(record_uri),
+            'table_name': table_name,
+            'item_key': json.dumps(item_key, separators=(',', ':')),
+            'post_uri': post_uri
+        } for record_uri, table_name, item_key, post_uri in records]).on_conflict_replace().execute()
+
+def pop_interaction_records(record_uris):
+    """
+    Looks up deleted records in one query and marks the ones we stored as deleted.
+    Returns the (DynamoDB table name, item key dict, post URI) of each item to delete.
+    """
+    if not record_uris:
+        return []
+    hashes = list({record_hash(record_uri) for record_uri in record_uris})
+    with db.atomic():
+        rows = list(InteractionRecord.select().where(InteractionRecord.record_hash.in_(hashes) &
+                                                     InteractionRecord.deleted_at.is_null()))
+        if rows:
+            (InteractionRecord.update(deleted_at=datetime.utcnow())
+             .where(InteractionRecord.record_hash.in_([row.record_hash for row in rows])).execute())
+    return [(row.table_name, json.loads(row.item_key), row.post_uri) for row in rows]
+
+def interaction_deleted(table_name, item_key, post_uri):
+    """
+    Whether the item stored under item_key (a like, repost or quote post of post_uri) has been deleted
+    since: a record stored as it was deleted, and no record stored as it since (e.g. a like again) is live
+    """
+    rows = (InteractionRecord.select(InteractionRecord.item_key, InteractionRecord.deleted_at)
+            .where((InteractionRecord.post_uri == post_uri) & (InteractionRecord.table_name == table_name)))
+    deleted = False
+    for row in rows:
+        if json.loads(row.item_key) == item_key:
+            if row.deleted_at is None:
+                return False
+            deleted = True
+    return deleted
+
+def prune_post_uris(retention_days, archive=True):
+    """
+    Removes PostURI rows stored more than retention_days ago, moving them to ArchivedPostURI first
+    if archive is set, and the InteractionRecord rows of their posts (whose deletes are no longer
+    applied), then checkpoints the WAL so the freed pages are reused. Returns the PostURI and
+    InteractionRecord rows removed.
+    """
+    horizon = datetime.utcnow() - timedelta(days=retention_days)
+    removed = removed_records = 0
+    while True:
+        with db.atomic():
+            rows = list(PostURI.select(PostURI.id, PostURI.uri, PostURI.created_at)
+                        .where(PostURI.created_at < horizon).limit(PRUNE_CHUNK_SIZE))
+            if not rows:
+                break
+            if archive:
+                ArchivedPostURI.insert_many([{'uri': row.uri, 'created_at': row.created_at} for row in rows]).on_conflict_ignore().execute()
+            PostURI.delete().where(PostURI.id.in_([row.id for row in rows])).execute()
+            removed_records += InteractionRecord.delete().where(InteractionRecord.post_uri.in_([row.uri for row in rows])).execute()
+        removed += len(rows)
+
+    if removed:
+        db.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        db.execute_sql('PRAGMA optimize')
+    return removed, removed_records
@@ -1,107 +1,225 @@
 #!/usr/bin/env python3
-import boto3
+from server import config
+from server import retry_log
+from server.database import interaction_deleted
+from server.batch_writer import BatchWriter
+from server.rate_limiter import RateLimiter
+from server.storage import open_storage, is_throttling
 from server.logger import logger
-from botocore.exceptions import ClientError
-import time
 from datetime import datetime, timezone
 import gc
+import os
 
-# Initialize DynamoDB
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-posts_table = dynamodb.Table('paper_posts')
-interactions_table = dynamodb.Table('interactions')
-reposts_table = dynamodb.Table('reposts')
-quoteposts_table = dynamodb.Table('quoteposts')
+TOMBSTONE_TTL_DAYS = int(os.environ.get('TOMBSTONE_TTL_DAYS', 31))
+
+# Unfollows also leave a deletion mark in the follows table, under the record key DELETED_FOLLOW_PREFIX
+# + rkey, for FOLLOW_DELETION_TTL_DAYS: a bootstrap from the user's repo (see rec_gen/follows.py) may
+# write the follow again after it was deleted, and drops it once it sees the mark
+DELETED_FOLLOW_PREFIX = '#deleted|'
+FOLLOW_DELETION_TTL_DAYS = int(os.environ.get('FOLLOW_DELETION_TTL_DAYS', 7))
+
+# Partition of the recommendations table holding each worker's trending posts and papers
+TRENDING_FEED_ID = 'trending_feed'
+
+# Tables whose items can be deleted when the record they came from is deleted
+INTERACTION_TABLES = ('interactions', 'reposts', 'quoteposts')
+
+# Attribute of an INTERACTION_TABLES item holding the URI of the post it refers to
+INTERACTION_POST_ATTRIBUTES = {'interactions': 'post_uri', 'reposts': 'post_uri', 'quoteposts': 'ref_uri'}
+
+# Every table the workers write: paper posts, their likes, reposts and quotes, the paper index,
+# follow records of our users (user_did, rkey -> subject_did) and tombstones of deleted posts
+# (partitioned by day, so the feed endpoint can drop them at serve time)
+WRITE_TABLES = ('paper_posts', 'interactions', 'reposts', 'quoteposts', 'paper_index', 'follows', 'tombstones')
+
+_writer = None
+_writer_pid = None
+
+def get_writer():
+    """
+    This process's buffered writer, started on first use: its threads do not survive a fork, so
+    every worker process starts its own
+    """
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = BatchWriter(storage.client, key_attributes, limiter=write_limiter, on_failure=retry_log.record_requests)
+        _writer_pid = os.getpid()
+    return _writer
+
+# The tables, in DynamoDB unless STORAGE_BACKEND says otherwise. With DynamoDB, puts and deletes go
+# through this process's batch writer, and the write rate of each table adapts to throttling, shared
+# by the worker processes (the limiter is created here, on import in the parent process, so that the
+# workers forked from it share its buckets).
+if config.STORAGE_BACKEND == 'dynamodb':
+    storage = open_storage('dynamodb', writer=get_writer)
+    write_limiter = RateLimiter(list(WRITE_TABLES))
+else:
+    storage = open_storage(config.STORAGE_BACKEND, config.STORAGE_SQLITE_FILE)
+    write_limiter = None
+
+def key_attributes(table_name):
+    """
+    The key attribute names of a table, from INTERACTIONS_TABLE_KEY-style environment variables
+    (comma-separated, e.g. REPOSTS_TABLE_KEY=user_did,post_uri) or else from the storage backend
+    """
+    return storage.key_attributes(table_name)
+
+def item_key(table_name, item):
+    """The primary key of an item of one of the WRITE_TABLES"""
+    return storage.item_key(table_name, item)
+
+def flush_writes():
+    """Writes everything this process has buffered, and waits for it"""
+    if _writer is not None and _writer_pid == os.getpid():
+        storage.flush()
+
+def write_stats():
+    """Current write rate and units waiting for tokens of every table, and this process's buffered items"""
+    backlog = _writer.backlog if _writer is not None and _writer_pid == os.getpid() else 0
+    return (write_limiter.stats() if write_limiter else {}), backlog
+
+def _put(table_name, items, if_match=None):
+    """Writes items (buffered with DynamoDB); ones that cannot be written are logged for retry"""
+    try:
+        storage.put_items(table_name, items, if_match=if_match)
+    except Exception as e:
+        retry_log.record_puts(table_name, items, e, if_match=if_match)
+
+def _delete(table_name, keys):
+    """Deletes items by key (buffered with DynamoDB); deletes that fail are logged for retry"""
+    try:
+        storage.delete_items(table_name, keys)
+    except Exception as e:
+        retry_log.record_deletes(table_name, keys, e)
+
+def _deleted_since(table_name, item):
+    """Whether the record a like, repost or quote post item came from was deleted after it was stored"""
+    return (table_name in INTERACTION_TABLES and
+            interaction_deleted(table_name, item_key(table_name, item), item.get(INTERACTION_POST_ATTRIBUTES[table_name])))
+
+def replay_failed_write(entry):
+    """Replays an entry of the retry log (see server/retry_log.py); raises if it fails again"""
+    if entry['op'] == 'put':
+        table_name, item = entry['table'], entry['item']
+        if _deleted_since(table_name, item):
+            logger.info(f"Dropped the logged put of a deleted item of {table_name}: {item_key(table_name, item)}")
+            return
+        storage.put_item(table_name, item, if_match=entry.get('if_match'))
+        # the record may have been deleted while the put was made, its delete landing first
+        if _deleted_since(table_name, item):
+            storage.delete_item(table_name, item_key(table_name, item))
+    elif entry['op'] == 'delete':
+        storage.delete_item(entry['table'], entry['key'])
+    elif entry['op'] == 'update':
+        storage.update_item(entry['table'], entry['key'], set=entry['set'])
 
 def mark_post_deleted(post_uri):
     """Mark a post as deleted in the DynamoDB table, and add a deletion timestamp"""
+    if write_limiter:
+        write_limiter.acquire('paper_posts')
+    key = {'at_uri': post_uri}
+    update = {'status': 'deleted', 'deleted_at': datetime.now(timezone.utc).isoformat()}
     try:
-        posts_table.update_item(
-            Key={'at_uri': post_uri},
-            UpdateExpression='SET #status = :val, #deleted_at = :timestamp',
-            ExpressionAttributeNames={'#status': 'status', '#deleted_at': 'deleted_at'},
-            ExpressionAttributeValues={':val': 'deleted', ':timestamp': datetime.now(timezone.utc).isoformat()}
-        )
+        storage.update_item('paper_posts', key, set=update)
         logger.info(f'Marked post {post_uri} as deleted')
-    except ClientError as e:
-        logger.error(f"Error marking post {post_uri} as deleted: {str(e)}")
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        if is_throttling(e):
+            write_limiter.throttled('paper_posts')
+        logger.error(f"Error marking post {post_uri} as deleted: {str(e)}")
+        retry_log.record_update('paper_posts', key, update, e)
     finally:
         gc.collect()
 
 def store_post(post):
-    """Store post in DynamoDB"""
-    try:
-        posts_table.put_item(Item=post)
-    except ClientError as e:
-        post_uri = post['at_uri']
-        logger.error(f"DynamoDB error storing post {post_uri}: {str(e)}")
-        if e.response['Error']['Code'] == 'ProvisionedThroughputExceededException':
-            time.sleep(1)  # Basic backoff
-    except Exception as e:
-        logger.error(f"Error storing post: {str(e)}")
-    finally:
-        # Force garbage collection
-        gc.collect()    
+    """
+    Store post in DynamoDB (buffered, see BatchWriter). The put is conditional on the post not having
+    a status: mark_post_deleted's update is not buffered, and may land first (or come from another
+    worker), and the put must not bring a deleted post back.
+    """
+    _put('paper_posts', [post], if_match={'status': None})
 
 def store_likes(interaction_dicts):
     """Store like in DynamoDB"""
-    with interactions_table.batch_writer() as batch:
-        # Add each item to the batch
-        if len(interaction_dicts) > 1:
-            print([interaction['post_uri'] for interaction in interaction_dicts])
-            print([interaction['user_did'] for interaction in interaction_dicts])
-        for item in interaction_dicts:
-            try:
-                batch.put_item(Item=item)
-            except ClientError as e:
-                user = item['user_did']
-                post_uri = item['post_uri']
-                logger.error(f"DynamoDB error storing interaction where user {user} liked post {post_uri}: {str(e)}")
-                if e.response['Error']['Code'] == 'ProvisionedThroughputExceededException':
-                    time.sleep(1)  # Basic backoff
-            except Exception as e:
-                logger.error(f"Error storing post: {str(e)}")
-            finally:
-                # Force garbage collection
-                gc.collect()
-    
+    if len(interaction_dicts) > 1:
+        print([interaction['post_uri'] for interaction in interaction_dicts])
+        print([interaction['user_did'] for interaction in interaction_dicts])
+    _put('interactions', interaction_dicts)
 
 def store_reposts(interaction_dicts):
     """Store reposts in DynamoDB"""
-    with reposts_table.batch_writer() as batch:
-        # Add each item to the batch
-        for item in interaction_dicts:
-            if len(interaction_dicts) > 1:
-                print(interaction_dicts)
-            try:
-                batch.put_item(Item=item)
-            except ClientError as e:
-                user_did = item['user_did']
-                post_uri = item['post_uri']
-                logger.error(f"DynamoDB error storing repost of post {post_uri} by user {user_did}: {str(e)}")
-                if e.response['Error']['Code'] == 'ProvisionedThroughputExceededException':
-                    time.sleep(1)  # Basic backoff
-            except Exception as e:
-                logger.error(f"Error storing post: {str(e)}")
-            finally:
-                # Force garbage collection
-                gc.collect()
+    if len(interaction_dicts) > 1:
+        print(interaction_dicts)
+    _put('reposts', interaction_dicts)
 
 def store_quoteposts(quotepost_dicts):
     """Store quoteposts in DynamoDB"""
-    with quoteposts_table.batch_writer() as batch:
-        for quotepost_dict in quotepost_dicts:
-            try:
-                batch.put_item(Item=quotepost_dict)
-            except ClientError as e:
-                quotepost_uri = quotepost_dict['at_uri']
-                logger.error(f"DynamoDB error storing quotepost {quotepost_uri}: {str(e)}")
-                if e.response['Error']['Code'] == 'ProvisionedThroughputExceededException':
-                    time.sleep(1)  # Basic backoff
-            except Exception as e:
-                logger.error(f"Error storing quotepost: {str(e)}")
-            finally:
-                # Force garbage collection
-                gc.collect()
\ No newline at end of file
+    _put('quoteposts', quotepost_dicts)
+
+def format_paper_index_entries(post):
+    """One paper_index item per paper key of a post, keyed by (paper_key, at_uri)"""
+    return [{
+        'paper_key': paper_key,
+        'at_uri': post['at_uri'],
+        'canonical': paper_key == post['PaperKey'],
+        'AuthorDID': post['AuthorDID'],
+        'CreatedDate': post['CreatedDate']
+    } for paper_key in post.get('PaperKeys', [])]
+
+def store_paper_index(posts):
+    """Index paper posts by their canonical paper keys in DynamoDB"""
+    _put('paper_index', [entry for post in posts for entry in format_paper_index_entries(post)])
+
+def remove_paper_index_entries(entries):
+    """Delete (paper_key, at_uri) entries from the paper index, e.g. when a post's keys change"""
+    _delete('paper_index', [{'paper_key': entry['paper_key'], 'at_uri': entry['at_uri']} for entry in entries])
+
+def get_posts(post_uris):
+    """Fetch stored paper posts by URI (BatchGetItem, 100 keys per request); returns a dict keyed by at_uri"""
+    post_uris = list(dict.fromkeys(post_uris))
+    return {item['at_uri']: item for item in storage.get_items('paper_posts', [{'at_uri': uri} for uri in post_uris])}
+
+def delete_interactions(keys_by_table):
+    """Delete items from the INTERACTION_TABLES, given {table name: [item key, ...]}"""
+    for table_name, keys in keys_by_table.items():
+        _delete(table_name, keys)
+
+def store_trending(worker_id, item):
+    """Replaces one worker's trending lists in the recommendations table"""
+    try:
+        storage.put_item('recommendations', {'user_did': TRENDING_FEED_ID, 'recommender': f'worker-{worker_id}', **item})
+    except Exception as e:
+        logger.error(f"Error storing trending posts of worker {worker_id}: {str(e)}")
+
+def get_user_dids():
+    """The DIDs of all users of the feeds, from a scan of the users table"""
+    return {item['user_did'] for item in storage.scan('users', attributes=['user_did'])}
+
+def store_follows(follow_dicts):
+    """Store follow records of our users in DynamoDB"""
+    _put('follows', follow_dicts)
+
+def delete_follows(keys):
+    """Delete follow records, given their {'user_did', 'rkey'} keys, and leave deletion marks for them"""
+    _delete('follows', keys)
+    now = datetime.now(timezone.utc)
+    expires_at = int(now.timestamp()) + FOLLOW_DELETION_TTL_DAYS * 24 * 3600
+    _put('follows', [{
+        'user_did': key['user_did'],
+        'rkey': DELETED_FOLLOW_PREFIX + key['rkey'],
+        'deleted_at': now.isoformat(),
+        'expires_at': expires_at
+    } for key in keys])
+
+def store_tombstones(post_uris):
+    """
+    Records deleted posts in the tombstones table: partition 'day', sort key 'sk' (deletion time and
+    URI, so the endpoint can read just the ones added since it last looked), expiring by TTL
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = int(now.timestamp()) + TOMBSTONE_TTL_DAYS * 24 * 3600
+    _put('tombstones', [{
+        'day': now.strftime('%Y-%m-%d'),
+        'sk': f'{now.isoformat()}|{post_uri}',
+        'post_uri': post_uri,
+        'expires_at': expires_at
+    } for post_uri in post_uris])
@@ -0,0 +1,120 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from server import config
+from server.database_dynamo import storage, flush_writes, write_limiter
+from server.storage import is_throttling
+from server.logger import logger
+
+# Engagement counters kept on each paper_posts item, by interaction kind
+COUNTER_ATTRIBUTES = {
+    'like': 'LikeCount',
+    'repost': 'RepostCount',
+    'quote': 'QuoteCount'
+}
+
+# The counter each table's items count towards, for deleted interactions
+TABLE_COUNTERS = {
+    'interactions': 'like',
+    'reposts': 'repost',
+    'quoteposts': 'quote'
+}
+
+# Concurrent UpdateItem calls per flush (the storage backends are thread-safe)
+FLUSH_THREADS = 8
+
+# post URI -> counter kind -> change since the last flush, for this worker process. Counted by the
+# worker loop and written by a background flush (see maybe_flush), so both hold _lock to touch it.
+_pending = defaultdict(lambda: defaultdict(int))
+_lock = threading.Lock()
+_last_flush = time()
+_flusher = None         # the thread of the background flush in progress
+_attempts = {}          # post URI -> flushes its update has failed in (other than by throttling)
+
+def count(post_uri, kind, delta=1):
+    """Counts a like, repost or quote of a stored paper post (or, with delta=-1, its deletion)"""
+    with _lock:
+        _pending[post_uri][kind] += delta
+
+def _apply(post_uri, deltas):
+    """
+    Adds one post's deltas in a single atomic UpdateItem; returns None once written, or else
+    'throttled' or 'failed' (also when the post is not stored yet, its write still being buffered)
+    """
+    deltas = {kind: delta for kind, delta in deltas.items() if delta}
+    if not deltas:
+        return None
+    if write_limiter:
+        write_limiter.acquire('paper_posts')
+    try:
+        # never creates an item for a post that is not stored
+        if storage.update_item('paper_posts', {'at_uri': post_uri},
+                               add={COUNTER_ATTRIBUTES[kind]: delta for kind, delta in deltas.items()}, must_exist=True):
+            return None
+        return 'failed'
+    except Exception as e:
+        if is_throttling(e):
+            write_limiter.throttled('paper_posts')
+            return 'throttled'
+        logger.error(f"Error updating engagement of post {post_uri}: {str(e)}")
+        return 'failed'
+
+def _write(pending):
+    """
+    Writes one flush's counts. Those that fail are counted again for the next flush, unless their
+    post's update has failed in config.ENGAGEMENT_MAX_ATTEMPTS flushes: those are dropped.
+    """
+    with ThreadPoolExecutor(max_workers=FLUSH_THREADS) as executor:
+        results = list(executor.map(lambda item: (item[0], item[1], _apply(*item)), pending.items()))
+    for post_uri, deltas, result in results:
+        if result is None:
+            _attempts.pop(post_uri, None)
+            continue
+        if result == 'failed':
+            _attempts[post_uri] = _attempts.get(post_uri, 0) + 1
+            if _attempts[post_uri] >= config.ENGAGEMENT_MAX_ATTEMPTS:
+                del _attempts[post_uri]
+                logger.error(f"Dropped the engagement counts {dict(deltas)} of post {post_uri} after "
+                             f"{config.ENGAGEMENT_MAX_ATTEMPTS} failed updates")
+                continue
+        with _lock:
+            for kind, delta in deltas.items():
+                _pending[post_uri][kind] += delta
+
+def _take():
+    global _pending, _last_flush
+    with _lock:
+        pending, _pending = _pending, defaultdict(lambda: defaultdict(int))
+    _last_flush = time()
+    return pending
+
+def flush():
+    """
+    Writes the counted engagement as one ADD update per post, however many events it coalesces, and
+    waits for it: called when the worker stops, after the background flush in progress, if any.
+    """
+    if _flusher is not None:
+        _flusher.join()
+    # the posts counted may still be buffered, and the updates only apply to stored posts
+    flush_writes()
+    pending = _take()
+    if pending:
+        _write(pending)
+    return len(pending)
+
+def maybe_flush():
+    """
+    Called from the worker loop: every ENGAGEMENT_FLUSH_INTERVAL seconds, hands the counts to a
+    background flush, so that the loop never waits for the updates (or for their write tokens)
+    """
+    global _flusher
+    if time() - _last_flush < config.ENGAGEMENT_FLUSH_INTERVAL or (_flusher is not None and _flusher.is_alive()):
+        return 0
+    pending = _take()
+    if not pending:
+        return 0
+    _flusher = threading.Thread(target=_write, args=(pending,), name='engagement-flush', daemon=True)
+    _flusher.start()
+    return len(pending)
@@ -0,0 +1,185 @@
+import fcntl
+import os
+import threading
+from array import array
+from bisect import bisect_left
+
+from server import config
+
+# Dictionary encoding of DIDs and at:// URIs: each string gets a dense integer ID (0, 1, 2, ... in
+# the order they were first seen), so in-process structures can hold 8-byte integers in arrays
+# instead of 60-100 byte strings in sets. The strings themselves are kept once, packed in one byte
+# buffer with an array of offsets, which is also the reverse lookup (ID -> string).
+#
+# The encoding is persistent and append-only: new strings are appended, one per line, to
+# config.INTERN_FILE, and an ID is a string's line number there. Every process (worker, backfill,
+# restart) that opens the file sees the same IDs, and picks up strings other processes appended
+# whenever it meets an ID or interns a string it does not know yet.
+
+_EMPTY = 0
+
+class Interner:
+    """Thread-safe. With path None, the IDs live only as long as the process."""
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = bytearray()
+        self._offsets = array('Q', [0])   # string i is _data[_offsets[i]:_offsets[i + 1]]
+        self._slots = array('q', bytes(8 * 1024))  # open addressing table of ID + 1
+        self._mask = len(self._slots) - 1
+        self._file_position = 0
+        if path:
+            with self._lock:
+                self._catch_up()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _string(self, i):
+        return self._data[self._offsets[i]:self._offsets[i + 1]]
+
+    def _find(self, encoded, h):
+        """The slot holding the encoded string, or the empty slot where it would go"""
+        slots, mask = self._slots, self._mask
+        slot = h & mask
+        while True:
+            value = slots[slot]
+            if value == _EMPTY or self._string(value - 1) == encoded:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _add_local(self, encoded):
+        """Adds a string that is not present yet; returns its ID. Call with the lock held."""
+        i = len(self)
+        self._data += encoded
+        self._offsets.append(len(self._data))
+        if len(self) * 2 > len(self._slots):
+            self._grow()
+        else:
+            self._slots[self._find(encoded, hash(bytes(encoded)))] = i + 1
+        return i
+
+    def _grow(self):
+        self._slots = array('q', bytes(16 * len(self._slots)))
+        self._mask = len(self._slots) - 1
+        for i in range(len(self)):
+            encoded = bytes(self._string(i))
+            self._slots[self._find(encoded, hash(encoded))] = i + 1
+
+    def _catch_up(self):
+        """Reads the strings other processes appended since the last read. Call with the lock held."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._file_position)
+            for line in f:
+                # a line without its newline is still being appended
+                if not line.endswith(b'\n'):
+                    break
+                self._add_local(line[:-1])
+                self._file_position += len(line)
+
+    def get(self, string):
+        """The ID of a string this process knows, or None (without reading the file)"""
+        encoded = string.encode()
+        with self._lock:
+            value = self._slots[self._find(encoded, hash(encoded))]
+        return value - 1 if value != _EMPTY else None
+
+    def intern(self, string):
+        """The ID of a string, added if it has none"""
+        return self.intern_many([string])[0]
+
+    def intern_many(self, strings):
+        """The IDs of strings (an array), adding the new ones with one append to the file"""
+        ids = array('q')
+        new = {}
+        with self._lock:
+            for string in strings:
+                encoded = string.encode()
+                value = self._slots[self._find(encoded, hash(encoded))]
+                if value != _EMPTY:
+                    ids.append(value - 1)
+                else:
+                    if b'\n' in encoded:
+                        raise ValueError(f'Cannot intern a string with a newline: {string!r}')
+                    ids.append(-1)
+                    new.setdefault(encoded, []).append(len(ids) - 1)
+            if new:
+                self._append(new, ids)
+        return ids
+
+    def _append(self, new, ids):
+        """Adds new strings ({encoded: positions in ids}) and fills in their IDs. Call with the lock held."""
+        if not self.path:
+            for encoded, positions in new.items():
+                i = self._add_local(encoded)
+                for position in positions:
+                    ids[position] = i
+            return
+
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # another process may have appended some of them (or others) since our last read
+                self._catch_up()
+                missing = [encoded for encoded in new if self._slots[self._find(encoded, hash(encoded))] == _EMPTY]
+                # written before they are given IDs here, so the IDs never run ahead of the file
+                data = b''.join(encoded + b'\n' for encoded in missing)
+                f.write(data)
+                f.flush()
+                for encoded in missing:
+                    self._add_local(encoded)
+                self._file_position += len(data)
+                for encoded, positions in new.items():
+                    i = self._slots[self._find(encoded, hash(encoded))] - 1
+                    for position in positions:
+                        ids[position] = i
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __getitem__(self, i):
+        """The string of an ID (reverse lookup)"""
+        with self._lock:
+            if i >= len(self):
+                self._catch_up()
+            if not 0 <= i < len(self):
+                raise KeyError(i)
+            return self._string(i).decode()
+
+    def lookup_many(self, ids):
+        return [self[i] for i in ids]
+
+class IdSet:
+    """
+    An immutable set of strings stored as a sorted array of their interned IDs: 8 bytes per member,
+    with membership tests by binary search. Strings the interner has never seen are not members.
+    """
+    def __init__(self, interner, strings=()):
+        self.interner = interner
+        self.ids = array('q', sorted(set(interner.intern_many(strings))))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contains_id(self, i):
+        position = bisect_left(self.ids, i)
+        return position < len(self.ids) and self.ids[position] == i
+
+    def __contains__(self, string):
+        i = self.interner.get(string)
+        return i is not None and self.contains_id(i)
+
+    def __iter__(self):
+        return (self.interner[i] for i in self.ids)
+
+_interner = None
+_interner_pid = None
+
+def get_interner():
+    """This process's interner of config.INTERN_FILE, opened on first use"""
+    global _interner, _interner_pid
+    if _interner is None or _interner_pid != os.getpid():
+        _interner = Interner(config.INTERN_FILE)
+        _interner_pid = os.getpid()
+    return _interner
@@ -1,7 +1,10 @@
 import logging
 from logging.handlers import RotatingFileHandler
+import os
 import sys
 
+LOG_DIR = '/var/log/preprint-bluesky-feed'
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -9,15 +12,16 @@ logger.setLevel(logging.INFO)
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
 
-# Create file handler for CloudWatch to pick up
-file_handler = RotatingFileHandler('/var/log/preprint-bluesky-feed/errors.log', maxBytes=10485760, backupCount=5)
-file_handler.setLevel(logging.ERROR)
-
 # Create formatters and add them to handlers
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
 
 # Add the handlers to the logger
 logger.addHandler(console_handler)
-logger.addHandler(file_handler)
\ No newline at end of file
+
+# Create file handler for CloudWatch to pick up (skipped when running tools outside the server)
+if os.path.isdir(LOG_DIR):
+    file_handler = RotatingFileHandler(os.path.join(LOG_DIR, 'errors.log'), maxBytes=10485760, backupCount=5)
+    file_handler.setLevel(logging.ERROR)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
\ No newline at end of file
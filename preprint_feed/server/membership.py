@@ -0,0 +1,287 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+from server.logger import logger
+
+# Membership index of the stored paper posts, used to reject interactions with every other post
+# without touching SQLite. It is a memory-mapped file shared by all worker processes: a Bloom filter
+# in front of an open-addressing (linear probing) table of 64-bit URI hashes. The file persists across
+# restarts, and is rebuilt from the PostURI table when it is missing.
+MEMBERSHIP_FILE = os.environ.get('MEMBERSHIP_FILE', 'post_membership.idx')
+
+# Table slots in a new index (a power of two); the index doubles when it gets too full
+INITIAL_CAPACITY = int(os.environ.get('MEMBERSHIP_CAPACITY', 1 << 22))
+MAX_LOAD_FACTOR = 0.7
+
+# Bloom filter size and number of bit probes per URI
+BLOOM_BITS_PER_SLOT = 8
+BLOOM_HASHES = 5
+
+# PostURI rows re-read below the saved watermark on startup, to pick up posts whose insert
+# committed in SQLite but never reached the index (e.g. a worker killed in between)
+CATCH_UP_OVERLAP = 10000
+
+_MAGIC = b'PMIDX001'
+# magic, capacity, count, bloom bits, watermark (highest PostURI id indexed), superseded flag
+_HEADER = struct.Struct('<8sQQQQQ')
+_HEADER_SIZE = 64
+_COUNT_OFFSET = 16
+_WATERMARK_OFFSET = 32
+_SUPERSEDED_OFFSET = 40
+
+def uri_hash(uri):
+    """64-bit hash of a URI; never 0, which marks an empty slot"""
+    return int.from_bytes(hashlib.blake2b(uri.encode(), digest_size=8).digest(), 'little') or 1
+
+def _bloom_step(key):
+    # the second hash of the Bloom filter's double hashing, derived from the key so that
+    # the filter can be rebuilt from the table alone when the index grows
+    return ((key >> 32) | (key << 32)) & 0xFFFFFFFFFFFFFFFF | 1
+
+def _file_size(capacity):
+    return _HEADER_SIZE + capacity * BLOOM_BITS_PER_SLOT // 8 + capacity * 8
+
+def _create_file(path, capacity):
+    """Writes an empty index file of the given capacity to path"""
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, capacity, 0, capacity * BLOOM_BITS_PER_SLOT, 0, 0).ljust(_HEADER_SIZE, b'\0'))
+        f.truncate(_file_size(capacity))
+
+class MembershipIndex:
+    """
+    Reads are lock-free: a slot is written with a single aligned 8-byte store, so a reader sees
+    a URI either before or after it is added. Writers serialize on an flock of path + '.lock',
+    which also covers processes that are not forked from the same parent, such as the backfill.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = None
+        self._lock_pid = None
+        self._map()
+
+    def _map(self):
+        with open(self.path, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), 0)
+        magic, capacity, _, bloom_bits, _, _ = _HEADER.unpack_from(self._mm)
+        if magic != _MAGIC or len(self._mm) != _file_size(capacity):
+            raise ValueError(f'{self.path} is not a membership index')
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._bloom_mask = bloom_bits - 1
+        self._bloom = memoryview(self._mm)[_HEADER_SIZE:_HEADER_SIZE + bloom_bits // 8]
+        self._slots = memoryview(self._mm)[_HEADER_SIZE + bloom_bits // 8:].cast('Q')
+
+    def _remap_if_superseded(self):
+        # set in the old file after a resize or rebuild has replaced it
+        if self._mm[_SUPERSEDED_OFFSET]:
+            self.close()
+            self._map()
+
+    def close(self):
+        self._bloom.release()
+        self._slots.release()
+        self._mm.close()
+
+    @property
+    def count(self):
+        return struct.unpack_from('<Q', self._mm, _COUNT_OFFSET)[0]
+
+    @property
+    def watermark(self):
+        return struct.unpack_from('<Q', self._mm, _WATERMARK_OFFSET)[0]
+
+    def __contains__(self, uri):
+        self._remap_if_superseded()
+        key = uri_hash(uri)
+
+        bloom = self._bloom
+        position = key
+        step = _bloom_step(key)
+        for _ in range(BLOOM_HASHES):
+            bit = position & self._bloom_mask
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+            position += step
+
+        slots = self._slots
+        i = key & self._mask
+        while True:
+            value = slots[i]
+            if value == key:
+                return True
+            if value == 0:
+                return False
+            i = (i + 1) & self._mask
+
+    def stored_subset(self, uris):
+        """The given URIs that are in the index, probed together in one pass"""
+        self._remap_if_superseded()
+        bloom, bloom_mask, slots, mask = self._bloom, self._bloom_mask, self._slots, self._mask
+        found = set()
+        for uri in uris:
+            key = uri_hash(uri)
+            position = key
+            step = _bloom_step(key)
+            for _ in range(BLOOM_HASHES):
+                bit = position & bloom_mask
+                if not bloom[bit >> 3] & (1 << (bit & 7)):
+                    break
+                position += step
+            else:
+                i = key & mask
+                while slots[i]:
+                    if slots[i] == key:
+                        found.add(uri)
+                        break
+                    i = (i + 1) & mask
+        return found
+
+    def _insert(self, key):
+        """Adds one hash; returns False if it was already present. Call with the write lock held."""
+        slots = self._slots
+        i = key & self._mask
+        while True:
+            value = slots[i]
+            if value == key:
+                return False
+            if value == 0:
+                break
+            i = (i + 1) & self._mask
+        slots[i] = key
+
+        bloom = self._bloom
+        position = key
+        step = _bloom_step(key)
+        for _ in range(BLOOM_HASHES):
+            bit = position & self._bloom_mask
+            bloom[bit >> 3] |= 1 << (bit & 7)
+            position += step
+        return True
+
+    @contextmanager
+    def _write_lock(self):
+        # flock belongs to the open file, so every process (including forked ones) opens its own
+        if self._lock_pid != os.getpid():
+            self._lock_file = open(self.path + '.lock', 'a')
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            self._remap_if_superseded()
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def add(self, uris, watermark=None):
+        """Adds post URIs, and raises the watermark to the highest PostURI id they were stored under"""
+        with self._write_lock():
+            count = self.count
+            for uri in uris:
+                if count + 1 > self.capacity * MAX_LOAD_FACTOR:
+                    self._grow()
+                if self._insert(uri_hash(uri)):
+                    count += 1
+                    struct.pack_into('<Q', self._mm, _COUNT_OFFSET, count)
+            if watermark is not None and watermark > self.watermark:
+                struct.pack_into('<Q', self._mm, _WATERMARK_OFFSET, watermark)
+
+    def _grow(self):
+        """Replaces the index with one of twice the capacity. Call with the write lock held."""
+        capacity = self.capacity * 2
+        tmp_path = self.path + '.tmp'
+        _create_file(tmp_path, capacity)
+        bigger = MembershipIndex(tmp_path)
+        for key in self._slots:
+            if key:
+                bigger._insert(key)
+        struct.pack_into('<Q', bigger._mm, _COUNT_OFFSET, self.count)
+        struct.pack_into('<Q', bigger._mm, _WATERMARK_OFFSET, self.watermark)
+        bigger._mm.flush()
+        bigger.close()
+
+        os.replace(tmp_path, self.path)
+        self._mm[_SUPERSEDED_OFFSET] = 1
+        self._remap_if_superseded()
+        logger.info(f'Grew membership index {self.path} to {capacity} slots')
+
+    def rebuild(self, rows):
+        """Replaces the index with one built from (PostURI id, uri) rows, e.g. after old rows were pruned"""
+        with self._write_lock():
+            build_index(self.path, rows, capacity=self.capacity).close()
+            self._mm[_SUPERSEDED_OFFSET] = 1
+            self._remap_if_superseded()
+
+def build_index(path, rows, capacity=INITIAL_CAPACITY):
+    """Creates a new index at path from (PostURI id, uri) rows"""
+    rows = list(rows)
+    while len(rows) > capacity * MAX_LOAD_FACTOR / 2:
+        capacity *= 2
+    tmp_path = path + '.tmp'
+    _create_file(tmp_path, capacity)
+    index = MembershipIndex(tmp_path)
+    for _, uri in rows:
+        if index._insert(uri_hash(uri)):
+            struct.pack_into('<Q', index._mm, _COUNT_OFFSET, index.count + 1)
+    struct.pack_into('<Q', index._mm, _WATERMARK_OFFSET, max((row_id for row_id, _ in rows), default=0))
+    index._mm.flush()
+    os.replace(tmp_path, path)
+    index.path = path
+    return index
+
+def open_post_index(path=MEMBERSHIP_FILE):
+    """
+    Opens the membership index, building it from the PostURI table if the file is missing or
+    unreadable, then adds any PostURI rows stored since it was last updated.
+    """
+    from server.database import PostURI
+
+    try:
+        index = MembershipIndex(path)
+    except (OSError, ValueError) as e:
+        logger.info(f'Building membership index {path} from the PostURI table ({e})')
+        index = build_index(path, PostURI.select(PostURI.id, PostURI.uri).tuples().iterator())
+        logger.info(f'Built membership index with {index.count} posts')
+        return index
+
+    since = max(0, index.watermark - CATCH_UP_OVERLAP)
+    rows = list(PostURI.select(PostURI.id, PostURI.uri).where(PostURI.id > since).tuples())
+    if rows:
+        index.add([uri for _, uri in rows], watermark=max(row_id for row_id, _ in rows))
+    logger.info(f'Opened membership index {path} with {index.count} posts')
+    return index
+
+_post_index = None
+
+def get_post_index():
+    """
+    The process's membership index, opened on first use. Open it in the parent process before
+    forking workers, so that they share its pages instead of each mapping the file again.
+    """
+    global _post_index
+    if _post_index is None:
+        _post_index = open_post_index()
+    return _post_index
+
+def is_stored_post(uri):
+    """Whether a post URI is one of the stored paper posts"""
+    return uri in get_post_index()
+
+def stored_posts(uris):
+    """The subset of a batch of post URIs that are stored paper posts"""
+    return get_post_index().stored_subset(uris)
+
+def rebuild_post_index():
+    """Rebuilds the index from the PostURI table, so that pruned posts stop matching"""
+    from server.database import PostURI
+
+    index = get_post_index()
+    # the rows are read with the write lock held, so no concurrent add is missed
+    index.rebuild(PostURI.select(PostURI.id, PostURI.uri).tuples().iterator())
+    logger.info(f'Rebuilt membership index with {index.count} posts')
+
+def add_stored_posts(post_uris):
+    """Records newly stored paper posts, given the PostURI rows they were stored as"""
+    get_post_index().add([post_uri.uri for post_uri in post_uris], watermark=max(post_uri.id for post_uri in post_uris))
@@ -0,0 +1,77 @@
+import re
+
+# Canonical paper keys look like "<scheme>:<id>", e.g. "doi:10.1038/s41586-024-07566-y",
+# "arxiv:2401.01234", "pmid:38012345", "pmcid:PMC1234567", "ssrn:4567890" or "nber:w31234".
+# When a post has several, PAPER_KEY_PRIORITY decides which one is the post's canonical key.
+PAPER_KEY_PRIORITY = ['arxiv', 'doi', 'pmcid', 'pmid', 'ssrn', 'nber']
+
+_DOI = re.compile(r'\b10\.\d{4,9}/[^\s"<>]+', re.IGNORECASE)
+_ARXIV = re.compile(r'(?:arxiv\.org/(?:abs|pdf|html)/|arxiv:\s?)(\d{4}\.\d{4,5}|[a-z-]+(?:\.[a-z]{2})?/\d{7})(?:v\d+)?', re.IGNORECASE)
+_PMID = re.compile(r'(?:pubmed\.ncbi\.nlm\.nih\.gov/|ncbi\.nlm\.nih\.gov/pubmed/|pmid:\s?)(\d{1,9})\b', re.IGNORECASE)
+_PMCID = re.compile(r'\bpmc(\d{4,9})\b', re.IGNORECASE)
+_SSRN = re.compile(r'ssrn\.com/(?:abstract=|sol3/papers\.cfm\?abstract_id=)(\d+)', re.IGNORECASE)
+_NBER = re.compile(r'nber\.org/(?:papers/|system/files/working_papers/w\d+/)w(\d+)', re.IGNORECASE)
+
+# DOIs registered for papers that have a more specific identifier of their own
+_ARXIV_DOI = re.compile(r'^10\.48550/arxiv\.(.+?)(?:v\d+)?$')
+_SSRN_DOI = re.compile(r'^10\.2139/ssrn\.(\d+)$')
+_NBER_DOI = re.compile(r'^10\.3386/w(\d+)$')
+
+# Publisher URL suffixes that follow a DOI but are not part of it
+_DOI_SUFFIX = re.compile(r'(?:/(?:full|abstract|abs|pdf|epdf|epub|html|meta|suppl|references)|\.pdf|\.full|\.abstract|\.short|\.long)+$')
+# bioRxiv/medRxiv version suffixes, e.g. 10.1101/2024.01.01.123456v2
+_PREPRINT_VERSION = re.compile(r'^(10\.1101/[\d.]+)v\d+$')
+
+_TRAILING_PUNCTUATION = '.,;:!?)]}\'"'
+
+def normalize_doi(doi):
+    """Lowercases a DOI and strips punctuation, query strings and publisher URL suffixes"""
+    doi = doi.lower().split('?')[0].split('#')[0].rstrip(_TRAILING_PUNCTUATION)
+    doi = _DOI_SUFFIX.sub('', doi).rstrip(_TRAILING_PUNCTUATION)
+    version_match = _PREPRINT_VERSION.match(doi)
+    if version_match:
+        doi = version_match.group(1)
+    return doi
+
+def _doi_key(doi):
+    doi = normalize_doi(doi)
+    arxiv_match = _ARXIV_DOI.match(doi)
+    if arxiv_match:
+        return f'arxiv:{arxiv_match.group(1)}'
+    ssrn_match = _SSRN_DOI.match(doi)
+    if ssrn_match:
+        return f'ssrn:{ssrn_match.group(1)}'
+    nber_match = _NBER_DOI.match(doi)
+    if nber_match:
+        return f'nber:w{nber_match.group(1)}'
+    return f'doi:{doi}'
+
+def extract_paper_keys(search_text):
+    """
+    Extracts the canonical keys of every paper identifier in a post's search text, without duplicates.
+    arXiv IDs lose their version suffix, and DOIs minted for arXiv, SSRN and NBER papers map to those schemes.
+    """
+    keys = []
+    for match in _ARXIV.finditer(search_text):
+        keys.append(f'arxiv:{match.group(1).lower()}')
+    for match in _DOI.finditer(search_text):
+        keys.append(_doi_key(match.group()))
+    for match in _PMCID.finditer(search_text):
+        keys.append(f'pmcid:PMC{match.group(1)}')
+    for match in _PMID.finditer(search_text):
+        keys.append(f'pmid:{match.group(1)}')
+    for match in _SSRN.finditer(search_text):
+        keys.append(f'ssrn:{match.group(1)}')
+    for match in _NBER.finditer(search_text):
+        keys.append(f'nber:w{match.group(1)}')
+    # drop keys that are empty after normalization, e.g. a bare "10.1234/"
+    keys = [key for key in keys if not key.endswith('/') and not key.endswith(':')]
+    return list(dict.fromkeys(keys))
+
+def canonical_paper_key(paper_keys):
+    """Picks the key that identifies the post's paper, by scheme priority; None if there is no key"""
+    for scheme in PAPER_KEY_PRIORITY:
+        for key in paper_keys:
+            if key.startswith(scheme + ':'):
+                return key
+    return None
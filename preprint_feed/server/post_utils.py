@@ -1,102 +1,151 @@
 from urllib.parse import unquote
 
+# Per-field limits applied before classification. Bluesky's own record limits are well
+# below these, so they only truncate malformed or adversarial records, which would
+# otherwise make the content patterns backtrack over arbitrarily long input.
+MAX_TEXT_LENGTH = 3000
+MAX_URL_LENGTH = 2048
+MAX_TITLE_LENGTH = 500
+MAX_DESCRIPTION_LENGTH = 1000
+MAX_ALT_TEXT_LENGTH = 1000
+MAX_LIST_ITEMS = 32
+
+def _capped(items):
+    """Return at most MAX_LIST_ITEMS entries of a list-valued record field"""
+    if not isinstance(items, list):
+        return []
+    return items[:MAX_LIST_ITEMS]
+
+_EMPTY = {}
+
+def _lowered(value, limit):
+    return value[:limit].lower() if value else ''
+
+def _joined(items, limit):
+    """Lowercased, space-joined non-empty entries of a list-valued record field"""
+    if not items:
+        return ''
+    return " ".join([item[:limit].lower() for item in _capped(items) if item])
+
+class _cached_field:
+    """
+    Like functools.cached_property, but without its per-instance lock, which costs more than
+    most fields take to build. The value is stored in the instance dict, which shadows this
+    descriptor, so later reads are plain attribute lookups.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.build(instance)
+        return value
+
+class SearchText:
+    """
+    Lazily built search text of a post record. Each normalized (capped, lowercased and, for
+    links, unquoted) field is built on first access, and the joined text, identical to
+    get_search_text, only when a check needs the full text. Checks that only need a few
+    fields, such as looking at the embed link, then never pay for building the rest.
+    """
+    def __init__(self, record):
+        self.record = record
+
+    @_cached_field
+    def _embed(self):
+        embed_data = self.record.get('embed', {})
+        return embed_data if isinstance(embed_data, dict) else _EMPTY
+
+    @_cached_field
+    def _external(self):
+        external_data = self._embed.get('external', {})
+        return external_data if isinstance(external_data, dict) else _EMPTY
+
+    @_cached_field
+    def _quoted(self):
+        quoted_record = self._embed.get('record', {})
+        return quoted_record if isinstance(quoted_record, dict) else _EMPTY
+
+    @_cached_field
+    def post_text(self):
+        return _lowered(self.record.get('text', ''), MAX_TEXT_LENGTH)
+
+    @_cached_field
+    def external_uri(self):
+        return unquote(_lowered(self._external.get('uri', ''), MAX_URL_LENGTH))
+
+    @_cached_field
+    def external_title(self):
+        return _lowered(self._external.get('title', ''), MAX_TITLE_LENGTH)
+
+    @_cached_field
+    def external_description(self):
+        return _lowered(self._external.get('description', ''), MAX_DESCRIPTION_LENGTH)
+
+    @_cached_field
+    def quoted_text(self):
+        return _lowered(self._quoted.get('text', ''), MAX_TEXT_LENGTH)
+
+    @_cached_field
+    def quoted_uri(self):
+        return unquote(_lowered(self._quoted.get('uri', ''), MAX_URL_LENGTH))
+
+    @_cached_field
+    def facet_urls(self):
+        facet_url_str = _joined(self.record.get('urls'), MAX_URL_LENGTH)
+        return unquote(facet_url_str)
+
+    @_cached_field
+    def mentions(self):
+        return _joined(self.record.get('mentions', []), MAX_TITLE_LENGTH)
+
+    @_cached_field
+    def tags(self):
+        # facet tags, then standalone tags
+        facet_tags = _joined(self.record.get('facet_tags'), MAX_TITLE_LENGTH)
+        standalone_tags = _joined(self.record.get('tags'), MAX_TITLE_LENGTH)
+        if facet_tags and standalone_tags:
+            return f"{facet_tags} {standalone_tags}"
+        return facet_tags or standalone_tags
+
+    @_cached_field
+    def labels(self):
+        return _joined(self.record.get('label_values', []), MAX_TITLE_LENGTH)
+
+    @_cached_field
+    def images_alt_text(self):
+        return _joined(self._embed.get('images_alt_texts', []), MAX_ALT_TEXT_LENGTH)
+
+    @_cached_field
+    def text(self):
+        """All fields joined, for full-text checks"""
+        # Fields not read yet are built without being cached, so they are freed once joined
+        cached = self.__dict__
+        return " ".join([cached[name] if name in cached else _TEXT_FIELD_BUILDERS[name](self) for name in TEXT_FIELDS])
+
+    @_cached_field
+    def link_text(self):
+        """Only the post's links (embed URI and facet URLs), as built by get_link_text"""
+        return " ".join([link for link in (self.external_uri, self.facet_urls) if link])
+
+    def __str__(self):
+        return self.text
+
+# The fields of the joined search text, in order
+TEXT_FIELDS = ['post_text', 'external_uri', 'external_title', 'external_description', 'quoted_text',
+               'quoted_uri', 'facet_urls', 'mentions', 'tags', 'labels', 'images_alt_text']
+_TEXT_FIELD_BUILDERS = {name: getattr(SearchText, name).build for name in TEXT_FIELDS}
+
+def get_link_text(record) -> str:
+    """
+    Builds a short string with only the links of a post (embed URI and facet URLs).
+    Used as the fallback input when classifying the full search text runs over budget.
+    """
+    return SearchText(record).link_text
+
 def get_search_text(record) -> str:
-    # Initialize all variables to empty strings or lists to avoid errors
-    post_text = ""
-    facet_urls = []
-    mentions = []
-    facet_tags = []
-    standalone_tags = []
-    label_values = []
-    facet_url_str = ""
-    mentions_str = ""
-    tags_str = ""
-    labels_str = ""
-    
-    external_uri = ""
-    external_title = ""
-    external_description = ""
-    quoted_text = ""
-    quoted_uri = ""
-    images_alt_text = ""
-    
-    # Safely extract text from record, defaulting to empty string if not found
-    post_text = record.get('text', '').lower()
-
-    # Get URLs from facets
-    for url in record.get('urls', []):
-        if url:  # Check if not empty
-            facet_urls.append(url.lower())
-    if facet_urls:
-        facet_url_str = " ".join(facet_urls)
-        
-    # Get mentions from facets
-    for mention in record.get('mentions', []):
-        if mention:  # Check if not empty
-            mentions.append(mention.lower())
-    if mentions:
-        mentions_str = " ".join(mentions)
-        
-    # Get tags from facets
-    for tag in record.get('facet_tags', []):
-        if tag:  # Check if not empty
-            facet_tags.append(tag.lower())
-    
-    # Get standalone tags
-    if isinstance(record.get('tags'), list):
-        for tag in record.get('tags', []):
-            if tag:  # Check if not empty
-                standalone_tags.append(tag.lower())
-        # Combine all tags
-    all_tags = facet_tags + standalone_tags
-    if all_tags:
-        tags_str = " ".join(all_tags)
-    
-    # Get label values
-    for label in record.get('label_values', []):
-        if label:  # Check if not empty
-            label_values.append(label.lower())
-    if label_values:
-        labels_str = " ".join(label_values)
-
-    # Safely navigate the nested embed structure
-    embed_data = record.get('embed', {})
-    if isinstance(embed_data, dict):
-        # Check for direct external links
-        external_data = embed_data.get('external', {})
-        if isinstance(external_data, dict):
-            external_uri = external_data.get('uri', '').lower()
-            external_title = external_data.get('title', '').lower()
-            external_description = external_data.get('description', '').lower()
-        
-        # Check for image alt texts
-        alt_texts = []
-        for alt_text in embed_data.get('images_alt_texts', []):
-            if alt_text:  # Check if not empty
-                alt_texts.append(alt_text.lower())
-        if alt_texts:
-            images_alt_text = " ".join(alt_texts)
-        
-        # Check for quoted posts
-        quoted_record = embed_data.get('record', {})
-        if isinstance(quoted_record, dict):
-            # Get text from quoted post
-            quoted_text = quoted_record.get('text', '').lower()
-            # Get URI reference
-            quoted_uri = quoted_record.get('uri', '').lower()
-        
-    try:
-        if external_uri:
-            external_uri = unquote(external_uri)
-        if quoted_uri:
-            quoted_uri = unquote(quoted_uri)
-        if facet_url_str:
-            facet_url_str = unquote(facet_url_str)
-    except (ImportError, AttributeError):
-        # If unquote isn't available, use the strings as-is
-        pass
-
-    # Combine ALL text sources for searching
-    search_text = f"{post_text} {external_uri} {external_title} {external_description} {quoted_text} {quoted_uri} {facet_url_str} {mentions_str} {tags_str} {labels_str} {images_alt_text}"
-
-    return search_text
\ No newline at end of file
+    """Builds the lowercased text of every searchable field of a post, joined by spaces"""
+    return SearchText(record).text
@@ -0,0 +1,92 @@
+import multiprocessing
+import time
+
+from server import config
+
+# Fields of each bucket in the shared array
+_RATE, _TOKENS, _UPDATED, _DECREASED, _WAITING = range(5)
+_FIELDS = 5
+
+class RateLimiter:
+    """
+    Token buckets, one per table, shared by every process forked after the limiter was created: the
+    buckets live in shared memory under one lock. Each bucket's rate (write units per second) adapts
+    to DynamoDB with AIMD: it grows by config.WRITE_RATE_INCREASE after every write that was not
+    throttled, and halves (at most once per DECREASE_INTERVAL) when one was, so together the
+    workers settle just under the table's capacity instead of repeatedly running into it.
+    """
+    # Bursts of up to this many seconds' worth of tokens are let through at once
+    BURST_SECONDS = 1.0
+    # Throttles reported within this long of a decrease are taken to be from the same overload
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, names, initial_rate=None, min_rate=None, max_rate=None):
+        self.index = {name: i for i, name in enumerate(names)}
+        self.initial_rate = initial_rate or config.WRITE_RATE_INITIAL
+        self.min_rate = min_rate or config.WRITE_RATE_MIN
+        self.max_rate = max_rate or config.WRITE_RATE_MAX
+        self._lock = multiprocessing.Lock()
+        self._buckets = multiprocessing.RawArray('d', len(names) * _FIELDS)
+        now = time.time()
+        for i in range(len(names)):
+            self._buckets[i * _FIELDS + _RATE] = self.initial_rate
+            self._buckets[i * _FIELDS + _TOKENS] = self.initial_rate * self.BURST_SECONDS
+            self._buckets[i * _FIELDS + _UPDATED] = now
+
+    def _refill(self, base, now):
+        """Adds the tokens earned since the last update. Call with the lock held."""
+        buckets = self._buckets
+        rate = buckets[base + _RATE]
+        buckets[base + _TOKENS] = min(rate * self.BURST_SECONDS,
+                                      buckets[base + _TOKENS] + (now - buckets[base + _UPDATED]) * rate)
+        buckets[base + _UPDATED] = now
+
+    def acquire(self, name, units=1):
+        """Waits until the table's bucket has units tokens (a request larger than the burst waits for a full bucket)"""
+        base = self.index[name] * _FIELDS
+        buckets = self._buckets
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    self._refill(base, time.time())
+                    needed = min(units, buckets[base + _RATE] * self.BURST_SECONDS)
+                    if buckets[base + _TOKENS] >= needed:
+                        buckets[base + _TOKENS] -= units
+                        if waiting:
+                            buckets[base + _WAITING] -= units
+                        return
+                    if not waiting:
+                        buckets[base + _WAITING] += units
+                        waiting = True
+                    wait = (needed - buckets[base + _TOKENS]) / buckets[base + _RATE]
+                time.sleep(wait)
+        except BaseException:
+            if waiting:
+                with self._lock:
+                    buckets[base + _WAITING] -= units
+            raise
+
+    def succeeded(self, name):
+        """Additive increase, after a write that went through unthrottled"""
+        base = self.index[name] * _FIELDS
+        with self._lock:
+            self._buckets[base + _RATE] = min(self.max_rate, self._buckets[base + _RATE] + config.WRITE_RATE_INCREASE)
+
+    def throttled(self, name):
+        """Multiplicative decrease, after a throttled write or one with unprocessed items"""
+        base = self.index[name] * _FIELDS
+        now = time.time()
+        with self._lock:
+            if now - self._buckets[base + _DECREASED] < self.DECREASE_INTERVAL:
+                return
+            self._buckets[base + _DECREASED] = now
+            self._refill(base, now)
+            rate = self._buckets[base + _RATE] = max(self.min_rate, self._buckets[base + _RATE] / 2)
+            self._buckets[base + _TOKENS] = min(self._buckets[base + _TOKENS], rate * self.BURST_SECONDS)
+
+    def stats(self):
+        """{table: (current rate in units per second, units waiting for tokens)}, across all processes"""
+        with self._lock:
+            return {name: (self._buckets[i * _FIELDS + _RATE], self._buckets[i * _FIELDS + _WAITING])
+                    for name, i in self.index.items()}
@@ -0,0 +1,196 @@
+import fcntl
+import json
+import os
+import random
+import threading
+from decimal import Decimal
+from time import sleep, time
+
+from server import config
+from server.logger import logger
+
+# Writes that failed, appended to a log in config.RETRY_LOG_DIR and replayed by a drainer thread in
+# the main process, so that a storage outage costs neither data nor worker time. Every process
+# appends to its own file (<pid>.jsonl), one JSON entry per line:
+#   {"op": "put" | "delete" | "update", "table", "item" | "key" (+ "set" for updates, and "if_match"
+#    for conditional puts), "failed_at", "attempts", "next_at", "error"}
+# Every logged write is idempotent, so replaying an entry twice (e.g. after a crash mid-drain) makes
+# the same write twice. A replayed put lands after any write of the same key made since it failed,
+# though, so the replay must not undo a later delete: paper posts are put under the "if_match"
+# condition they were made with (a post marked deleted stays so), and puts of likes, reposts and
+# quote posts whose records were deleted since are dropped, or undone if the delete landed while
+# the put was made (see database_dynamo.replay_failed_write). The other tables' puts are replayed
+# unconditionally: the workers never delete tombstones or paper index entries, and unfollows leave
+# deletion marks that readers apply.
+#
+# The drainer claims a file by renaming it to <pid>.<time>.draining; writers hold an exclusive lock
+# while appending and reopen the file if it was renamed under them, so no entry is missed.
+
+LOG_SUFFIX = '.jsonl'
+DRAINING_SUFFIX = '.draining'
+
+# Backoff of an entry's replays: doubling from RETRY_BACKOFF_BASE up to config.RETRY_BACKOFF_MAX seconds
+RETRY_BACKOFF_BASE = 5.0
+
+# Entries replayed this many times without success are reported at every attempt
+REPORT_ATTEMPTS = 10
+
+_lock = threading.Lock()
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not serializable')
+
+def _log_path():
+    return os.path.join(config.RETRY_LOG_DIR, f'{os.getpid()}{LOG_SUFFIX}')
+
+def _append(entries):
+    """Appends entries to this process's log, and syncs it to disk"""
+    lines = ''.join(json.dumps(entry, default=_encode, separators=(',', ':')) + '\n' for entry in entries)
+    path = _log_path()
+    with _lock:
+        os.makedirs(config.RETRY_LOG_DIR, exist_ok=True)
+        while True:
+            with open(path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # the drainer may have claimed the file between the open and the lock
+                try:
+                    renamed = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+                except FileNotFoundError:
+                    renamed = True
+                if renamed:
+                    continue
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                return
+
+def _entry(op, table, error, **fields):
+    now = time()
+    return {'op': op, 'table': table, **fields, 'failed_at': now, 'attempts': 0, 'next_at': now, 'error': str(error)}
+
+def record_puts(table, items, error, if_match=None):
+    """Logs puts that failed; with if_match, puts made only if the stored item has those values"""
+    items = list(items)
+    if items:
+        condition = {'if_match': if_match} if if_match else {}
+        _append([_entry('put', table, error, item=item, **condition) for item in items])
+        logger.error(f"Logged {len(items)} failed writes to {table} for retry: {error}")
+
+def record_deletes(table, keys, error):
+    """Logs deletes that failed"""
+    keys = list(keys)
+    if keys:
+        _append([_entry('delete', table, error, key=key) for key in keys])
+        logger.error(f"Logged {len(keys)} failed deletes from {table} for retry: {error}")
+
+def record_update(table, key, set, error):
+    """Logs an update (SET of attributes only, which is idempotent) that failed"""
+    _append([_entry('update', table, error, key=key, set=set)])
+    logger.error(f"Logged failed update of {key} in {table} for retry: {error}")
+
+def record_requests(table, requests, error):
+    """Logs BatchWriteItem put and delete requests (and conditional puts, see BatchWriter) that were given up on"""
+    puts = [request for request in requests if 'PutRequest' in request]
+    record_puts(table, [request['PutRequest']['Item'] for request in puts if 'IfMatch' not in request], error)
+    for request in puts:
+        if 'IfMatch' in request:
+            record_puts(table, [request['PutRequest']['Item']], error, if_match=request['IfMatch'])
+    record_deletes(table, [request['DeleteRequest']['Key'] for request in requests if 'DeleteRequest' in request], error)
+
+def _read(path):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line, parse_float=Decimal))
+            except ValueError:
+                # a line cut short by a crash mid-append
+                logger.error(f"Skipping unreadable retry log line in {path}: {line[:200]!r}")
+    return entries
+
+def _claim():
+    """Renames the logs written so far for draining; returns every file waiting to be drained"""
+    if not os.path.isdir(config.RETRY_LOG_DIR):
+        return []
+    for name in os.listdir(config.RETRY_LOG_DIR):
+        if name.endswith(LOG_SUFFIX):
+            path = os.path.join(config.RETRY_LOG_DIR, name)
+            claimed = f'{path[:-len(LOG_SUFFIX)]}.{time():.6f}{DRAINING_SUFFIX}'
+            os.rename(path, claimed)
+            # waits for an append in progress, made before the rename
+            with open(claimed) as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+    return sorted(os.path.join(config.RETRY_LOG_DIR, name) for name in os.listdir(config.RETRY_LOG_DIR)
+                  if name.endswith(DRAINING_SUFFIX))
+
+def _backoff(attempts):
+    return random.uniform(0.5, 1.0) * min(config.RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempts)
+
+def drain(replay):
+    """
+    Replays the entries that are due, in the order they were logged, with replay(entry). After a
+    failure the remaining due entries wait for the failed one's backoff rather than hammer a store
+    that is down. Entries not replayed are logged again. Returns (replayed, pending).
+    """
+    replayed = pending = 0
+    retry_at = None
+    for path in _claim():
+        remaining = []
+        for entry in _read(path):
+            now = time()
+            if entry['next_at'] > now or (retry_at is not None and retry_at > now):
+                entry['next_at'] = max(entry['next_at'], retry_at or 0)
+                remaining.append(entry)
+                continue
+            try:
+                replay(entry)
+                replayed += 1
+            except Exception as e:
+                entry['attempts'] += 1
+                entry['error'] = str(e)
+                entry['next_at'] = retry_at = now + _backoff(entry['attempts'])
+                remaining.append(entry)
+                if entry['attempts'] >= REPORT_ATTEMPTS:
+                    logger.error(f"Write to {entry['table']} still failing after {entry['attempts']} attempts: {str(e)}")
+        if remaining:
+            _append(remaining)
+        pending += len(remaining)
+        # only removed once what is left of it is logged again
+        os.remove(path)
+    return replayed, pending
+
+def stats():
+    """(entries waiting to be replayed, age in seconds of the oldest failure), across all processes' logs"""
+    if not os.path.isdir(config.RETRY_LOG_DIR):
+        return 0, 0.0
+    n_entries, oldest = 0, None
+    for name in os.listdir(config.RETRY_LOG_DIR):
+        if name.endswith(LOG_SUFFIX) or name.endswith(DRAINING_SUFFIX):
+            try:
+                entries = _read(os.path.join(config.RETRY_LOG_DIR, name))
+            except FileNotFoundError:
+                continue
+            n_entries += len(entries)
+            oldest = min([oldest or time()] + [float(entry['failed_at']) for entry in entries])
+    return n_entries, (time() - oldest if oldest else 0.0)
+
+def start_drainer(replay):
+    """Starts the drainer thread: drains every config.RETRY_DRAIN_INTERVAL seconds, and reports the backlog"""
+    def drain_loop():
+        while True:
+            try:
+                replayed, pending = drain(replay)
+                if replayed or pending:
+                    n_entries, age = stats()
+                    logger.info(f"Retry log: replayed {replayed} writes; {n_entries} pending, oldest failed {age:.0f}s ago")
+            except Exception as e:
+                logger.error(f"Error draining the retry log: {str(e)}")
+            sleep(config.RETRY_DRAIN_INTERVAL)
+
+    thread = threading.Thread(target=drain_loop, name='retry-log-drainer', daemon=True)
+    thread.start()
+    return thread
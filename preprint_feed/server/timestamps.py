@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from time import time
+
+# Record timestamps (createdAt) are set by the client that wrote the record: they come as 'Z' or
+# '+00:00' or other offsets, with or without fractional seconds, and can be far in the future. Items
+# keep the raw value, and alongside it an integer key that sorts correctly: milliseconds since the
+# epoch, no later than when the record was indexed.
+#
+# This file is self-contained, and copied as is into the rec_gen Lambda (which sorts on these keys,
+# and computes them for items stored before they were): keep the copies identical.
+
+def parse_ms(created_at):
+    """Milliseconds since the epoch of an ISO 8601 timestamp (UTC if it has no offset), or None"""
+    if not isinstance(created_at, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(created_at.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def created_ts(created_at, indexed_ms=None):
+    """
+    The sort key of a record: its timestamp in epoch milliseconds, clamped to when it was indexed
+    (by default now). A missing or unreadable timestamp counts as the indexed time.
+    """
+    if indexed_ms is None:
+        indexed_ms = int(time() * 1000)
+    ms = parse_ms(created_at)
+    return indexed_ms if ms is None else min(ms, indexed_ms)
@@ -0,0 +1,189 @@
+import hashlib
+import math
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+from time import time
+
+from server import config
+from server.database import post_paper_keys
+from server.database_dynamo import store_trending
+from server.logger import logger
+
+# Trending paper posts and papers, counted in each worker process from the likes, reposts and quotes
+# of stored paper posts. Counts decay exponentially, one tracker per window (its half-life), and memory
+# is fixed whatever the event rate: a count-min sketch estimates the score of any post or paper, and a
+# space-saving summary keeps the TRENDING_TOP_K heaviest of each. Every TRENDING_PUBLISH_INTERVAL
+# seconds a worker publishes its ranked lists; the feed endpoint sums the lists of all workers, since
+# the firehose batches are spread over them.
+WINDOWS = {
+    'hour': 3600,
+    'day': 24 * 3600
+}
+
+# Score each interaction adds to the post it is with (and to its paper)
+INTERACTION_WEIGHTS = {
+    'like': 1.0,
+    'repost': 2.0,
+    'quote': 3.0
+}
+
+SKETCH_WIDTH = 1 << 14
+SKETCH_DEPTH = 4
+
+# Weights grow as 2^(age / half-life) (forward decay, so nothing has to be decayed per event);
+# all counts are scaled back down once the landmark is this many half-lives old
+RESCALE_AFTER_HALF_LIVES = 32
+
+def _hashes(key):
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+class CountMinSketch:
+    """Estimates (never under) the total weight added for a key, in SKETCH_DEPTH x SKETCH_WIDTH counters"""
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.counts = array('d', bytes(8 * width * depth))
+
+    def _cells(self, key):
+        first, step = _hashes(key)
+        return [row * self.width + (first + row * step) % self.width for row in range(self.depth)]
+
+    def add(self, key, weight):
+        """Adds weight to the key and returns its new estimate"""
+        counts = self.counts
+        estimate = math.inf
+        for cell in self._cells(key):
+            counts[cell] += weight
+            estimate = min(estimate, counts[cell])
+        return estimate
+
+    def estimate(self, key):
+        return min(self.counts[cell] for cell in self._cells(key))
+
+    def scale(self, factor):
+        counts = self.counts
+        for i in range(len(counts)):
+            counts[i] *= factor
+
+class SpaceSaving:
+    """
+    The heaviest keys (at most capacity of them): a new key takes the place of the lightest one,
+    inheriting its count as the error bound. Each entry also keeps the last payload seen with its key.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}  # key -> [count, error, payload]
+
+    def add(self, key, weight, payload=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                entry = self.entries[key] = [0.0, 0.0, None]
+            else:
+                lightest = min(self.entries, key=lambda k: self.entries[k][0])
+                floor = self.entries.pop(lightest)[0]
+                entry = self.entries[key] = [floor, floor, None]
+        entry[0] += weight
+        if payload is not None:
+            entry[2] = payload
+
+    def scale(self, factor):
+        for entry in self.entries.values():
+            entry[0] *= factor
+            entry[1] *= factor
+
+class DecayedTracker:
+    """Exponentially decayed scores of posts and papers over one window (half-life, in seconds)"""
+    def __init__(self, half_life, top_k):
+        self.half_life = half_life
+        self.landmark = time()
+        self.posts = SpaceSaving(top_k)
+        self.papers = SpaceSaving(top_k)
+        self.post_sketch = CountMinSketch()
+        self.paper_sketch = CountMinSketch()
+
+    def _weight(self, weight, now):
+        age = now - self.landmark
+        if age > RESCALE_AFTER_HALF_LIVES * self.half_life:
+            factor = 2.0 ** -(age / self.half_life)
+            for summary in (self.posts, self.papers, self.post_sketch, self.paper_sketch):
+                summary.scale(factor)
+            self.landmark = now
+            age = 0
+        return weight * 2.0 ** (age / self.half_life)
+
+    def add(self, post_uri, paper_key, weight, now):
+        weight = self._weight(weight, now)
+        self.post_sketch.add(post_uri, weight)
+        self.posts.add(post_uri, weight, payload=paper_key)
+        if paper_key:
+            self.paper_sketch.add(paper_key, weight)
+            self.papers.add(paper_key, weight, payload=post_uri)
+
+    def ranked(self, now, limit):
+        """
+        The current scores, highest first: posts as (post URI, score, paper key) and papers as
+        (paper key, score, post URI), where the post is the paper's highest scoring post
+        """
+        decay = 2.0 ** -((now - self.landmark) / self.half_life)
+
+        posts = sorted(((uri, min(count, self.post_sketch.estimate(uri)) * decay, paper_key)
+                        for uri, (count, _, paper_key) in self.posts.entries.items()),
+                       key=lambda post: post[1], reverse=True)[:limit]
+
+        best_posts = {}
+        for uri, _, paper_key in posts:
+            if paper_key:
+                best_posts.setdefault(paper_key, uri)
+        papers = sorted(((key, min(count, self.paper_sketch.estimate(key)) * decay, best_posts.get(key, last_uri))
+                         for key, (count, _, last_uri) in self.papers.entries.items()),
+                        key=lambda paper: paper[1], reverse=True)[:limit]
+        return posts, papers
+
+_trackers = None
+_last_publish = time()
+
+def _get_trackers():
+    global _trackers
+    if _trackers is None:
+        _trackers = {window: DecayedTracker(half_life, config.TRENDING_TOP_K) for window, half_life in WINDOWS.items()}
+    return _trackers
+
+def record(interactions):
+    """Counts a batch's stored likes, reposts and quotes, given as (post URI, kind) pairs"""
+    if not interactions:
+        return
+    paper_keys = post_paper_keys({post_uri for post_uri, _ in interactions})
+    now = time()
+    for tracker in _get_trackers().values():
+        for post_uri, kind in interactions:
+            tracker.add(post_uri, paper_keys.get(post_uri), INTERACTION_WEIGHTS[kind], now)
+
+def _score(score):
+    return Decimal(str(round(score, 4)))
+
+def publish(worker_id):
+    """Writes this worker's ranked posts and papers for every window"""
+    global _last_publish
+    _last_publish = now = time()
+    windows = {}
+    for window, tracker in _get_trackers().items():
+        posts, papers = tracker.ranked(now, config.TRENDING_TOP_K)
+        windows[window] = {
+            'half_life': tracker.half_life,
+            'posts': [[uri, _score(score), paper_key] for uri, score, paper_key in posts if score > 0],
+            'papers': [[key, _score(score), uri] for key, score, uri in papers if score > 0]
+        }
+    store_trending(worker_id, {
+        'published_at': Decimal(int(now)),
+        'generation_date': datetime.now(timezone.utc).isoformat(),
+        'windows': windows
+    })
+    logger.info(f'Worker {worker_id} published trending posts for {len(windows)} windows')
+
+def maybe_publish(worker_id):
+    """Called from the worker loop: publishes every TRENDING_PUBLISH_INTERVAL seconds"""
+    if time() - _last_publish >= config.TRENDING_PUBLISH_INTERVAL:
+        publish(worker_id)
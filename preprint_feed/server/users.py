@@ -0,0 +1,26 @@
+from time import time
+
+from server import config
+from server.database_dynamo import get_user_dids
+from server.interning import IdSet, get_interner
+from server.logger import logger
+
+# The users of the feeds, re-read from the users table every USERS_REFRESH_INTERVAL seconds, so
+# that each worker can drop the firehose records of everyone else with a set lookup. Held as their
+# interned IDs: a DID that was never interned (almost every firehose author) is rejected without
+# touching the set.
+_user_dids = None
+_loaded_at = None
+
+def user_dids():
+    """The DIDs of our users (an IdSet); if a refresh fails, the last ones read are kept"""
+    global _user_dids, _loaded_at
+    if _loaded_at is None or time() - _loaded_at >= config.USERS_REFRESH_INTERVAL:
+        if _user_dids is None:
+            _user_dids = IdSet(get_interner())
+        try:
+            _user_dids = IdSet(get_interner(), get_user_dids())
+        except Exception as e:
+            logger.error(f"Error reading the users table: {str(e)}")
+        _loaded_at = time()
+    return _user_dids
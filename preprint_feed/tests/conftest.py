@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the server package as the scripts do, from the preprint_feed directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
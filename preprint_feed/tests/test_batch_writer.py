@@ -0,0 +1,58 @@
+import threading
+import time
+
+from server.batch_writer import BatchWriter
+
+class FakeClient:
+    """Records the writes of BatchWriteItem calls; the first call waits until release is set"""
+    def __init__(self):
+        self.writes = []
+        self.first_call = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        with self._lock:
+            first = not self.first_call.is_set()
+            self.first_call.set()
+        if first:
+            assert self.release.wait(5)
+        for requests in RequestItems.values():
+            with self._lock:
+                self.writes.extend(('put', request['PutRequest']['Item']['at_uri']) if 'PutRequest' in request
+                                   else ('delete', request['DeleteRequest']['Key']['at_uri']) for request in requests)
+        return {}
+
+def writer_for(client):
+    return BatchWriter(client, lambda table_name: ['at_uri'], threads=4, deadline=0.01)
+
+def test_delete_waits_for_the_put_of_its_key_in_flight():
+    client = FakeClient()
+    writer = writer_for(client)
+    try:
+        writer.put('paper_posts', {'at_uri': 'p', 'text': 'x'})
+        assert client.first_call.wait(5)
+        writer.delete('paper_posts', {'at_uri': 'p'})
+        writer.put('paper_posts', {'at_uri': 'other'})
+        time.sleep(0.2)
+        # other keys are written meanwhile, while the delete stays buffered behind the put
+        assert client.writes == [('put', 'other')]
+        assert writer.backlog == 1
+        client.release.set()
+        writer.flush()
+        assert client.writes == [('put', 'other'), ('put', 'p'), ('delete', 'p')]
+    finally:
+        client.release.set()
+        writer.close()
+
+def test_buffered_writes_to_a_key_replace_each_other():
+    client = FakeClient()
+    client.first_call.set()
+    writer = BatchWriter(client, lambda table_name: ['at_uri'], threads=4, deadline=60)
+    try:
+        writer.put('paper_posts', {'at_uri': 'p'})
+        writer.delete('paper_posts', {'at_uri': 'p'})
+        writer.flush()
+        assert client.writes == [('delete', 'p')]
+    finally:
+        writer.close()
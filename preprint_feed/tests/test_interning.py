@@ -0,0 +1,40 @@
+import multiprocessing
+
+from server.interning import Interner
+
+fork = multiprocessing.get_context('fork')
+
+def dids(start, stop):
+    return [f'did:plc:{i:024d}' for i in range(start, stop)]
+
+def intern_in_child(path, strings):
+    Interner(path).intern_many(strings)
+
+def test_two_instances_on_one_file_agree(tmp_path):
+    path = str(tmp_path / 'interned.txt')
+    first, second = Interner(path), Interner(path)
+    a = first.intern_many(dids(0, 10))
+    # overlapping strings, some new to both: the second instance picks up the first one's appends
+    b = second.intern_many(dids(5, 15))
+    assert list(b[:5]) == list(a[5:])
+    assert first.intern_many(dids(10, 15)) == b[5:]
+    assert second[a[0]] == dids(0, 1)[0]
+    assert first.get(dids(14, 15)[0]) == b[-1]
+    assert Interner(path).intern_many(dids(0, 15)) == first.intern_many(dids(0, 15))
+
+def test_processes_interning_at_once_agree(tmp_path):
+    path = str(tmp_path / 'interned.txt')
+    processes = [fork.Process(target=intern_in_child, args=(path, dids(i * 50, i * 50 + 200))) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    # every string was appended once, and its ID is its line number for every instance
+    assert sorted(lines) == dids(0, 350)
+    interner = Interner(path)
+    assert list(interner.intern_many(lines)) == list(range(len(lines)))
+    assert len(interner) == 350
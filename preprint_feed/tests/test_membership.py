@@ -0,0 +1,62 @@
+import multiprocessing
+
+from server import database
+from server.membership import MembershipIndex, build_index, open_post_index
+
+# fork, as the workers are started: the children inherit the parent's open index
+fork = multiprocessing.get_context('fork')
+
+def uris(start, stop):
+    return [f'at://did:plc:author/app.bsky.feed.post/{i}' for i in range(start, stop)]
+
+def add_in_child(path, new_uris):
+    MembershipIndex(path).add(new_uris)
+
+def store_in_child(db_path, new_uris):
+    # stored in SQLite, but the process ends before adding them to the index
+    database.init_db(db_path)
+    database.store_post_uris(new_uris)
+    database.db.close()
+
+def run(target, *args):
+    process = fork.Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+def test_insert(tmp_path):
+    index = build_index(str(tmp_path / 'posts.idx'), [], capacity=64)
+    index.add(uris(0, 10), watermark=10)
+    assert all(uri in index for uri in uris(0, 10))
+    assert uris(10, 11)[0] not in index
+    assert index.stored_subset(uris(5, 15)) == set(uris(5, 10))
+    assert index.count == 10 and index.watermark == 10
+    index.add(uris(0, 5))
+    assert index.count == 10
+
+def test_grow_in_another_process_is_seen(tmp_path):
+    path = str(tmp_path / 'posts.idx')
+    index = build_index(path, [], capacity=16)
+    index.add(uris(0, 5))
+    # enough to grow the index several times over, from another process
+    run(add_in_child, path, uris(5, 200))
+    assert index.stored_subset(uris(0, 250)) == set(uris(0, 200))
+    assert index.capacity >= 200 / 0.7 and index.count == 200
+    # and this process writes into the grown file, where the other one sees it
+    index.add(uris(200, 210))
+    assert all(uri in MembershipIndex(path) for uri in uris(0, 210))
+
+def test_open_catches_up_with_posts_stored_by_another_process(tmp_path):
+    db_path, path = str(tmp_path / 'feed.db'), str(tmp_path / 'posts.idx')
+    database.init_db(db_path)
+    try:
+        rows = database.store_post_uris(uris(0, 10))
+        build_index(path, [(row.id, row.uri) for row in rows]).close()
+        database.db.close()
+
+        run(store_in_child, db_path, uris(10, 20))
+        index = open_post_index(path)
+        assert index.stored_subset(uris(0, 30)) == set(uris(0, 20))
+        assert index.watermark == 20
+    finally:
+        database.db.close()
@@ -0,0 +1,12 @@
+from server.paper_ids import extract_paper_keys
+
+def test_arxiv_doi_loses_version_suffix():
+    assert extract_paper_keys('https://doi.org/10.48550/arXiv.2401.01234v2') == ['arxiv:2401.01234']
+
+def test_arxiv_doi_and_url_give_one_key():
+    doi_keys = extract_paper_keys('https://doi.org/10.48550/arXiv.2401.01234v2')
+    url_keys = extract_paper_keys('https://arxiv.org/abs/2401.01234')
+    assert doi_keys == url_keys
+
+def test_old_style_arxiv_doi_loses_version_suffix():
+    assert extract_paper_keys('doi:10.48550/arXiv.hep-th/9901001v3') == ['arxiv:hep-th/9901001']
@@ -0,0 +1,30 @@
+import multiprocessing
+
+from server import config
+from server.rate_limiter import RateLimiter
+
+fork = multiprocessing.get_context('fork')
+
+def report(limiter, name, outcome, times):
+    for _ in range(times):
+        getattr(limiter, outcome)(name)
+
+def test_rate_grows_additively_and_halves_once_per_overload():
+    limiter = RateLimiter(['a', 'b'], initial_rate=100, min_rate=10, max_rate=1000)
+    report(limiter, 'a', 'succeeded', 3)
+    assert limiter.stats()['a'][0] == 100 + 3 * config.WRITE_RATE_INCREASE
+    limiter.throttled('a')
+    # throttles right after a decrease are the same overload
+    limiter.throttled('a')
+    assert limiter.stats()['a'][0] == (100 + 3 * config.WRITE_RATE_INCREASE) / 2
+    assert limiter.stats()['b'][0] == 100
+
+def test_buckets_are_shared_with_forked_processes():
+    limiter = RateLimiter(['a'], initial_rate=100, min_rate=10, max_rate=1000)
+    processes = [fork.Process(target=report, args=(limiter, 'a', 'succeeded', 10)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert limiter.stats()['a'][0] == 100 + 20 * config.WRITE_RATE_INCREASE
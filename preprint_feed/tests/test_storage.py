@@ -0,0 +1,82 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from server.storage import MemoryStorage, SQLiteStorage
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STORAGE_COPIES = ['PreprintFeedEndpoint', 'feed_postprocessor', 'rec_gen', 'rec_gen_sender']
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStorage()
+    return SQLiteStorage(str(tmp_path / 'storage.db'))
+
+def post(uri, **attributes):
+    return {'at_uri': uri, **attributes}
+
+@pytest.mark.parametrize('function', STORAGE_COPIES)
+def test_lambda_copy_is_identical(function):
+    with open(os.path.join(REPO_DIR, 'preprint_feed', 'server', 'storage.py'), 'rb') as f:
+        original = f.read()
+    with open(os.path.join(REPO_DIR, 'lambda_functions', function, 'storage.py'), 'rb') as f:
+        assert f.read() == original, f'lambda_functions/{function}/storage.py differs from preprint_feed/server/storage.py'
+
+def test_put_item_if_absent(storage):
+    assert storage.put_item('paper_posts', post('p', text='first'), if_absent=True)
+    assert not storage.put_item('paper_posts', post('p', text='second'), if_absent=True)
+    assert storage.get_item('paper_posts', {'at_uri': 'p'})['text'] == 'first'
+
+def test_put_item_if_match(storage):
+    # None stands for an absent attribute, as it is when there is no item
+    assert storage.put_item('paper_posts', post('p', version=1), if_match={'version': None})
+    assert not storage.put_item('paper_posts', post('p', version=2), if_match={'version': None})
+    assert not storage.put_item('paper_posts', post('p', version=2), if_match={'version': 5})
+    assert storage.put_item('paper_posts', post('p', version=2), if_match={'version': 1})
+    assert storage.get_item('paper_posts', {'at_uri': 'p'})['version'] == Decimal(2)
+
+def test_put_items_if_match_skips_items_that_do_not_match(storage):
+    storage.put_item('paper_posts', post('deleted', status='deleted'))
+    storage.put_items('paper_posts', [post('deleted', text='again'), post('new', text='new')], if_match={'status': None})
+    assert storage.get_item('paper_posts', {'at_uri': 'deleted'}) == post('deleted', status='deleted')
+    assert storage.get_item('paper_posts', {'at_uri': 'new'}) == post('new', text='new')
+
+def test_update_item_sets_adds_and_removes(storage):
+    storage.put_item('paper_posts', post('p', Tags=['a'], LikeCount=1, excluded_at='x'))
+    assert storage.update_item('paper_posts', {'at_uri': 'p'}, set={'Tags': ['b']}, add={'LikeCount': 2, 'QuoteCount': 1},
+                               remove=['excluded_at'])
+    assert storage.get_item('paper_posts', {'at_uri': 'p'}) == post('p', Tags=['b'], LikeCount=3, QuoteCount=1)
+
+def test_update_item_must_exist(storage):
+    assert not storage.update_item('paper_posts', {'at_uri': 'missing'}, add={'LikeCount': 1}, must_exist=True)
+    assert storage.get_item('paper_posts', {'at_uri': 'missing'}) is None
+    assert storage.update_item('paper_posts', {'at_uri': 'created'}, add={'LikeCount': 1})
+    assert storage.get_item('paper_posts', {'at_uri': 'created'}) == post('created', LikeCount=1)
+
+def test_update_item_unless(storage):
+    storage.put_item('paper_posts', post('deleted', status='deleted'))
+    storage.put_item('paper_posts', post('live'))
+    assert not storage.update_item('paper_posts', {'at_uri': 'deleted'}, set={'Tags': ['a']}, unless={'status': 'deleted'})
+    assert storage.update_item('paper_posts', {'at_uri': 'live'}, set={'Tags': ['a']}, unless={'status': 'deleted'})
+    assert 'Tags' not in storage.get_item('paper_posts', {'at_uri': 'deleted'})
+    assert storage.get_item('paper_posts', {'at_uri': 'live'})['Tags'] == ['a']
+
+def test_query_orders_by_sort_key(storage):
+    index = 'AuthorDID-CreatedDate-index'
+    for day in ('01', '03', '02'):
+        storage.put_item('paper_posts', post(f'p{day}', AuthorDID='did:a', CreatedDate=f'2025-01-{day}'))
+    storage.put_item('paper_posts', post('other', AuthorDID='did:b', CreatedDate='2025-01-04'))
+    assert [item['at_uri'] for item in storage.query('paper_posts', 'did:a', index=index)] == ['p01', 'p02', 'p03']
+    assert [item['at_uri'] for item in storage.query('paper_posts', 'did:a', index=index, newest_first=True)] == ['p03', 'p02', 'p01']
+    assert [item['at_uri'] for item in storage.query('paper_posts', 'did:a', index=index, after='2025-01-01')] == ['p02', 'p03']
+
+def test_query_limit_applies_before_exclude(storage):
+    index = 'AuthorDID-CreatedDate-index'
+    storage.put_item('paper_posts', post('old', AuthorDID='did:a', CreatedDate='2025-01-01'))
+    storage.put_item('paper_posts', post('new', AuthorDID='did:a', CreatedDate='2025-01-02', status='deleted'))
+    # as with DynamoDB, the limit counts the newest item before it is excluded
+    assert storage.query('paper_posts', 'did:a', index=index, limit=1, newest_first=True, exclude={'status': ['deleted']}) == []
+    assert [item['at_uri'] for item in storage.query('paper_posts', 'did:a', index=index, limit=2, newest_first=True,
+                                                     exclude={'status': ['deleted']})] == ['old']
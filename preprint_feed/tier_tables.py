@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Moves old items out of the tables that only grow: archives them to the columnar store written by
+# export_columnar.py, then sets their TTL attribute so that DynamoDB deletes them. Run from the
+# preprint_feed directory (needs pyarrow), e.g. daily after the export:
+#   python3 tier_tables.py --dry-run                   # count what would be tiered, write nothing
+#   python3 tier_tables.py --age-days 90               # tier items dated more than 90 days ago
+#   python3 tier_tables.py --tables recommendations --dormant-days 30
+#
+# What is tiered:
+#   - interactions, reposts, quoteposts, counterfactual_recs: items whose day (as exported, see
+#     EXPORT_TABLES) is more than --age-days ago
+#   - recommendations: the items of dormant users, whose last access (user_accesses_agg) is more than
+#     --dormant-days ago. The scheduled generation (rec_gen_sender, whose DORMANT_DAYS must equal
+#     --dormant-days) skips dormant users, so their tiered items keep the TTL attribute and expire. A
+#     returning user's access dispatches their generation, which writes items without it; once the
+#     items have expired, the user is served as a new one until then.
+#
+# Each table is read with a parallel segmented Scan. A segment archives the items it tiers into
+# <out-dir>/<table>/day=YYYY-MM-DD/tiered-<run>-<segment>-<n>.parquet, alongside the export's files,
+# and only once those files are written sets the items' TTL_ATTRIBUTE to --grace-days from now.
+# Tiered items are then left out of the export, and once a table is done the export's own files of
+# the days it tiered are removed. Their rows are not all in the tiered files: items deleted from the
+# table between the export and the run (e.g. unliked likes) are only in the export's files, so a
+# file's rows whose keys no tiered file of the day holds are first written to a tiered file of
+# their own. Every item is archived before it can expire; a run interrupted between writing a file
+# and setting the TTLs archives those items again in the next run, so readers should drop
+# duplicate keys.
+#
+# DynamoDB deletes expired items itself, once TTL is enabled on TTL_ATTRIBUTE:
+#   aws dynamodb update-time-to-live --table-name <table> --time-to-live-specification Enabled=true,AttributeName=expires_at
+# The SQLite and memory backends have no TTL, so with them the job deletes expired items itself.
+import argparse
+import multiprocessing
+import os
+from datetime import datetime, timedelta, timezone
+from time import perf_counter, time
+
+import export_columnar
+from export_columnar import (COMPRESSION, DEFAULT_OUT_DIR, EXPORT_TABLES, PART_PREFIX, ROWS_PER_FILE, SCAN_PAGE_SIZE,
+                             TTL_ATTRIBUTE, UNKNOWN_DAY, import_pyarrow, item_day, write_part)
+from server import config
+from server.storage import default_storage
+
+# Table -> (attribute holding the item's day, timestamp attribute whose date is used otherwise)
+TIER_TABLES = {
+    'interactions': EXPORT_TABLES['interactions'],
+    'reposts': EXPORT_TABLES['reposts'],
+    'quoteposts': EXPORT_TABLES['quoteposts'],
+    'counterfactual_recs': EXPORT_TABLES['counterfactual_recs'],
+    'recommendations': (None, 'generation_date')
+}
+
+# Tiered by their user's activity rather than their age
+USER_TIERED_TABLES = {'recommendations'}
+
+# Files written by this job, next to the export's PART_PREFIX files
+TIERED_PREFIX = 'tiered-'
+
+COUNTERS = ['read', 'tiered', 'expired', 'gone']
+
+def init_worker():
+    export_columnar.init_worker()
+
+def set_expiry(storage, table_name, items, expires_at, counts):
+    for item in items:
+        if storage.update_item(table_name, storage.item_key(table_name, item), set={TTL_ATTRIBUTE: expires_at}, must_exist=True):
+            counts['tiered'] += 1
+        else:
+            # deleted since it was read
+            counts['gone'] += 1
+
+def tier_segment(task):
+    """Archives and sets the expiry of one segment's items that are due; returns (table, segment, counts, days)"""
+    (table_name, segment, total_segments, cutoff_day, dormant_users, run_id, out_dir,
+     expires_at, delete_expired, dry_run) = task
+    storage = default_storage()
+    day_attribute, timestamp_attribute = TIER_TABLES[table_name]
+    counts = dict.fromkeys(COUNTERS, 0)
+    days = set()
+    pending = {}    # day -> items to archive
+    n_files = 0
+
+    def flush():
+        nonlocal n_files
+        for day, items in sorted(pending.items()):
+            if not dry_run:
+                write_part(items, os.path.join(out_dir, table_name, f'day={day}',
+                                               f'{TIERED_PREFIX}{run_id}-{segment:04d}-{n_files:04d}.parquet'))
+                n_files += 1
+                set_expiry(storage, table_name, items, expires_at, counts)
+            else:
+                counts['tiered'] += len(items)
+        pending.clear()
+
+    start = None
+    now = time()
+    while True:
+        items, start = storage.scan_page(table_name, start=start, limit=SCAN_PAGE_SIZE,
+                                         segment=segment, total_segments=total_segments)
+        expired = []
+        for item in items:
+            counts['read'] += 1
+            if TTL_ATTRIBUTE in item:
+                if delete_expired and item[TTL_ATTRIBUTE] <= now:
+                    expired.append(storage.item_key(table_name, item))
+                continue
+            day = item_day(item, day_attribute, timestamp_attribute)
+            if table_name in USER_TIERED_TABLES:
+                if item.get('user_did') not in dormant_users:
+                    continue
+            elif day == UNKNOWN_DAY or day > cutoff_day:
+                continue
+            pending.setdefault(day, []).append(item)
+            days.add(day)
+        if sum(len(day_items) for day_items in pending.values()) >= ROWS_PER_FILE:
+            flush()
+        if expired:
+            counts['expired'] += len(expired)
+            if not dry_run:
+                storage.delete_items(table_name, expired)
+                storage.flush()
+        if start is None:
+            break
+    flush()
+    return table_name, segment, counts, days
+
+def dormant_users(dormant_days):
+    """The users whose last access is more than dormant_days ago (not those never seen to access)"""
+    cutoff_day = (datetime.now(timezone.utc) - timedelta(days=dormant_days)).date().isoformat()
+    users = set()
+    for item in default_storage().scan('user_accesses_agg', attributes=['user_did', 'last_access']):
+        day = item_day(item, None, 'last_access')
+        if day != UNKNOWN_DAY and day <= cutoff_day:
+            users.add(item['user_did'])
+    return frozenset(users)
+
+def _keys(table, key_attributes):
+    return list(zip(*(table.column(attribute).to_pylist() for attribute in key_attributes)))
+
+def remove_exported_files(pyarrow, table_dir, days, key_attributes, run_id):
+    """
+    Removes the export's files of days that have been tiered, once their rows are all in tiered
+    files: rows whose keys are not (items deleted since they were exported) are archived first.
+    Returns the number of rows archived that way.
+    """
+    n_archived = 0
+    for day in days:
+        day_dir = os.path.join(table_dir, f'day={day}')
+        if not os.path.isdir(day_dir):
+            continue
+        file_names = sorted(os.listdir(day_dir))
+        archived = set()
+        for file_name in file_names:
+            if file_name.startswith(TIERED_PREFIX):
+                table = pyarrow.parquet.read_table(os.path.join(day_dir, file_name), columns=key_attributes)
+                archived.update(_keys(table, key_attributes))
+        n_files = 0
+        for file_name in file_names:
+            if not file_name.startswith(PART_PREFIX):
+                continue
+            path = os.path.join(day_dir, file_name)
+            table = pyarrow.parquet.read_table(path)
+            missing = [key not in archived for key in _keys(table, key_attributes)]
+            if any(missing):
+                # written as export_columnar.write_part writes, so a file is only seen once complete
+                name = f'{TIERED_PREFIX}{run_id}-export-{n_files:04d}.parquet'
+                partial = os.path.join(day_dir, '.' + name)
+                pyarrow.parquet.write_table(table.filter(pyarrow.array(missing)), partial, compression=COMPRESSION)
+                os.replace(partial, os.path.join(day_dir, name))
+                n_files += 1
+                n_archived += sum(missing)
+            os.remove(path)
+    return n_archived
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old items to the columnar store and let them expire from the tables')
+    parser.add_argument('--tables', nargs='+', choices=list(TIER_TABLES), default=list(TIER_TABLES), help='tables to tier')
+    parser.add_argument('--age-days', type=int, default=90, help='age (days) past which items are tiered')
+    parser.add_argument('--dormant-days', type=int, default=30, help='days since their last access after which users\' recommendations are tiered')
+    parser.add_argument('--grace-days', type=float, default=1, help='days between archiving an item and its expiry')
+    parser.add_argument('--out-dir', default=DEFAULT_OUT_DIR, help='the columnar store (as written by export_columnar.py)')
+    parser.add_argument('--segments', type=int, default=32, help='parallel scan segments per table')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='count what would be tiered, but write nothing')
+    args = parser.parse_args()
+
+    pyarrow = import_pyarrow()
+    now = datetime.now(timezone.utc)
+    run_id = now.strftime('%Y%m%dT%H%M%S')
+    cutoff_day = (now - timedelta(days=args.age_days)).date().isoformat()
+    expires_at = int(now.timestamp() + args.grace_days * 86400)
+    delete_expired = config.STORAGE_BACKEND != 'dynamodb'
+    users = dormant_users(args.dormant_days) if USER_TIERED_TABLES.intersection(args.tables) else frozenset()
+
+    # spawn rather than fork, so every worker creates its own DynamoDB client
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes, initializer=init_worker) as pool:
+        for table_name in args.tables:
+            tasks = [(table_name, segment, args.segments, cutoff_day, users, run_id, args.out_dir,
+                      expires_at, delete_expired, args.dry_run) for segment in range(args.segments)]
+            totals = dict.fromkeys(COUNTERS, 0)
+            days = set()
+            start = perf_counter()
+            for n_done, (_, segment, counts, segment_days) in enumerate(pool.imap_unordered(tier_segment, tasks), start=1):
+                for counter in COUNTERS:
+                    totals[counter] += counts[counter]
+                days |= segment_days
+                print(f'[{table_name} {n_done}/{len(tasks)}] segment {segment}: tiered {counts["tiered"]} of {counts["read"]}; '
+                      f'total {totals["tiered"]} in {perf_counter() - start:.0f}s', flush=True)
+
+            if table_name in EXPORT_TABLES and not args.dry_run:
+                n_kept = remove_exported_files(pyarrow, os.path.join(args.out_dir, table_name), days,
+                                               default_storage().key_attributes(table_name), run_id)
+                if n_kept:
+                    print(f'Archived {n_kept} exported {table_name} rows no longer in the table', flush=True)
+            summary = ', '.join(f'{counter} {totals[counter]}' for counter in COUNTERS)
+            print(f'{"Dry run of" if args.dry_run else "Tiered"} {table_name} '
+                  f'({f"{len(users)} dormant users" if table_name in USER_TIERED_TABLES else "through " + cutoff_day}): {summary}')
+
+
+if __name__ == '__main__':
+    main()